@@ -20,4 +20,4 @@ __version__ = '0.0.46'
 
 # do not change this line manually
 # this is managed by shell/make-proto.sh and updated on every execution
-__proto_version__ = '0.0.10'
+__proto_version__ = '0.0.15'
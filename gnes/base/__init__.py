@@ -245,18 +245,31 @@ class TrainableBase(metaclass=TrainableType):
         pass
 
     @profiling
-    def dump(self, filename: str = None) -> None:
+    def dump(self, filename: str = None) -> int:
         """
         Serialize the object to a binary file
 
         :param filename: file path of the serialized file, if not given then :py:attr:`dump_full_path` is used
+        :return: the number of bytes written
         """
         f = filename or self.dump_full_path
         if not f:
             f = tempfile.NamedTemporaryFile('w', delete=False, dir=os.environ.get('GNES_VOLUME', None)).name
-        with open(f, 'wb') as fp:
-            pickle.dump(self, fp)
+        # write to a temp file then rename, so that "f" is never left half-written
+        with tempfile.NamedTemporaryFile('wb', delete=False, dir=os.path.dirname(os.path.abspath(f)),
+                                         prefix=os.path.basename(f), suffix='.tmp') as fp:
+            try:
+                pickle.dump(self, fp)
+            except Exception:
+                os.remove(fp.name)
+                raise
+        # a temp file is created with 0600, give the dump the usual permissions of a new file
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(fp.name, 0o666 & ~umask)
+        os.replace(fp.name, f)
         self.logger.critical('model is serialized to %s' % f)
+        return os.path.getsize(f)
 
     @profiling
     def dump_yaml(self, filename: str = None) -> None:
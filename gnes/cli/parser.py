@@ -180,6 +180,12 @@ def set_service_parser(parser=None):
     parser.add_argument('--dump_interval', type=int, default=5,
                         help='serialize the model in the service every n seconds if model changes. '
                              '-1 means --read_only. ')
+    parser.add_argument('--async_dump', action=ActionNoYes, default=False,
+                        help='dump the model in a forked background process, '
+                             'so that the service keeps handling messages while dumping')
+    parser.add_argument('--dump_timeout', type=int, default=600,
+                        help='kill the background dump if it is not finished in n seconds, '
+                             'then dump synchronously')
     parser.add_argument('--read_only', action='store_true', default=False,
                         help='do not allow the service to modify the model, '
                              'dump_interval will be ignored')
@@ -192,6 +198,13 @@ def set_service_parser(parser=None):
     parser.add_argument('--parallel_type', '--replica_type', type=ParallelType.from_string, choices=list(ParallelType),
                         default=ParallelType.PUSH_NONBLOCK,
                         help='parallel type of the concurrent services')
+    parser.add_argument('--pipeline_workers', type=int, default=0,
+                        help='run the event loop as a pipeline, with one thread receiving, '
+                             'this number of threads handling and one thread sending the messages. '
+                             '0 for the single-thread event loop, '
+                             'more than 1 only if the service has thread-safe handlers')
+    parser.add_argument('--pipeline_queue_size', type=int, default=10,
+                        help='max number of messages waiting between two pipeline stages')
     parser.add_argument('--check_version', action=ActionNoYes, default=True,
                         help='comparing the GNES and proto version of incoming message with local setup, '
                              'mismatch raise an exception')
@@ -248,8 +261,28 @@ def _set_sortable_service_parser(parser=None):
     return parser
 
 
-# shortcut to keep consistent
-set_encoder_parser = _set_loadable_service_parser
+def set_encoder_parser(parser=None):
+    if not parser:
+        parser = set_base_parser()
+    _set_loadable_service_parser(parser)
+
+    parser.add_argument('--pack_embedding', action=ActionNoYes, default=False,
+                        help='store the chunk embeddings of a document in one packed array, '
+                             'instead of one array per chunk')
+    parser.add_argument('--max_batch_size', type=int, default=0,
+                        help='hold back the incoming index/query messages and encode their chunks in one batch, '
+                             'once the batch reaches this number of chunks. 0 for encoding each message on its own')
+    parser.add_argument('--max_wait_ms', type=int, default=10,
+                        help='the longest time (ms) a message can be held back for batching')
+    parser.add_argument('--embed_cache_size', type=int, default=0,
+                        help='size (in MB) of the in-memory LRU cache of the chunk embeddings, keyed on '
+                             'the hash of the chunk content, so that a repeated content is not encoded again. '
+                             '0 means no cache')
+    parser.add_argument('--embed_cache_path', type=str, default=None,
+                        help='directory that keeps all cached embeddings on disk, behind the in-memory cache. '
+                             'every encoder writes into its own sub-directory, which is cleared when '
+                             'the encoder is trained, remove it by hand when the encoder model changes otherwise')
+    return parser
 
 
 def set_preprocessor_parser(parser=None):
@@ -282,6 +315,10 @@ def set_router_parser(parser=None):
 
     parser.add_argument('--num_part', type=int, default=None,
                         help='explicitly set the number of parts of message')
+    parser.add_argument('--reduce_timeout', type=int, default=0,
+                        help='time (in ms) to wait for all parts of a message since its first part arrives, '
+                             'after that the received parts are reduced and sent out as a partial result, '
+                             'the late parts are dropped. 0 means waiting forever')
     parser.set_defaults(read_only=True)
     return parser
 
@@ -293,6 +330,16 @@ def set_indexer_parser(parser=None):
     parser.add_argument('--as_response', type=ActionNoYes, default=True,
                         help='convert the message type from request to response after indexing. '
                              'turn it off if you want to chain other services after this index service.')
+    parser.add_argument('--explain_score', action=ActionNoYes, default=False,
+                        help='build the explanation of the score of every search result, '
+                             'regardless of whether the query asks for it. '
+                             'this is slow, turn it on only for debugging the score functions')
+    parser.add_argument('--result_cache_size', type=int, default=0,
+                        help='size (in MB) of the LRU cache of the chunk search results, '
+                             'keyed on the query embeddings and top_k. the cache is dropped on every index. '
+                             '0 means no cache')
+    parser.add_argument('--result_cache_ttl', type=float, default=0,
+                        help='seconds before a cached search result expires, 0 means never')
 
     return parser
 
@@ -356,6 +403,9 @@ def set_frontend_parser(parser=None):
                         help='dumping route information to a file')
     parser.add_argument('--max_pending_request', type=int, default=100,
                         help='maximum number of pending requests allowed, when exceed wait until we receive the response')
+    parser.add_argument('--explain_score', action=ActionNoYes, default=False,
+                        help='ask every query for the explanation of the scores, '
+                             'otherwise only the queries setting "explain" get it')
     return parser
 
 
@@ -17,7 +17,7 @@
 import numpy as np
 
 from ..base import BaseNumericEncoder
-from ...helper import batching, train_required
+from ...helper import batching, train_required, centroid_norms, nearest_centroids
 
 
 class HashEncoder(BaseNumericEncoder):
@@ -37,6 +37,7 @@ class HashEncoder(BaseNumericEncoder):
         self.kmeans_clusters = kmeans_clusters
         self.method = method
         self.centroids = None
+        self.centroid_norms = None
         self.x = None
         self.vec_dim = None
         self.hash_cores = None
@@ -48,6 +49,7 @@ class HashEncoder(BaseNumericEncoder):
         self.centroids = [self.train_kmeans(vecs) for _ in range(self.num_idx)]
         self.centroids = np.reshape(
             self.centroids, [1, self.num_idx, self.kmeans_clusters, self.vec_dim]).astype(np.float32)
+        self.centroid_norms = centroid_norms(self.centroids[0])
 
         if self.vec_dim % self.num_bytes != 0:
             raise ValueError('vec dim should be divided by x')
@@ -69,9 +71,11 @@ class HashEncoder(BaseNumericEncoder):
         return centroids
 
     def pred_kmeans(self, vecs):
-        vecs = np.reshape(vecs, [vecs.shape[0], 1, 1, vecs.shape[1]])
-        dist = np.sum(np.square(vecs - self.centroids), -1)
-        return np.argmax(-dist, axis=-1).astype(np.uint32)
+        if getattr(self, 'centroid_norms', None) is None:
+            self.centroid_norms = centroid_norms(self.centroids[0])
+        # every set of centroids is compared with the whole vector
+        vecs = np.reshape(vecs, [vecs.shape[0], 1, vecs.shape[1]])
+        return nearest_centroids(vecs, self.centroids[0], self.centroid_norms, dtype=np.uint32)
 
     def ran_gen(self):
         self.logger.info('hash functions with %s' % self.method)
@@ -120,6 +124,7 @@ class HashEncoder(BaseNumericEncoder):
         self.num_idx = x.num_idx
         self.kmeans_clusters = x.kmeans_clusters
         self.centroids = x.centroids
+        self.centroid_norms = getattr(x, 'centroid_norms', None)
         self.method = x.method
         self.x = x.x
         self.vec_dim = x.vec_dim
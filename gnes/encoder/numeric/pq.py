@@ -17,7 +17,7 @@
 import numpy as np
 
 from ..base import BaseBinaryEncoder
-from ...helper import batching, train_required
+from ...helper import batching, train_required, centroid_norms, nearest_centroids
 
 
 class PQEncoder(BaseBinaryEncoder):
@@ -29,6 +29,7 @@ class PQEncoder(BaseBinaryEncoder):
         self.num_bytes = num_bytes
         self.num_clusters = cluster_per_byte
         self.centroids = None
+        self.centroid_norms = None
 
     def train(self, vecs: np.ndarray, *args, **kwargs):
         import faiss
@@ -47,18 +48,19 @@ class PQEncoder(BaseBinaryEncoder):
         self.centroids = np.reshape(centroids, [1, self.num_bytes,
                                                 self.num_clusters,
                                                 dim_per_byte])
+        self.centroid_norms = centroid_norms(self.centroids[0])
 
     @train_required
     @batching
     def encode(self, vecs: np.ndarray, *args, **kwargs) -> np.ndarray:
         dim_per_byte = self._get_dim_per_byte(vecs)
 
-        x = np.reshape(vecs, [vecs.shape[0], self.num_bytes, 1, dim_per_byte])
-        x = np.sum(np.square(x - self.centroids), -1)
-        # start from 1
-        x = np.argmax(-x, 2) + 1
+        if getattr(self, 'centroid_norms', None) is None:
+            self.centroid_norms = centroid_norms(self.centroids[0])
 
-        return np.array(x, dtype=np.uint8)
+        x = np.reshape(vecs, [vecs.shape[0], self.num_bytes, dim_per_byte])
+        # start from 1
+        return nearest_centroids(x, self.centroids[0], self.centroid_norms, offset=1, dtype=np.uint8)
 
     def _get_dim_per_byte(self, vecs: np.ndarray):
         num_dim = vecs.shape[1]
@@ -71,4 +73,5 @@ class PQEncoder(BaseBinaryEncoder):
         self.num_bytes = x.num_bytes
         self.num_clusters = x.num_clusters
         self.centroids = x.centroids
+        self.centroid_norms = getattr(x, 'centroid_norms', None)
         self.is_trained = x.is_trained
@@ -14,21 +14,68 @@
 #  limitations under the License.
 
 
+from typing import List, Union
+
 import numpy as np
 
 from ..base import BaseNumericEncoder
 from ...helper import batching, train_required
 
 
+def vlad_pool(frames: np.ndarray, offsets: np.ndarray, centroids: np.ndarray, assignment: np.ndarray,
+              intra_norm: bool = False, power_norm: bool = False) -> np.ndarray:
+    """
+    Aggregate the frames of every chunk into a VLAD vector
+
+    :param frames: [num_frames, dim], the frames of all chunks concatenated
+    :param offsets: [num_chunks + 1], the frames of the j-th chunk are ``frames[offsets[j]:offsets[j+1]]``
+    :param centroids: [num_clusters, dim]
+    :param assignment: [num_frames], the nearest centroid of every frame
+    :param intra_norm: l2-normalize the residuals of every cluster before the global normalization
+    :param power_norm: apply the signed square root before the global normalization
+    :return: [num_chunks, num_clusters * dim], l2-normalized
+    """
+    num_chunks, (num_clusters, dim) = len(offsets) - 1, centroids.shape
+    # sum of residuals = sum of the assigned frames - number of assigned frames * centroid,
+    # the frames of all chunks are summed up in one pass over the frames sorted by (chunk, cluster)
+    bins = np.repeat(np.arange(num_chunks) * num_clusters, np.diff(offsets)) + assignment
+    counts = np.bincount(bins, minlength=num_chunks * num_clusters)
+    res = np.zeros([num_chunks * num_clusters, dim], dtype=np.float64)
+    if len(bins):
+        non_empty = counts > 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[non_empty]
+        res[non_empty] = np.add.reduceat(frames[np.argsort(bins, kind='stable')].astype(np.float64), starts, axis=0)
+    res = res.reshape([num_chunks, num_clusters, dim])
+    counts = counts.reshape([num_chunks, num_clusters, 1])
+    res -= counts * centroids.astype(np.float64)
+    if intra_norm:
+        res /= np.maximum(np.linalg.norm(res, axis=-1, keepdims=True), np.finfo(res.dtype).tiny)
+    res = res.reshape([num_chunks, -1])
+    if power_norm:
+        res = np.sign(res) * np.sqrt(np.abs(res))
+    res /= np.maximum(np.linalg.norm(res, axis=-1, keepdims=True), np.finfo(res.dtype).tiny)
+    return res
+
+
 class VladEncoder(BaseNumericEncoder):
     batch_size = 2048
 
     def __init__(self, num_clusters: int,
                  using_faiss_pred: bool = False,
+                 intra_norm: bool = False,
+                 power_norm: bool = False,
                  *args, **kwargs):
+        """
+        :param num_clusters: number of the centroids
+        :param using_faiss_pred: assign the frames to the centroids by faiss
+        :param intra_norm: l2-normalize the residuals of every cluster before the global normalization
+        :param power_norm: apply the signed square root before the global normalization
+        """
         super().__init__(*args, **kwargs)
         self.num_clusters = num_clusters
         self.using_faiss_pred = using_faiss_pred
+        self.intra_norm = intra_norm
+        self.power_norm = power_norm
         self.centroids = None
         self.index_flat = None
 
@@ -36,8 +83,11 @@ class VladEncoder(BaseNumericEncoder):
         import faiss
         kmeans = faiss.Kmeans(vecs.shape[1], self.num_clusters, niter=5, verbose=False)
         kmeans.train(vecs)
-        self.centroids = kmeans.centroids
-        self.centroids_l2 = np.sum(self.centroids**2, axis=1).reshape([1, -1])
+        self.set_centroids(kmeans.centroids)
+
+    def set_centroids(self, centroids: np.ndarray):
+        self.centroids = centroids
+        self.centroids_l2 = np.sum(self.centroids ** 2, axis=1).reshape([1, -1])
         self.centroids_trans = np.transpose(self.centroids)
         if self.using_faiss_pred:
             self.faiss_index()
@@ -54,7 +104,7 @@ class VladEncoder(BaseNumericEncoder):
         else:
             vecs_l2 = np.sum(vecs**2, axis=1).reshape([-1, 1])
             dist = vecs_l2 + self.centroids_l2 - 2 * np.matmul(vecs, self.centroids_trans)
-            return np.argmax(dist, axis=-1).reshape([-1]).astype(np.int32)
+            return np.argmin(dist, axis=-1).reshape([-1]).astype(np.int32)
 
     @batching
     def train(self, vecs: np.ndarray, *args, **kwargs):
@@ -64,28 +114,27 @@ class VladEncoder(BaseNumericEncoder):
 
     @train_required
     @batching
-    def encode(self, vecs: np.ndarray, *args, **kwargs) -> np.ndarray:
-        knn_output = [self.kmeans_pred(vecs_) for vecs_ in vecs]
-
-        output = []
-        for chunk_count, chunk in enumerate(vecs):
-            res = np.zeros((self.centroids.shape[0], self.centroids.shape[1]))
-            for frame_count, frame in enumerate(chunk):
-                center_index = knn_output[chunk_count][frame_count]
-                res[center_index] += (frame - self.centroids[center_index])
-            res = res.reshape([-1])
-            output.append(res / np.sum(res**2)**0.5)
-
-        return np.array(output, dtype=np.float32)
+    def encode(self, vecs: Union[np.ndarray, List[np.ndarray]], *args, **kwargs) -> np.ndarray:
+        """
+        :param vecs: [num_chunks, num_frames, dim], or a list of [num_frames, dim] arrays when the chunks
+                have different number of frames
+        """
+        if isinstance(vecs, np.ndarray):
+            frames = vecs.reshape([-1, vecs.shape[-1]])
+            offsets = np.arange(0, vecs.shape[0] + 1) * vecs.shape[1]
+        else:
+            frames = np.concatenate(vecs)
+            offsets = np.cumsum([0] + [len(v) for v in vecs])
+        # the frames of all chunks are assigned in one batch
+        return vlad_pool(frames, offsets, self.centroids, self.kmeans_pred(frames),
+                         getattr(self, 'intra_norm', False), getattr(self, 'power_norm', False)).astype(np.float32)
 
     def _copy_from(self, x: 'VladEncoder') -> None:
         self.num_clusters = x.num_clusters
-        self.centroids = x.centroids
-        self.centroids_l2 = x.centroids_l2
-        self.centroids_trans = np.transpose(self.centroids)
         self.using_faiss_pred = x.using_faiss_pred
-        if self.using_faiss_pred:
-            self.faiss_index()
+        self.intra_norm = getattr(x, 'intra_norm', False)
+        self.power_norm = getattr(x, 'power_norm', False)
+        self.set_centroids(x.centroids)
 
     def __setstate__(self, state):
         super().__setstate__(state)
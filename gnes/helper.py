@@ -20,6 +20,7 @@ import os
 import sys
 import threading
 import time
+from collections import OrderedDict
 from copy import copy
 from functools import wraps
 from itertools import islice
@@ -42,7 +43,8 @@ __all__ = ['get_sys_info', 'get_optimal_sample_size',
            'profile_logger', 'load_contrib_module',
            'parse_arg', 'profiling', 'FileLock',
            'train_required', 'get_first_available_gpu',
-           'PathImporter', 'progressbar', 'Singleton']
+           'PathImporter', 'progressbar', 'Singleton', 'LRUCache',
+           'centroid_norms', 'nearest_centroids', 'adc_table', 'kmeans']
 
 
 class Singleton:
@@ -317,6 +319,77 @@ class TimeContext:
             print(colored('    [%3.3f secs]' % self.duration, 'green'), flush=True)
 
 
+class LRUCache:
+    """
+    A thread-safe LRU cache bounded by the total size of its values,
+    the entries optionally expire ``ttl`` seconds after they are put
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = 0, size_fn: Callable[[Any], int] = len):
+        """
+        :param max_bytes: upper bound of the total size of the values, the least recently used ones are evicted first
+        :param ttl: seconds before an entry expires, 0 means never
+        :param size_fn: returns the size (in bytes) of a value
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_fn = size_fn
+        self.num_bytes = 0
+        self.num_hit = 0
+        self.num_miss = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl and item[2] < time.perf_counter():
+                self._pop(key)
+                item = None
+            if item is None:
+                self.num_miss += 1
+                return default
+            self._data.move_to_end(key)
+            self.num_hit += 1
+            return item[0]
+
+    def put(self, key, value) -> None:
+        size = self.size_fn(value)
+        with self._lock:
+            self._pop(key)
+            if size > self.max_bytes:
+                # never fits, do not flush the whole cache for it
+                return
+            self._data[key] = (value, size, time.perf_counter() + self.ttl)
+            self.num_bytes += size
+            while self.num_bytes > self.max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key) -> None:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.num_bytes -= item[1]
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.num_bytes = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.num_hit / max(1, self.num_hit + self.num_miss)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
 class Tokenizer:
     def __init__(self, dict_path: str = None):
         import jieba
@@ -410,6 +483,108 @@ def pooling_torch(data_tensor, mask_tensor, pooling_strategy):
     return output_tensor
 
 
+# upper bound of the number of elements in a [vector, cluster] distance tile of one sub-space
+_MAX_CENTROID_TILE_ELEMENTS = 1 << 22
+
+
+def centroid_norms(centroids: np.ndarray) -> np.ndarray:
+    """
+    Squared l2-norms of the centroids, precompute them once for :py:func:`nearest_centroids`
+
+    :param centroids: [num_sub, num_clusters, dim_per_sub]
+    :return: [num_sub, num_clusters]
+    """
+    return np.einsum('ijk,ijk->ij', centroids, centroids)
+
+
+def nearest_centroids(x: np.ndarray, centroids: np.ndarray, norms: np.ndarray = None,
+                      out: np.ndarray = None, offset: int = 0, dtype=np.uint32) -> np.ndarray:
+    """
+    Assign every sub-vector to its nearest centroid (in l2) of the same sub-space.
+    The distance is computed as ``||c||^2 - 2xc`` via matmul, as ``||x||^2`` does not change the argmin,
+    and vectors are scored in tiles so that the peak memory does not grow with the number of clusters.
+
+    :param x: [num_vecs, num_sub, dim_per_sub], or [num_vecs, 1, dim] to compare the whole vector
+            with the centroids of every sub-space
+    :param centroids: [num_sub, num_clusters, dim_per_sub]
+    :param norms: precomputed :py:func:`centroid_norms` of ``centroids``
+    :param out: [num_vecs, num_sub] preallocated code buffer, the codes are written into it
+    :param offset: added to the codes, e.g. 1 when 0 is reserved
+    :param dtype: dtype of the code buffer when ``out`` is not given
+    :return: the code buffer ``out``
+    """
+    num_vecs, num_sub, num_clusters = x.shape[0], centroids.shape[0], centroids.shape[1]
+    if x.shape[1] not in {1, num_sub}:
+        raise ValueError('can not assign %d sub-vectors to %d sub-spaces' % (x.shape[1], num_sub))
+    if norms is None:
+        norms = centroid_norms(centroids)
+    if out is None:
+        out = np.empty([num_vecs, num_sub], dtype=dtype)
+    x = x.astype(centroids.dtype, copy=False)
+    step = max(1, _MAX_CENTROID_TILE_ELEMENTS // max(1, num_clusters))
+    for j in range(0, num_vecs, step):
+        for s in range(num_sub):
+            dist = np.matmul(x[j:(j + step), min(s, x.shape[1] - 1)], centroids[s].T)
+            dist *= -2
+            dist += norms[s]
+            np.add(np.argmin(dist, axis=1), offset, out=out[j:(j + step), s], casting='unsafe')
+    return out
+
+
+def adc_table(queries: np.ndarray, centroids: np.ndarray, norms: np.ndarray = None) -> np.ndarray:
+    """
+    Lookup table for the asymmetric distance computation (ADC) of product quantization:
+    the squared l2 distance between the sub-vectors of every query and every centroid of the same sub-space.
+    The distance between a query and a code ``c`` is then ``table[q, range(num_sub), c].sum()``.
+
+    :param queries: [num_queries, num_sub * dim_per_sub]
+    :param centroids: [num_sub, num_clusters, dim_per_sub]
+    :param norms: precomputed :py:func:`centroid_norms` of ``centroids``
+    :return: [num_queries, num_sub, num_clusters]
+    """
+    num_sub, dim_per_sub = centroids.shape[0], centroids.shape[2]
+    q = np.reshape(queries, [queries.shape[0], num_sub, dim_per_sub]).astype(centroids.dtype, copy=False)
+    if norms is None:
+        norms = centroid_norms(centroids)
+    table = np.matmul(q.transpose(1, 0, 2), centroids.transpose(0, 2, 1)).transpose(1, 0, 2)
+    table *= -2
+    table += norms
+    table += np.expand_dims(np.einsum('qsd,qsd->qs', q, q), -1)
+    return np.ascontiguousarray(np.maximum(table, 0, out=table))
+
+
+def kmeans(vecs: np.ndarray, num_clusters: int, num_iter: int = 20, seed: int = None) -> np.ndarray:
+    """
+    Lloyd's k-means in l2, initialized with randomly sampled vectors.
+    An emptied cluster is re-seeded with a random vector.
+
+    :param vecs: [num_vecs, dim]
+    :param num_clusters: number of clusters, must not exceed ``num_vecs``
+    :param num_iter: number of iterations
+    :param seed: seed of the random sampling
+    :return: [num_clusters, dim] float32 centroids
+    """
+    if num_clusters > vecs.shape[0]:
+        raise ValueError('can not train %d clusters on %d vectors' % (num_clusters, vecs.shape[0]))
+    rng = np.random.RandomState(seed)
+    vecs = vecs.astype(np.float32, copy=False)
+    centroids = vecs[rng.choice(vecs.shape[0], num_clusters, replace=False)].copy()
+    x = np.expand_dims(vecs, 1)
+    for _ in range(num_iter):
+        assignment = nearest_centroids(x, np.expand_dims(centroids, 0), dtype=np.int64)[:, 0]
+        counts = np.bincount(assignment, minlength=num_clusters)
+        non_empty = counts > 0
+        # sum up the vectors of every cluster in one pass over the sorted assignment
+        order = np.argsort(assignment, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[non_empty]
+        sums = np.add.reduceat(vecs[order].astype(np.float64), starts, axis=0)
+        centroids[non_empty] = sums / counts[non_empty, None]
+        num_empty = num_clusters - np.count_nonzero(non_empty)
+        if num_empty:
+            centroids[~non_empty] = vecs[rng.choice(vecs.shape[0], num_empty, replace=False)]
+    return centroids
+
+
 def batching(func: Callable[[Any], np.ndarray] = None, *,
              batch_size: Union[int, Callable] = None, num_batch=None,
              iter_axis: int = 0, concat_axis: int = 0, chunk_dim=-1):
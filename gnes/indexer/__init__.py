@@ -23,6 +23,9 @@ _cls2file_map = {
     'RocksDBIndexer': 'doc.rocksdb',
     'AsyncLVDBIndexer': 'doc.leveldb',
     'NumpyIndexer': 'chunk.numpy',
+    'MmapIndexer': 'chunk.memmap',
+    'PQIndexer': 'chunk.pq',
+    'HNSWIndexer': 'chunk.hnsw',
     'BIndexer': 'chunk.bindexer',
     'HBIndexer': 'chunk.hbindexer',
     'JointIndexer': 'base',
@@ -35,6 +38,7 @@ _cls2file_map = {
     'ListKeyIndexer': 'chunk.helper',
     'ListNumpyKeyIndexer': 'chunk.helper',
     'NumpyKeyIndexer': 'chunk.helper',
+    'ColumnarKeyIndexer': 'chunk.helper',
 }
 
 register_all_class(_cls2file_map, 'indexer')
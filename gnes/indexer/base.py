@@ -12,15 +12,49 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import glob
+import os
+import pickle
+import struct
 from collections import defaultdict
 from functools import wraps
-from typing import List, Any, Union, Callable, Tuple
+from typing import List, Any, Union, Callable, Tuple, Iterator, Dict
 
 import numpy as np
 
 from ..base import TrainableBase, CompositionalTrainableBase
-from ..proto import gnes_pb2, blob2array
+from ..helper import LRUCache
+from ..proto import gnes_pb2, blobs2array
 from ..score_fn.base import get_unary_score, ModifierScoreFn
+from ..score_fn.chunk import HIT_DTYPE
+
+# a new log segment is started once the current one exceeds this size
+_LOG_SEGMENT_SIZE = 1 << 26
+
+
+def _list_log_segments(dump_path: str) -> List[Tuple[int, str]]:
+    """Log segments of a dump, as a sorted list of (seq of the first record, file path)"""
+    segments = []
+    for p in glob.glob(glob.escape(dump_path) + '.*.log'):
+        start = p[len(dump_path) + 1:-len('.log')]
+        if start.isdigit():
+            segments.append((int(start), p))
+    return sorted(segments)
+
+
+def _read_log(dump_path: str) -> Iterator[Tuple[int, Tuple, dict]]:
+    """Read the (seq, args, kwargs) records from all log segments, a truncated tail record is ignored"""
+    for _, p in _list_log_segments(dump_path):
+        with open(p, 'rb') as fp:
+            while True:
+                header = fp.read(8)
+                if len(header) < 8:
+                    break
+                body_len = struct.unpack('<Q', header)[0]
+                body = fp.read(body_len)
+                if len(body) < body_len:
+                    break
+                yield pickle.loads(body)
 
 
 class BaseIndexer(TrainableBase):
@@ -28,6 +62,8 @@ class BaseIndexer(TrainableBase):
                  normalize_fn: 'BaseScoreFn' = None,
                  score_fn: 'BaseScoreFn' = None,
                  is_big_score_similar: bool = False,
+                 incremental_dump: bool = False,
+                 compact_ratio: float = 1.0,
                  *args, **kwargs):
         """
         Base indexer, a valid indexer must implement :py:meth:`add` and :py:meth:`query` methods
@@ -35,6 +71,11 @@ class BaseIndexer(TrainableBase):
         :type score_fn: advanced score function
         :type normalize_fn: normalizing score function
         :type is_big_score_similar: when set to true, then larger score means more similar
+        :type incremental_dump: append every :py:meth:`add` to a log next to the dump file,
+            so that :py:meth:`dump` only flushes the log instead of pickling the whole index.
+            only effective for indexers whose ``add`` is decorated with :py:meth:`append_log`
+        :type compact_ratio: write a full snapshot and drop the log when it grows larger than
+            this ratio of the last snapshot
         """
         super().__init__(*args, **kwargs)
         self.normalize_fn = normalize_fn if normalize_fn else ModifierScoreFn()
@@ -42,9 +83,139 @@ class BaseIndexer(TrainableBase):
         self.normalize_fn._context = self
         self.score_fn._context = self
         self.is_big_score_similar = is_big_score_similar
+        self.incremental_dump = incremental_dump
+        self.compact_ratio = compact_ratio
         self._num_docs = 0
         self._num_chunks = 0
         self._num_chunks_in_doc = defaultdict(int)
+        # seq of the last logged "add" and of the last one included in the snapshot
+        self._log_seq = 0
+        self._snapshot_seq = 0
+        self._log_fp = None
+        self._log_pid = None
+        self._is_replaying = False
+
+    def __getstate__(self):
+        d = super().__getstate__()
+        d['_log_fp'] = None
+        d['_log_pid'] = None
+        return d
+
+    def __setstate__(self, d):
+        super().__setstate__(d)
+        # also covers the indexers restored as a part of another object, e.g. the components of JointIndexer
+        if getattr(self, 'incremental_dump', False) and self.dump_full_path:
+            self._replay_log(self.dump_full_path)
+
+    @staticmethod
+    def append_log(func):
+        """Decorate :py:meth:`add`, so that its arguments are appended to the log when ``incremental_dump`` is on"""
+
+        @wraps(func)
+        def arg_wrapper(self, *args, **kwargs):
+            r = func(self, *args, **kwargs)
+            if getattr(self, 'incremental_dump', False) and not self._is_replaying:
+                self._append_log(args, kwargs)
+            return r
+
+        return arg_wrapper
+
+    def _append_log(self, args: Tuple, kwargs: dict):
+        if self._log_fp is not None and self._log_fp.tell() > _LOG_SEGMENT_SIZE:
+            self._close_log()
+        self._log_seq += 1
+        if self._log_fp is None:
+            self._log_fp = open('%s.%d.log' % (self.dump_full_path, self._log_seq), 'ab', buffering=0)
+            self._log_pid = os.getpid()
+        body = pickle.dumps((self._log_seq, self._encode_log_args(args), kwargs), protocol=pickle.HIGHEST_PROTOCOL)
+        # one write per record, so that a forked process sharing this file never sees a partial record
+        self._log_fp.write(struct.pack('<Q', len(body)) + body)
+
+    def _encode_log_args(self, args: Tuple) -> Tuple:
+        return args
+
+    def _decode_log_args(self, args: Tuple) -> Tuple:
+        return args
+
+    def _close_log(self):
+        if self._log_fp is not None and self._log_pid == os.getpid():
+            self._log_fp.close()
+            self._log_fp = None
+            self._log_pid = None
+
+    def _replay_log(self, dump_path: str):
+        num_records = 0
+        self._is_replaying = True
+        try:
+            for seq, args, kwargs in _read_log(dump_path):
+                if seq > self._log_seq:
+                    self.add(*self._decode_log_args(args), **kwargs)
+                    self._log_seq = seq
+                    num_records += 1
+        finally:
+            self._is_replaying = False
+        if num_records:
+            self.logger.info('replayed %d records from the log of %s' % (num_records, dump_path))
+
+    @property
+    def log_size(self) -> int:
+        """Number of bytes in the log segments since the last snapshot"""
+        return sum(os.path.getsize(p) for _, p in _list_log_segments(self.dump_full_path))
+
+    def flush_log(self):
+        """Flush the log to the disk"""
+        if self._log_fp is not None:
+            os.fsync(self._log_fp.fileno())
+
+    def begin_snapshot(self):
+        """Mark all logged records as included in the snapshot that is about to be written"""
+        # start a new segment after the snapshot, unless the log is owned by the parent of this forked process
+        self._close_log()
+        self._snapshot_seq = self._log_seq
+
+    def end_snapshot(self):
+        """Remove the log segments covered by the snapshot"""
+        segments = _list_log_segments(self.dump_full_path)
+        for (start, p), (next_start, _) in zip(segments, segments[1:] + [(None, None)]):
+            # a segment is covered if all its records are in the snapshot, the last one is covered
+            # only if no one is appending to it
+            if (next_start is not None and next_start <= self._snapshot_seq + 1) or \
+                    (next_start is None and start <= self._snapshot_seq and self._log_fp is None):
+                os.remove(p)
+
+    def dump(self, filename: str = None) -> int:
+        """
+        With ``incremental_dump``, only flush the log to the disk, unless the log is larger than
+        ``compact_ratio`` of the last snapshot, then write a new snapshot and remove the log segments it covers
+
+        :return: the number of bytes written, i.e. the size of the log since the last snapshot when only the log
+            is flushed
+        """
+        f = filename or self.dump_full_path
+        if not getattr(self, 'incremental_dump', False) or f != self.dump_full_path:
+            return super().dump(filename)
+
+        log_size = self.log_size
+        if os.path.exists(f) and log_size <= self.compact_ratio * os.path.getsize(f):
+            self.flush_log()
+            self.logger.info('flushed the log of %s, %d bytes since the last snapshot' % (f, log_size))
+            return log_size
+
+        self.begin_snapshot()
+        size = super().dump(f)
+        self.end_snapshot()
+        return size
+
+    @staticmethod
+    def load(filename: str = None) -> 'BaseIndexer':
+        obj = TrainableBase.load(filename)
+        if getattr(obj, 'incremental_dump', False):
+            obj._replay_log(filename)
+        return obj
+
+    def close(self):
+        self._close_log()
+        super().close()
 
     def add(self, keys: Any, docs: Any, weights: List[float], *args, **kwargs):
         pass
@@ -85,10 +256,46 @@ class BaseChunkIndexer(BaseIndexer):
     def query(self, keys: np.ndarray, top_k: int, *args, **kwargs) -> List[List[Tuple]]:
         pass
 
-    def query_and_score(self, q_chunks: List['gnes_pb2.Chunk'], top_k: int, *args, **kwargs) -> List[
-        'gnes_pb2.Response.QueryResponse.ScoredResult']:
-        vecs = [blob2array(c.embedding) for c in q_chunks]
-        queried_results = self.query(np.stack(vecs), top_k=top_k)
+    def query_and_score(self, q_chunks: List['gnes_pb2.Chunk'], top_k: int, q_embeddings: np.ndarray = None,
+                        explain: bool = False, *args, **kwargs) -> List['gnes_pb2.Response.QueryResponse.ScoredResult']:
+        """
+        :param q_chunks: the query chunks
+        :param top_k: number of results per query chunk
+        :param q_embeddings: the embeddings of ``q_chunks`` in one array, read from the chunks if not given
+        :param explain: attach a JSON explanation to every score. Otherwise all hits are scored at once
+                on numpy arrays and only the score value is set
+        """
+        if q_embeddings is None:
+            q_embeddings = blobs2array(c.embedding for c in q_chunks)
+        queried_results = self.query(q_embeddings, top_k=top_k)
+        if not explain:
+            try:
+                return self._batch_score(q_chunks, queried_results)
+            except NotImplementedError:
+                self.logger.warning('%s or %s does not support batch scoring, fallback to explained scoring' % (
+                    self.normalize_fn.__class__.__name__, self.score_fn.__class__.__name__))
+        return self._explain_score(q_chunks, queried_results)
+
+    def _batch_score(self, q_chunks: List['gnes_pb2.Chunk'],
+                     queried_results: List[List[Tuple]]) -> List['gnes_pb2.Response.QueryResponse.ScoredResult']:
+        num_hits = [len(r) for r in queried_results]
+        if not sum(num_hits):
+            return []
+        hits = np.empty(sum(num_hits), dtype=HIT_DTYPE)
+        hits['q_idx'] = np.repeat(np.arange(len(num_hits)), num_hits)
+        hits['doc_id'], hits['offset'], hits['weight'], relevance = zip(*(h for r in queried_results for h in r))
+        values = self.normalize_fn.batch_call(np.asarray(relevance, dtype=np.float64))
+        values = self.score_fn.batch_call(values, q_chunks, hits, queried_results)
+        values = np.broadcast_to(values, hits.shape)
+
+        ScoredResult = gnes_pb2.Response.QueryResponse.ScoredResult
+        return [ScoredResult(chunk=gnes_pb2.Chunk(doc_id=_doc_id, offset=_offset, weight=_weight),
+                             score=ScoredResult.Score(value=_value))
+                for _doc_id, _offset, _weight, _value in zip(hits['doc_id'].tolist(), hits['offset'].tolist(),
+                                                             hits['weight'].tolist(), values.tolist())]
+
+    def _explain_score(self, q_chunks: List['gnes_pb2.Chunk'],
+                       queried_results: List[List[Tuple]]) -> List['gnes_pb2.Response.QueryResponse.ScoredResult']:
         results = []
         for q_chunk, topk_chunks in zip(q_chunks, queried_results):
             for _doc_id, _offset, _weight, _relevance in topk_chunks:
@@ -98,12 +305,8 @@ class BaseChunkIndexer(BaseIndexer):
                 r.chunk.weight = _weight
                 _score = get_unary_score(value=_relevance,
                                          name=self.__class__.__name__,
-                                         operands=[
-                                             dict(name='doc_chunk',
-                                                  doc_id=_doc_id,
-                                                  offset=_offset),
-                                             dict(name='query_chunk',
-                                                  offset=q_chunk.offset)])
+                                         doc_chunk=dict(doc_id=_doc_id, offset=_offset),
+                                         query_chunk=dict(offset=q_chunk.offset))
                 _score = self.normalize_fn(_score)
                 _score = self.score_fn(_score, q_chunk, r.chunk, queried_results)
                 r.score.CopyFrom(_score)
@@ -137,20 +340,20 @@ class BaseChunkIndexer(BaseIndexer):
     @property
     def num_docs(self):
         if self.helper_indexer:
-            return self.helper_indexer._num_docs
+            return self.helper_indexer.num_docs
         else:
             return self._num_docs
 
     @property
     def num_chunks(self):
         if self.helper_indexer:
-            return self.helper_indexer._num_chunks
+            return self.helper_indexer.num_chunks
         else:
             return self._num_chunks
 
     def num_chunks_in_doc(self, doc_id: int):
         if self.helper_indexer:
-            return self.helper_indexer._num_chunks_in_doc[doc_id]
+            return self.helper_indexer.num_chunks_in_doc(doc_id)
         else:
             self.logger.warning('enable helper_indexer to track num_chunks_in_doc')
 
@@ -158,6 +361,21 @@ class BaseChunkIndexer(BaseIndexer):
 class BaseDocIndexer(BaseIndexer):
     """Storing documents and contents """
 
+    def __init__(self, doc_cache_size: int = 0, *args, **kwargs):
+        """
+        :param doc_cache_size: size (in MB, by the serialized size) of the LRU cache of the parsed documents,
+            only effective for indexers whose ``query`` is decorated with :py:meth:`cached_query`.
+            0 means no cache. the cached documents are shared by all queries, do not modify them
+        """
+        super().__init__(*args, **kwargs)
+        self.doc_cache_size = doc_cache_size
+
+    def post_init(self):
+        if getattr(self, 'doc_cache_size', 0) > 0:
+            self._doc_cache = LRUCache(self.doc_cache_size * 1024 * 1024, size_fn=lambda d: d.ByteSize())
+        else:
+            self._doc_cache = None
+
     def add(self, keys: List[int], docs: List['gnes_pb2.Document'], *args, **kwargs):
         """
         adding new docs and their protobuf representation
@@ -170,19 +388,47 @@ class BaseDocIndexer(BaseIndexer):
     def query(self, keys: List[int], *args, **kwargs) -> List['gnes_pb2.Document']:
         pass
 
-    def query_and_score(self, docs: List['gnes_pb2.Response.QueryResponse.ScoredResult'], *args, **kwargs) -> List[
-        'gnes_pb2.Response.QueryResponse.ScoredResult']:
+    def _encode_log_args(self, args: Tuple) -> Tuple:
+        keys, docs, *rest = args
+        return (keys, [d.SerializeToString() for d in docs], *rest)
+
+    def _decode_log_args(self, args: Tuple) -> Tuple:
+        keys, docs, *rest = args
+        return (keys, [gnes_pb2.Document.FromString(d) for d in docs], *rest)
+
+    def query_and_score(self, docs: List['gnes_pb2.Response.QueryResponse.ScoredResult'], explain: bool = False,
+                        *args, **kwargs) -> List['gnes_pb2.Response.QueryResponse.ScoredResult']:
+        """
+        :param docs: the scored results to fill with the documents
+        :param explain: extend the explanation tree of every score. Otherwise all results are scored at once
+                on numpy arrays and only the score value is kept
+        """
         keys = [r.doc.doc_id for r in docs]
-        results = []
         queried_results = self.query(keys, *args, **kwargs)
-        for d, r in zip(queried_results, docs):
-            if d:
-                r.doc.CopyFrom(d)
-                _score = self.normalize_fn(r.score)
-                _score = self.score_fn(_score, d)
-                r.score.CopyFrom(_score)
-            results.append(r)
-        return results
+        found = [(d, r) for d, r in zip(queried_results, docs) if d]
+        for d, r in found:
+            r.doc.CopyFrom(d)
+        if found and not explain:
+            try:
+                self._batch_score(*zip(*found))
+                return list(docs)
+            except NotImplementedError:
+                self.logger.warning('%s or %s does not support batch scoring, fallback to explained scoring' % (
+                    self.normalize_fn.__class__.__name__, self.score_fn.__class__.__name__))
+        for d, r in found:
+            _score = self.normalize_fn(r.score)
+            _score = self.score_fn(_score, d)
+            r.score.CopyFrom(_score)
+        return list(docs)
+
+    def _batch_score(self, docs: List['gnes_pb2.Document'],
+                     results: List['gnes_pb2.Response.QueryResponse.ScoredResult']) -> None:
+        last_scores = [r.score for r in results]
+        values = self.normalize_fn.batch_call(np.array([s.value for s in last_scores], dtype=np.float64))
+        values = self.score_fn.batch_call(values, docs, last_scores)
+        for r, v in zip(results, np.broadcast_to(values, len(results)).tolist()):
+            r.score.Clear()
+            r.score.value = v
 
     @staticmethod
     def update_counter(func):
@@ -190,10 +436,46 @@ class BaseDocIndexer(BaseIndexer):
         def arg_wrapper(self, keys: List[int], docs: List['gnes_pb2.Document'], *args, **kwargs):
             self._num_docs += len(keys)
             self._num_chunks += sum(len(d.chunks) for d in docs)
+            # the overwritten documents are no longer valid in the cache
+            if getattr(self, '_doc_cache', None) is not None:
+                for k in keys:
+                    self._doc_cache.pop(k)
             return func(self, keys, docs, *args, **kwargs)
 
         return arg_wrapper
 
+    @staticmethod
+    def cached_query(func):
+        """Decorate :py:meth:`query`, so that the documents are looked up in the document cache first,
+        and only the missing keys are queried, once per distinct key. ``func`` must return a document or None
+        for every key, in the same order"""
+
+        @wraps(func)
+        def arg_wrapper(self, keys: List[int], *args, **kwargs):
+            cache = getattr(self, '_doc_cache', None)
+            if cache is None:
+                return func(self, keys, *args, **kwargs)
+            docs = [cache.get(k) for k in keys]
+            misses = list(dict.fromkeys(k for k, d in zip(keys, docs) if d is None))
+            if misses:
+                found = dict(zip(misses, func(self, misses, *args, **kwargs)))
+                for k, d in found.items():
+                    if d is not None:
+                        cache.put(k, d)
+                docs = [found[k] if d is None else d for k, d in zip(keys, docs)]
+            return docs
+
+        return arg_wrapper
+
+    @property
+    def doc_cache_stats(self) -> Dict[str, float]:
+        """The number of hits and misses of the document cache, and the hit rate"""
+        cache = getattr(self, '_doc_cache', None)
+        if cache is None:
+            return {}
+        return {'num_hit': cache.num_hit, 'num_miss': cache.num_miss, 'hit_rate': cache.hit_rate,
+                'num_docs': len(cache), 'num_bytes': cache.num_bytes}
+
 
 class BaseChunkIndexerHelper(BaseChunkIndexer):
     """A helper class for storing chunk info, doc mapping, weights.
@@ -206,6 +488,9 @@ class BaseChunkIndexerHelper(BaseChunkIndexer):
     def query(self, keys: List[int], *args, **kwargs) -> List[Tuple[int, int, float]]:
         pass
 
+    def num_chunks_in_doc(self, doc_id: int):
+        return self._num_chunks_in_doc[doc_id]
+
 
 class JointIndexer(CompositionalTrainableBase):
 
@@ -234,6 +519,32 @@ class JointIndexer(CompositionalTrainableBase):
         if not self._binary_indexer or not self._doc_indexer:
             raise ValueError('"JointIndexer" requires a valid pair of "BaseBinaryIndexer" and "BaseTextIndexer"')
 
+    def dump(self, filename: str = None) -> int:
+        """
+        The components are pickled in the snapshot of the joint indexer, so their logs are managed here:
+        only flush them when all components keep a log that is smaller than ``compact_ratio`` of the snapshot,
+        otherwise write a new snapshot and remove the log segments it covers
+        """
+        f = filename or self.dump_full_path
+        logged = [c for c in self.components if getattr(c, 'incremental_dump', False)]
+        if not logged or f != self.dump_full_path:
+            return super().dump(filename)
+
+        log_size = sum(c.log_size for c in logged)
+        if (len(logged) == len(self.components) and os.path.exists(f)
+                and log_size <= min(c.compact_ratio for c in logged) * os.path.getsize(f)):
+            for c in logged:
+                c.flush_log()
+            self.logger.info('flushed the logs of %s, %d bytes since the last snapshot' % (f, log_size))
+            return log_size
+
+        for c in logged:
+            c.begin_snapshot()
+        size = super().dump(f)
+        for c in logged:
+            c.end_snapshot()
+        return size
+
     def add(self, keys: Any, docs: Any, *args,
             **kwargs) -> None:
         if isinstance(docs, np.ndarray):
@@ -249,13 +560,18 @@ class JointIndexer(CompositionalTrainableBase):
               *args,
               **kwargs) -> List[List[Tuple]]:
         topk_results = self._binary_indexer.query(keys, top_k, *args, **kwargs)
-        doc_caches = dict()
-        topk_results_with_docs = []
-        for topk in topk_results:
-            topk_wd = []
-            for doc_id, offset, weight, score in topk:
-                doc = doc_caches.get(doc_id, self._doc_indexer.query([doc_id])[0])
-                doc_caches[doc_id] = doc
-                topk_wd.append((doc_id, offset, weight, score, doc.chunks[offset]))
-            topk_results_with_docs.append(topk_wd)
-        return topk_results_with_docs
+        # the documents of all hits are fetched in one batch, once per distinct doc_id
+        doc_ids = list(dict.fromkeys(doc_id for topk in topk_results for doc_id, *_ in topk))
+        results = self._doc_indexer.query(doc_ids) if doc_ids else []
+        if len(results) == len(doc_ids):
+            docs = {k: d for k, d in zip(doc_ids, results) if d is not None}
+        else:
+            # missing documents are dropped by the doc indexer (e.g. "keep_na_doc=False"),
+            # so the results can no longer be paired by position
+            docs = {d.doc_id: d for d in results if d is not None}
+        missing = [k for k in doc_ids if k not in docs]
+        if missing:
+            self.logger.warning('%d documents are not found in %s, their hits are dropped: %s' %
+                                (len(missing), self._doc_indexer.__class__.__name__, missing))
+        return [[(doc_id, offset, weight, score, docs[doc_id].chunks[offset])
+                 for doc_id, offset, weight, score in topk if doc_id in docs] for topk in topk_results]
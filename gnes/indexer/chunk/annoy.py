@@ -18,7 +18,7 @@ from typing import List, Tuple, Any
 
 import numpy as np
 
-from .helper import ListKeyIndexer
+from .helper import ColumnarKeyIndexer
 from ..base import BaseChunkIndexer as BCI
 
 
@@ -40,7 +40,7 @@ class AnnoyIndexer(BCI):
         self.data_path = data_path
         self.metric = metric
         self.n_trees = n_trees
-        self.helper_indexer = ListKeyIndexer()
+        self.helper_indexer = self.helper_indexer or ColumnarKeyIndexer()
 
     def post_init(self):
         from annoy import AnnoyIndex
@@ -20,7 +20,7 @@ from typing import List, Tuple, Any
 import numpy as np
 
 from .cython import IndexCore
-from ..helper import ListKeyIndexer
+from ..helper import ColumnarKeyIndexer
 from ...base import BaseChunkIndexer as BCI
 
 
@@ -40,7 +40,7 @@ class BIndexer(BCI):
         self.insert_iterations = insert_iterations
         self.query_iterations = query_iterations
         self.data_path = data_path
-        self.helper_indexer = ListKeyIndexer()
+        self.helper_indexer = self.helper_indexer or ColumnarKeyIndexer()
 
     def post_init(self):
         self.bindexer = IndexCore(self.num_bytes, 4, self.ef,
@@ -19,7 +19,7 @@ from typing import List, Tuple, Any
 
 import numpy as np
 
-from .helper import ListKeyIndexer
+from .helper import ColumnarKeyIndexer
 from ..base import BaseChunkIndexer as BCI
 
 
@@ -36,7 +36,7 @@ class FaissIndexer(BCI):
         self.data_path = data_path
         self.num_dim = num_dim
         self.index_key = index_key
-        self.helper_indexer = ListKeyIndexer()
+        self.helper_indexer = self.helper_indexer or ColumnarKeyIndexer()
 
     def post_init(self):
         import faiss
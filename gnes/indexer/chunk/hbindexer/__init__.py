@@ -20,7 +20,7 @@ from typing import List, Tuple, Any
 import numpy as np
 
 from .cython import IndexCore
-from ..helper import ListKeyIndexer
+from ..helper import ColumnarKeyIndexer
 from ...base import BaseChunkIndexer as BCI
 
 
@@ -40,7 +40,7 @@ class HBIndexer(BCI):
         self.data_path = data_path
         if self.n_idx <= 0:
             raise ValueError('There should be at least 1 clustering slot')
-        self.helper_indexer = ListKeyIndexer()
+        self.helper_indexer = self.helper_indexer or ColumnarKeyIndexer()
 
     def post_init(self):
         self.hbindexer = IndexCore(self.n_clusters, self.n_bytes, self.n_idx)
@@ -14,13 +14,139 @@
 #  limitations under the License.
 
 
-from typing import List, Tuple
+from typing import List, Tuple, Union
 
 import numpy as np
 
 from ..base import BaseChunkIndexerHelper as CIH
 
 
+class GrowableArray:
+    """A contiguous numpy array that doubles its capacity when it is full,
+    so that appending ``n`` rows in many small batches costs amortized O(n) copies
+    """
+
+    def __init__(self, dtype=None, capacity: int = 1024):
+        """
+        :param dtype: dtype of the array, when not given it is decided on first :py:meth:`append`
+        :param capacity: number of rows reserved on first :py:meth:`append`
+        """
+        self._dtype = dtype
+        self._init_capacity = max(1, capacity)
+        self._buffer = None  # type: np.ndarray
+        self._size = 0
+
+    @classmethod
+    def from_array(cls, data: np.ndarray) -> 'GrowableArray':
+        """Wrap ``data`` (e.g. a memory-mapped array) without copying,
+        it is copied into a new buffer on the first :py:meth:`append` that needs more room"""
+        a = cls(data.dtype, len(data))
+        a._buffer = data
+        a._size = len(data)
+        return a
+
+    def append(self, rows: np.ndarray) -> int:
+        """Copy ``rows`` into the free space at the tail, grow the buffer if needed
+
+        :return: the size after appending
+        """
+        rows = np.asarray(rows, dtype=self._dtype)
+        if self._buffer is None:
+            self._dtype = rows.dtype
+            self._buffer = np.empty([max(self._init_capacity, len(rows)), *rows.shape[1:]], dtype=self._dtype)
+        elif rows.shape[1:] != self._buffer.shape[1:]:
+            raise ValueError('rows of shape %s can not be appended to an array of shape %s' %
+                             (rows.shape, self.data.shape))
+        self.reserve(self._size + len(rows))
+        self._buffer[self._size:(self._size + len(rows))] = rows
+        self._size += len(rows)
+        return self._size
+
+    def reserve(self, capacity: int) -> None:
+        """Make sure there is room for at least ``capacity`` rows, doubling the buffer as needed"""
+        if capacity > self.capacity:
+            new_capacity = max(capacity, 2 * self.capacity)
+            new_buffer = np.empty([new_capacity, *self._buffer.shape[1:]], dtype=self._dtype)
+            new_buffer[:self._size] = self._buffer[:self._size]
+            self._buffer = new_buffer
+
+    def shrink_to_fit(self) -> None:
+        """Release the unused capacity"""
+        if self._buffer is not None and self.capacity > self._size:
+            self._buffer = self._buffer[:self._size].copy()
+
+    @property
+    def data(self) -> np.ndarray:
+        """A view of the filled rows, it is invalidated by the next :py:meth:`append`"""
+        return self._buffer[:self._size] if self._buffer is not None else None
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer) if self._buffer is not None else 0
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, item):
+        return self.data[item]
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        # only the filled rows are serialized
+        d['_buffer'] = self.data
+        return d
+
+
+class InvertedLists:
+    """Rows partitioned into ``num_lists`` lists, every list keeps its rows and their ids
+    in two contiguous :py:class:`GrowableArray`, so that a list is scanned without gathering
+    """
+
+    def __init__(self, num_lists: int, dtype=None):
+        """
+        :param num_lists: number of lists
+        :param dtype: dtype of the rows, when not given it is decided on first :py:meth:`add`
+        """
+        self._rows = [GrowableArray(dtype, capacity=16) for _ in range(num_lists)]
+        self._ids = [GrowableArray(np.int64, capacity=16) for _ in range(num_lists)]
+
+    def add(self, list_ids: np.ndarray, rows: np.ndarray, ids: np.ndarray) -> None:
+        """Append every row with its id to the list given in ``list_ids``"""
+        list_ids = np.asarray(list_ids)
+        order = np.argsort(list_ids, kind='stable')
+        bounds = np.flatnonzero(np.diff(list_ids[order])) + 1
+        for group in np.split(order, bounds):
+            if len(group):
+                l = int(list_ids[group[0]])
+                self._rows[l].append(rows[group])
+                self._ids[l].append(np.asarray(ids)[group])
+
+    def rows(self, list_id: int) -> np.ndarray:
+        return self._rows[list_id].data
+
+    def ids(self, list_id: int) -> np.ndarray:
+        return self._ids[list_id].data
+
+    def list_sizes(self) -> np.ndarray:
+        return np.array([r.size for r in self._rows], dtype=np.int64)
+
+    @property
+    def num_lists(self) -> int:
+        return len(self._rows)
+
+    @property
+    def size(self) -> int:
+        return sum(r.size for r in self._rows)
+
+
 class DictKeyIndexer(CIH):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -62,9 +188,10 @@ class ListNumpyKeyIndexer(ListKeyIndexer):
         self._np_int2key_weight = None
 
     def _build_np_buffer(self):
-        if self._data_updated or not self._np_int2key or not self._np_int2key_weight:
+        if self._data_updated or self._np_int2key is None or self._np_int2key_weight is None:
             self._np_int2key = np.array(self._int2key, int)
             self._np_int2key_weight = np.array(self._int2key_weight, float)
+            self._data_updated = False
 
     def add(self, *args, **kwargs) -> int:
         self._data_updated = True
@@ -78,39 +205,98 @@ class ListNumpyKeyIndexer(ListKeyIndexer):
 
     def __getstate__(self):
         d = super().__getstate__()
-        del d['_np_int2key_weight']
-        del d['_np_int2key']
+        d['_np_int2key_weight'] = None
+        d['_np_int2key'] = None
         return d
 
 
 class NumpyKeyIndexer(CIH):
     def __init__(self, buffer_size: int = 10000, col_size: int = 3, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._int2key_info = np.zeros([buffer_size, col_size])
-        self._buffer_size = 10000
+        self._int2key_info = GrowableArray(np.float64, buffer_size)
+        self._buffer_size = buffer_size
         self._col_size = col_size
-        self._size = 0
-        self._max_size = self._buffer_size
-        self._all_docs = []
 
     @CIH.update_counter
     def add(self, keys: List[Tuple[int, int]], weights: List[float], *args, **kwargs) -> int:
-        l = len(keys)
-        if self._size + l > self._max_size:
-            extend_size = max(l, self._buffer_size)
-            self._int2key_info = np.concatenate([self._int2key_info, np.zeros([extend_size, self._col_size])])
-            self._max_size += extend_size
-
-        self._int2key_info[self._size:(self._size + l), 0:(self._col_size - 1)] = np.array(keys)
-        self._int2key_info[self._size:(self._size + l), self._col_size - 1] = np.array(weights)
-        self._size += l
-        return self._size
+        rows = np.empty([len(keys), self._col_size])
+        rows[:, 0:(self._col_size - 1)] = np.array(keys)
+        rows[:, self._col_size - 1] = np.array(weights)
+        return self._int2key_info.append(rows)
 
     def query(self, keys: List[int], *args, **kwargs) -> List[Tuple[int, int, float]]:
+        if not self._int2key_info.size:
+            if len(keys):
+                raise IndexError('can not query %d keys from an empty %s' % (len(keys), self.__class__.__name__))
+            return []
         key_offset = self._int2key_info[keys, 0:(self._col_size - 1)].astype(int).tolist()
         weights = self._int2key_info[keys, self._col_size - 1].astype(float).tolist()
         return [(*ko, w) for ko, w in zip(key_offset, weights)]
 
+    @property
+    def size(self):
+        return self._int2key_info.size
+
     @property
     def capacity(self):
-        return self._max_size
+        return self._int2key_info.capacity
+
+    def shrink_to_fit(self):
+        self._int2key_info.shrink_to_fit()
+
+    def __setstate__(self, d):
+        if isinstance(d['_int2key_info'], np.ndarray):
+            # the earlier versions kept a zero-padded ndarray and the number of filled rows
+            d['_int2key_info'] = GrowableArray.from_array(d['_int2key_info'][:d.pop('_size')])
+            d.pop('_max_size', None)
+            d.pop('_all_docs', None)
+        super().__setstate__(d)
+
+
+class ColumnarKeyIndexer(CIH):
+    """Store doc_id, offset and weight of the chunks in three contiguous numpy columns,
+    which takes 16 bytes per chunk and allows vectorized lookups
+    """
+
+    def __init__(self, buffer_size: int = 10000, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._doc_ids = GrowableArray(np.uint64, buffer_size)
+        self._offsets = GrowableArray(np.uint32, buffer_size)
+        self._weights = GrowableArray(np.float32, buffer_size)
+        self._num_chunks_in_doc = {}
+
+    def add(self, keys: List[Tuple[int, int]], weights: List[float], *args, **kwargs) -> int:
+        if len(keys) != len(weights):
+            raise ValueError('"keys" and "weights" must have the same length')
+        keys = np.array(keys, dtype=np.uint64).reshape([-1, 2])
+        self._doc_ids.append(keys[:, 0])
+        self._offsets.append(keys[:, 1])
+        self._weights.append(weights)
+
+        doc_ids, counts = np.unique(keys[:, 0], return_counts=True)
+        for doc_id, c in zip(doc_ids.tolist(), counts.tolist()):
+            self._num_chunks_in_doc[doc_id] = self._num_chunks_in_doc.get(doc_id, 0) + c
+        self._num_docs = len(self._num_chunks_in_doc)
+        self._num_chunks = self._doc_ids.size
+        return self._num_chunks
+
+    def query_columns(self, keys: Union[List[int], np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: a tuple of (doc_ids, offsets, weights) arrays in the shape of ``keys``
+        """
+        if not self._doc_ids.size:
+            if np.size(keys):
+                raise IndexError('can not query %d keys from an empty %s' % (np.size(keys), self.__class__.__name__))
+            shape = np.shape(keys)
+            return np.empty(shape, np.uint64), np.empty(shape, np.uint32), np.empty(shape, np.float32)
+        return self._doc_ids[keys], self._offsets[keys], self._weights[keys]
+
+    def query(self, keys: List[int], *args, **kwargs) -> List[Tuple[int, int, float]]:
+        return list(zip(*(c.tolist() for c in self.query_columns(keys))))
+
+    def num_chunks_in_doc(self, doc_id: int):
+        return self._num_chunks_in_doc.get(doc_id, 0)
+
+    def shrink_to_fit(self):
+        for c in (self._doc_ids, self._offsets, self._weights):
+            c.shrink_to_fit()
@@ -0,0 +1,248 @@
+#  Tencent is pleased to support the open source community by making GNES available.
+#
+#  Copyright (C) 2019 THL A29 Limited, a Tencent company. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import heapq
+import os
+from typing import List, Tuple, Any
+
+import numpy as np
+
+from .helper import ColumnarKeyIndexer, GrowableArray
+from .numpy import pairwise_distance
+from ..base import BaseChunkIndexer as BCI
+
+_METRICS = {'l2', 'inner_product', 'cosine'}
+
+
+class HNSWIndexer(BCI):
+    """A hierarchical navigable small world (HNSW) graph index of float vectors in pure numpy.
+    Vectors are inserted one by one into the graph, so adding and querying can be interleaved freely.
+
+    The graph is kept in flat arrays, which are saved as ``data_path.*.npy`` on :py:meth:`dump`:
+    ``vec`` [num_chunks, dim] the vectors, ``level`` [num_chunks] the top layer of every node,
+    ``link0`` [num_chunks, 2M] the neighbors on the bottom layer, ``upper`` [num_upper_rows, M] the neighbors
+    on the upper layers, where the layer ``l`` of a node is at ``upper_offset[node] + l - 1``.
+    The unused slots are -1. With ``read_only``, the arrays are memory-mapped instead of read into the memory.
+    """
+
+    def __init__(self, data_path: str, metric: str = 'l2', M: int = 16, ef_construction: int = 100,
+                 ef_search: int = 50, read_only: bool = False, *args, **kwargs):
+        """
+        :param data_path: path prefix of the array files
+        :param metric: one of "l2", "inner_product" and "cosine"
+        :param M: number of the neighbors of a node on the upper layers, twice as many on the bottom layer
+        :param ef_construction: size of the dynamic candidate list when inserting
+        :param ef_search: size of the dynamic candidate list when querying, at least ``top_k``
+        :param read_only: memory-map the array files and refuse :py:meth:`add`
+        """
+        super().__init__(*args, **kwargs)
+        if metric not in _METRICS:
+            raise ValueError('unknown metric: %s, must be one of %s' % (metric, _METRICS))
+        self.data_path = data_path
+        self.metric = metric
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.read_only = read_only
+        self.entry_point = -1
+        self.max_level = -1
+        self.helper_indexer = self.helper_indexer or ColumnarKeyIndexer()
+
+    def post_init(self):
+        self._rng = np.random.RandomState()
+        self._vectors = self._load_array('vec', np.float32)
+        self._levels = self._load_array('level', np.int32)
+        self._links0 = self._load_array('link0', np.int32)
+        self._upper_offset = self._load_array('upper_offset', np.int64)
+        self._upper = self._load_array('upper', np.int32)
+
+    def _array_path(self, name: str) -> str:
+        return '%s.%s.npy' % (self.data_path, name)
+
+    def _load_array(self, name: str, dtype) -> 'GrowableArray':
+        path = self._array_path(name)
+        if self.entry_point >= 0 and os.path.exists(path):
+            return GrowableArray.from_array(np.load(path, mmap_mode='r' if self.read_only else None))
+        return GrowableArray(dtype)
+
+    def __getstate__(self):
+        d = super().__getstate__()
+        if not self.read_only:
+            for name, a in [('vec', self._vectors), ('level', self._levels), ('link0', self._links0),
+                            ('upper_offset', self._upper_offset), ('upper', self._upper)]:
+                if a.size:
+                    # replace the file at once, so that a reader never maps a partially written one
+                    tmp_path = self._array_path(name) + '.tmp'
+                    with open(tmp_path, 'wb') as fp:
+                        np.save(fp, a.data)
+                    os.replace(tmp_path, self._array_path(name))
+        return d
+
+    def _distance(self, q: np.ndarray, ids: List[int]) -> np.ndarray:
+        v = self._vectors.data[ids]
+        if self.metric == 'l2':
+            diff = v - q
+            return np.einsum('ij,ij->i', diff, diff)
+        if self.metric == 'inner_product':
+            return -np.dot(v, q)
+        # vectors are normalized on insert
+        return 1 - np.dot(v, q)
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = vectors.astype(np.float32, copy=False)
+        if self.metric == 'cosine':
+            return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), np.finfo(np.float32).tiny)
+        return vectors
+
+    def _links(self, node: int, level: int) -> np.ndarray:
+        if level == 0:
+            return self._links0.data[node]
+        return self._upper.data[self._upper_offset.data[node] + level - 1]
+
+    def _set_neighbors(self, node: int, level: int, ids: np.ndarray) -> None:
+        links = self._links(node, level)
+        links[:] = -1
+        links[:len(ids)] = ids
+
+    def _search_layer(self, q: np.ndarray, entry_points: List[int], ef: int,
+                      level: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Best-first search on one layer
+
+        :return: a tuple of (node ids, distances) of the ``ef`` nearest nodes found, sorted by the distance
+        """
+        visited = set(entry_points)
+        candidates = list(zip(self._distance(q, entry_points).tolist(), entry_points))
+        heapq.heapify(candidates)
+        # a max-heap of the nearest nodes found so far
+        results = [(-d, n) for d, n in candidates]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            dist, node = heapq.heappop(candidates)
+            if dist > -results[0][0]:
+                break
+            neighbors = [n for n in self._links(node, level).tolist() if n >= 0 and n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for d, n in zip(self._distance(q, neighbors).tolist(), neighbors):
+                if len(results) < ef or d < -results[0][0]:
+                    heapq.heappush(candidates, (d, n))
+                    heapq.heappush(results, (-d, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        results.sort(reverse=True)
+        return np.array([n for _, n in results], dtype=np.int64), np.array([-d for d, _ in results])
+
+    def _select_neighbors(self, ids: np.ndarray, dists: np.ndarray, m: int) -> np.ndarray:
+        """The neighbor selection heuristic: a candidate is kept if it is closer to the base node than
+        to every kept one, the list is then filled up with the nearest discarded candidates
+
+        :param ids: candidates sorted by their distances ``dists`` to the base node
+        """
+        if len(ids) <= m:
+            return ids
+        pair_dists = pairwise_distance(self._vectors.data[ids], self._vectors.data[ids],
+                                       'inner_product' if self.metric == 'inner_product' else 'l2')
+        if self.metric == 'cosine':
+            # l2 is monotonic to cosine on normalized vectors
+            dists = 2 * dists
+        is_kept = np.zeros(len(ids), dtype=bool)
+        # a candidate is discarded once it is closer to a kept one than to the base node
+        is_discarded = np.zeros(len(ids), dtype=bool)
+        for j in range(len(ids)):
+            if not is_discarded[j]:
+                is_kept[j] = True
+                if np.count_nonzero(is_kept) == m:
+                    break
+                is_discarded |= pair_dists[j] <= dists
+        num_missing = m - np.count_nonzero(is_kept)
+        if num_missing > 0:
+            is_kept[np.flatnonzero(~is_kept)[:num_missing]] = True
+        return ids[is_kept]
+
+    def _insert(self, vector: np.ndarray) -> None:
+        node = self._vectors.size
+        level = int(-np.log(1 - self._rng.random_sample()) / np.log(self.M))
+        self._vectors.append(vector[None])
+        self._levels.append([level])
+        self._links0.append(np.full([1, 2 * self.M], -1, dtype=np.int32))
+        self._upper_offset.append([self._upper.size if level else -1])
+        if level:
+            self._upper.append(np.full([level, self.M], -1, dtype=np.int32))
+
+        if self.entry_point < 0:
+            self.entry_point, self.max_level = node, level
+            return
+
+        entry_points = [self.entry_point]
+        for l in range(self.max_level, level, -1):
+            entry_points = self._search_layer(vector, entry_points, 1, l)[0].tolist()
+        for l in range(min(level, self.max_level), -1, -1):
+            ids, dists = self._search_layer(vector, entry_points, self.ef_construction, l)
+            neighbors = self._select_neighbors(ids, dists, self.M)
+            self._set_neighbors(node, l, neighbors)
+            max_links = 2 * self.M if l == 0 else self.M
+            for n in neighbors.tolist():
+                links = self._links(n, l)
+                free = np.flatnonzero(links < 0)
+                if len(free):
+                    links[free[0]] = node
+                else:
+                    # the neighbor is full, shrink its links together with the new node
+                    cand = np.append(links, node)
+                    d = self._distance(self._vectors.data[n], cand)
+                    order = np.argsort(d, kind='stable')
+                    self._set_neighbors(n, l, self._select_neighbors(cand[order], d[order], max_links))
+            entry_points = ids.tolist()
+
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    @BCI.append_log
+    @BCI.update_helper_indexer
+    def add(self, keys: List[Tuple[int, Any]], vectors: np.ndarray, weights: List[float], *args, **kwargs):
+        if self.read_only:
+            raise PermissionError('%s is opened as read-only' % self.data_path)
+        if len(vectors) != len(keys):
+            raise ValueError('vectors length should be equal to doc_ids')
+        if self._vectors.size and vectors.shape[1] != self._vectors.data.shape[1]:
+            raise ValueError("vectors' shape [%d, %d] does not match with indexer's dim: %d" %
+                             (vectors.shape[0], vectors.shape[1], self._vectors.data.shape[1]))
+
+        for v in self._normalize(vectors):
+            self._insert(v)
+
+    def query(self, keys: np.ndarray, top_k: int, ef_search: int = None, *args, **kwargs) -> List[List[Tuple]]:
+        """
+        :param ef_search: override the size of the dynamic candidate list
+        """
+        if self.entry_point < 0:
+            return [[] for _ in range(keys.shape[0])]
+
+        ef = max(ef_search or self.ef_search, top_k)
+        ret = []
+        for q in self._normalize(keys):
+            entry_points = [self.entry_point]
+            for l in range(self.max_level, 0, -1):
+                entry_points = self._search_layer(q, entry_points, 1, l)[0].tolist()
+            ids, dists = self._search_layer(q, entry_points, ef, 0)
+            chunk_info = self.helper_indexer.query(ids[:top_k].tolist())
+            ret.append([(*r, s) for r, s in zip(chunk_info, dists[:top_k].tolist())])
+        return ret
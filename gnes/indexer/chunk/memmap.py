@@ -0,0 +1,192 @@
+#  Tencent is pleased to support the open source community by making GNES available.
+#
+#  Copyright (C) 2019 THL A29 Limited, a Tencent company. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import struct
+from typing import List, Tuple, Any
+
+import numpy as np
+
+from .numpy import blocked_topk, _METRICS
+from ..base import BaseChunkIndexer as BCI
+
+# every file starts with a fixed-size .npy header, so that the shape can be rewritten in place on append
+_HEADER_SIZE = 256
+
+KEY_DTYPE = np.dtype([('doc_id', '<u8'), ('offset', '<u4'), ('weight', '<f4')])
+
+
+def _write_npy_header(fp, dtype: np.dtype, shape: Tuple) -> None:
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype),
+                   'fortran_order': False,
+                   'shape': tuple(shape)}).encode('latin1')
+    magic = np.lib.format.magic(1, 0)
+    pad = _HEADER_SIZE - len(magic) - 2 - len(header) - 1
+    if pad < 0:
+        raise ValueError('header of %s is too long' % header)
+    fp.seek(0)
+    fp.write(magic + struct.pack('<H', len(header) + pad + 1) + header + b' ' * pad + b'\n')
+
+
+def _read_npy_header(path: str) -> Tuple[np.dtype, Tuple]:
+    with open(path, 'rb') as fp:
+        np.lib.format.read_magic(fp)
+        shape, _, dtype = np.lib.format.read_array_header_1_0(fp)
+    return dtype, shape
+
+
+def _num_rows(path: str) -> int:
+    return _read_npy_header(path)[1][0] if os.path.exists(path) else 0
+
+
+def _append_rows(path: str, rows: np.ndarray, at_row: int = None) -> int:
+    """Append ``rows`` to a .npy file written by :py:func:`_write_npy_header`, the header is updated last
+    so that a partially written tail is never visible and gets overwritten by the next append
+
+    :param at_row: write from this row on and drop everything after it, by default append after the last row
+    :return: the number of rows after appending
+    """
+    if not os.path.exists(path):
+        with open(path, 'wb') as fp:
+            _write_npy_header(fp, rows.dtype, (0, *rows.shape[1:]))
+    dtype, shape = _read_npy_header(path)
+    if tuple(shape[1:]) != rows.shape[1:]:
+        raise ValueError('can not append rows of shape %s to %s of shape %s' % (rows.shape, path, shape))
+    rows = np.ascontiguousarray(rows, dtype=dtype)
+    at_row = shape[0] if at_row is None else min(at_row, shape[0])
+    with open(path, 'r+b') as fp:
+        fp.seek(_HEADER_SIZE + at_row * rows[:1].nbytes)
+        fp.truncate()
+        fp.write(rows.tobytes())
+        fp.flush()
+        _write_npy_header(fp, dtype, (at_row + len(rows), *shape[1:]))
+    return at_row + len(rows)
+
+
+class MmapIndexer(BCI):
+    """An exhaustive search indexer whose vectors and keys live in two append-only .npy files,
+    which are memory-mapped on query. It opens in O(1) regardless of the index size,
+    and several read-only processes on the same host share the vectors through the OS page cache.
+
+    The files are ``data_path.vec.npy`` of shape [num_chunks, dim] and
+    ``data_path.key.npy`` of (doc_id, offset, weight) records, both readable by :py:func:`np.load`.
+    """
+
+    def __init__(self, data_path: str, dtype: str = None, read_only: bool = False,
+                 metric: str = 'l1', block_size: int = 8192, *args, **kwargs):
+        """
+        :param data_path: path prefix of the vector and key files
+        :param dtype: dtype of the vector file when it is created, by default the dtype of the first added vectors
+        :param read_only: open the files read-only and pick up the rows appended by other processes on query
+        :param metric: one of "l1", "l2", "inner_product", "cosine" and "hamming"
+        :param block_size: number of indexed vectors scored at once at query time
+        """
+        super().__init__(*args, **kwargs)
+        if metric not in _METRICS:
+            raise ValueError('unknown metric: %s, must be one of %s' % (metric, _METRICS))
+        self.data_path = data_path
+        self.dtype = dtype
+        self.read_only = read_only
+        self.metric = metric
+        self.block_size = block_size
+
+    def post_init(self):
+        self._vecs = None  # type: np.memmap
+        self._keys = None  # type: np.memmap
+        # number of the committed rows, a reader checks the key file on every query for the rows
+        # appended by other processes, the writer knows it from its own add()
+        self._num_rows = None
+        # number of chunks per doc, counted incrementally over the first "_num_counted" rows
+        self._doc_counts = {}
+        self._num_counted = 0
+
+    @property
+    def vec_path(self):
+        return self.data_path + '.vec.npy'
+
+    @property
+    def key_path(self):
+        return self.data_path + '.key.npy'
+
+    def _open(self):
+        if self.read_only or self._num_rows is None:
+            self._num_rows = _num_rows(self.key_path)
+        # remapped only when the files have grown, the rows mapped before never change
+        if self._num_rows != (len(self._keys) if self._keys is not None else 0):
+            # the key file is committed last, both files may have more rows than counted
+            self._keys = np.load(self.key_path, mmap_mode='r')[:self._num_rows]
+            self._vecs = np.load(self.vec_path, mmap_mode='r')[:self._num_rows]
+
+    def _close(self):
+        self._vecs = None
+        self._keys = None
+        self._num_rows = None
+        self._doc_counts = {}
+        self._num_counted = 0
+
+    def add(self, keys: List[Tuple[int, Any]], vectors: np.ndarray, weights: List[float], *args, **kwargs):
+        if self.read_only:
+            raise PermissionError('%s is opened as read-only' % self.data_path)
+        if len(vectors) != len(keys):
+            raise ValueError('vectors length should be equal to doc_ids')
+        if len(keys) == 0:
+            return
+
+        rows = np.empty(len(keys), dtype=KEY_DTYPE)
+        rows['doc_id'], rows['offset'] = zip(*keys)
+        rows['weight'] = weights
+        if self._num_rows is None:
+            self._num_rows = _num_rows(self.key_path)
+        # vectors beyond the committed keys are left by an interrupted add(), they are overwritten
+        _append_rows(self.vec_path, np.asarray(vectors, dtype=self.dtype), at_row=self._num_rows)
+        # the current map is kept, the next query extends it to the appended rows
+        self._num_rows = _append_rows(self.key_path, rows)
+
+    def query(self, keys: np.ndarray, top_k: int, *args, **kwargs) -> List[List[Tuple]]:
+        self._open()
+        if self._keys is None:
+            return [[] for _ in range(keys.shape[0])]
+
+        ids, score = blocked_topk(keys, self._vecs, top_k, self.metric, self.block_size)
+        info = self._keys[ids]
+        return [list(zip(d, o, w, s)) for d, o, w, s in zip(info['doc_id'].tolist(),
+                                                               info['offset'].tolist(),
+                                                               info['weight'].tolist(),
+                                                               score.tolist())]
+
+    def _count_docs(self):
+        self._open()
+        if self._keys is not None and self._num_counted < len(self._keys):
+            doc_ids, counts = np.unique(self._keys['doc_id'][self._num_counted:], return_counts=True)
+            for d, c in zip(doc_ids.tolist(), counts.tolist()):
+                self._doc_counts[d] = self._doc_counts.get(d, 0) + c
+            self._num_counted = len(self._keys)
+        return self._doc_counts
+
+    @property
+    def num_chunks(self):
+        self._open()
+        return len(self._keys) if self._keys is not None else 0
+
+    @property
+    def num_docs(self):
+        return len(self._count_docs())
+
+    def num_chunks_in_doc(self, doc_id: int):
+        return self._count_docs().get(doc_id, 0)
+
+    def close(self):
+        self._close()
+        super().close()
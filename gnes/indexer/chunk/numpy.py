@@ -14,26 +14,235 @@
 #  limitations under the License.
 
 
-from typing import List, Tuple, Any
+from typing import List, Tuple, Any, Callable
 
 import numpy as np
 
-from .helper import ListKeyIndexer
+from .helper import ColumnarKeyIndexer, GrowableArray, InvertedLists
 from ..base import BaseChunkIndexer as BCI
+from ...helper import kmeans
+
+# upper bound of the number of elements in a [query, vector, dim] tile,
+# only used by the element-wise metrics (l1, hamming) that can not be written as matmul
+_MAX_TILE_ELEMENTS = 1 << 24
+
+_METRICS = {'l1', 'l2', 'inner_product', 'cosine', 'hamming'}
+
+
+def _as_float(x: np.ndarray) -> np.ndarray:
+    return x if np.issubdtype(x.dtype, np.floating) else x.astype(np.float32)
+
+
+def _elementwise_distance(queries: np.ndarray, vectors: np.ndarray, metric: str) -> np.ndarray:
+    num_dim = max(1, vectors.shape[1])
+    # split the vectors first, so that a tile is bounded even if a single query does not fit
+    v_step = max(1, min(vectors.shape[0], _MAX_TILE_ELEMENTS // num_dim))
+    q_step = max(1, _MAX_TILE_ELEMENTS // (v_step * num_dim))
+    dist = np.empty([queries.shape[0], vectors.shape[0]], dtype=np.float64)
+    for i in range(0, vectors.shape[0], v_step):
+        v = vectors[i:(i + v_step)]
+        for j in range(0, queries.shape[0], q_step):
+            q = np.expand_dims(queries[j:(j + q_step)], axis=1)
+            if metric == 'hamming':
+                dist[j:(j + q_step), i:(i + v_step)] = np.count_nonzero(q != v, axis=-1)
+            else:
+                dist[j:(j + q_step), i:(i + v_step)] = np.sum(np.abs(q - v), axis=-1)
+    return dist / vectors.shape[1]
+
+
+def pairwise_distance(queries: np.ndarray, vectors: np.ndarray, metric: str = 'l1',
+                      vector_norms: np.ndarray = None) -> np.ndarray:
+    """
+    Compute the distance between every query and every vector, smaller always means closer
+
+    :param queries: [num_queries, dim]
+    :param vectors: [num_vectors, dim]
+    :param metric: one of "l1", "l2", "inner_product", "cosine" and "hamming".
+            "l1" and "hamming" are normalized by the dimension, "l2" is the squared euclidean distance,
+            "inner_product" is the negative dot product and "cosine" is 1 - cosine similarity.
+    :param vector_norms: precomputed squared l2-norms of ``vectors``, only used by "l2" and "cosine"
+    :return: [num_queries, num_vectors]
+    """
+    if metric in {'l1', 'hamming'}:
+        return _elementwise_distance(queries, vectors, metric)
+
+    queries, vectors = _as_float(queries), _as_float(vectors)
+    dot = np.matmul(queries, vectors.T)
+    if metric == 'inner_product':
+        return -dot
+    if vector_norms is None:
+        vector_norms = np.einsum('ij,ij->i', vectors, vectors)
+    q_norms = np.einsum('ij,ij->i', queries, queries)
+    if metric == 'l2':
+        dist = np.expand_dims(q_norms, 1) + np.expand_dims(vector_norms, 0) - 2 * dot
+        return np.maximum(dist, 0, out=dist)
+    if metric == 'cosine':
+        denom = np.sqrt(np.expand_dims(q_norms, 1) * np.expand_dims(vector_norms, 0))
+        return 1 - dot / np.maximum(denom, np.finfo(denom.dtype).tiny)
+    raise ValueError('unknown metric: %s, must be one of %s' % (metric, _METRICS))
+
+
+def topk_smallest(dist: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Select the ``top_k`` smallest values of each row via argpartition, then sort only the selected part
+
+    :return: a tuple of (column indices, values), both in the shape of [num_rows, top_k] and sorted ascending
+    """
+    top_k = min(top_k, dist.shape[1])
+    if top_k < dist.shape[1]:
+        idx = np.argpartition(dist, top_k - 1, axis=1)[:, :top_k]
+    else:
+        idx = np.tile(np.arange(dist.shape[1]), (dist.shape[0], 1))
+    val = np.take_along_axis(dist, idx, axis=1)
+    order = np.argsort(val, axis=1, kind='stable')
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(val, order, axis=1)
+
+
+def merge_topk(idx: np.ndarray, dist: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Keep the ``top_k`` smallest of the concatenated candidates of every row
+
+    :param idx: [num_rows, num_candidates] candidate indices
+    :param dist: [num_rows, num_candidates] candidate distances
+    :return: a tuple of (indices, distances), both sorted ascending
+    """
+    if idx.shape[1] > top_k:
+        order, dist = topk_smallest(dist, top_k)
+        idx = np.take_along_axis(idx, order, axis=1)
+    return idx, dist
+
+
+def scan_topk(dist_fn: Callable[[int, int], np.ndarray], num_queries: int, num_vectors: int,
+              top_k: int, block_size: int = 8192) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exhaustive top-k search that scores the vectors in tiles of ``block_size`` rows via ``dist_fn(start, end)``,
+    which returns the [num_queries, end - start] distances, so that the peak memory is bounded by
+    ``num_queries * (block_size + top_k)`` regardless of the index size
+
+    :return: a tuple of (vector indices, distances), both in the shape of [num_queries, top_k]
+    """
+    best_idx = np.empty([num_queries, 0], dtype=np.int64)
+    best_dist = np.empty([num_queries, 0], dtype=np.float64)
+    for start in range(0, num_vectors, block_size):
+        end = min(start + block_size, num_vectors)
+        idx, dist = topk_smallest(dist_fn(start, end), top_k)
+        best_idx, best_dist = merge_topk(np.concatenate([best_idx, idx + start], axis=1),
+                                         np.concatenate([best_dist, dist], axis=1), top_k)
+    return best_idx, best_dist
+
+
+def blocked_topk(queries: np.ndarray, vectors: np.ndarray, top_k: int, metric: str = 'l1',
+                 block_size: int = 8192, vector_norms: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exhaustive top-k search of ``queries`` in ``vectors``, see :py:func:`scan_topk`
+
+    :return: a tuple of (vector indices, distances), both in the shape of [num_queries, top_k]
+    """
+    return scan_topk(lambda start, end: pairwise_distance(
+        queries, vectors[start:end], metric, vector_norms[start:end] if vector_norms is not None else None),
+                     queries.shape[0], vectors.shape[0], top_k, block_size)
+
+
+def probed_topk(probes: np.ndarray, list_fn: Callable[[int, np.ndarray], Tuple[np.ndarray, np.ndarray]],
+                top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k search over inverted lists, every list is searched once for all the queries probing it
+
+    :param probes: [num_queries, nprobe] the lists probed by every query
+    :param list_fn: ``list_fn(list_id, query_idx)`` returns the (ids, distances) of the
+            top-k hits of the queries ``query_idx`` in the list ``list_id``, both in the shape of [len(query_idx), k]
+    :return: a tuple of (ids, distances), both in the shape of [num_queries, top_k],
+            unfilled hits have the id -1 and the distance inf
+    """
+    best_idx = np.full([probes.shape[0], top_k], -1, dtype=np.int64)
+    best_dist = np.full([probes.shape[0], top_k], np.inf, dtype=np.float64)
+    # group the queries by the probed list in one sort
+    order = np.argsort(probes, axis=None, kind='stable')
+    list_ids = probes.ravel()[order]
+    bounds = np.flatnonzero(np.diff(list_ids)) + 1
+    for list_id, q_idx in zip(list_ids[np.concatenate([[0], bounds])].tolist(),
+                              np.split(order // probes.shape[1], bounds)):
+        idx, dist = list_fn(list_id, q_idx)
+        best_idx[q_idx], best_dist[q_idx] = merge_topk(np.concatenate([best_idx[q_idx], idx], axis=1),
+                                                       np.concatenate([best_dist[q_idx], dist], axis=1), top_k)
+    return best_idx, best_dist
+
+
+def collect_hits(ids: np.ndarray, score: np.ndarray, key_indexer: ColumnarKeyIndexer) -> List[List[Tuple]]:
+    """
+    Turn the top-k (ids, distances) into the (doc_id, offset, weight, score) hits of every query
+
+    :param ids: [num_queries, top_k] the row ids of the hits, -1 for an unfilled hit
+    :param score: [num_queries, top_k] the distances of the hits
+    :param key_indexer: maps a row id to its (doc_id, offset, weight)
+    """
+    ret = []
+    for _ids, _score in zip(ids.tolist(), score.tolist()):
+        # the lists probed by a query may have less than top_k rows in total
+        hits = [(i, s) for i, s in zip(_ids, _score) if i >= 0]
+        chunk_info = key_indexer.query([i for i, _ in hits])
+        ret.append([(*r, s) for r, (_, s) in zip(chunk_info, hits)])
+    return ret
 
 
 class NumpyIndexer(BCI):
     """An exhaustive search indexer using numpy
-    The distance is computed as L1 distance normalized by the number of dimension
+    By default the distance is computed as L1 distance normalized by the number of dimension,
+    see :py:func:`pairwise_distance` for the other metrics
+
+    With ``num_lists > 0``, it becomes an inverted-file (IVF) index: the vectors are partitioned by
+    the coarse centroids of a k-means trained in :py:meth:`train`, every list is stored contiguously,
+    and a query only scans its ``nprobe`` nearest lists.
     """
 
-    def __init__(self, is_binary: bool = False, *args, **kwargs):
+    def __init__(self, is_binary: bool = False, metric: str = 'l1', block_size: int = 8192,
+                 num_lists: int = 0, nprobe: int = 1, *args, **kwargs):
+        """
+        :param is_binary: compare vectors element-wise, equivalent to ``metric='hamming'``
+        :param metric: one of "l1", "l2", "inner_product", "cosine" and "hamming"
+        :param block_size: number of indexed vectors scored at once at query time
+        :param num_lists: number of the coarse lists, 0 means exhaustive search
+        :param nprobe: number of the lists scanned per query
+        """
         super().__init__(*args, **kwargs)
+        if metric not in _METRICS:
+            raise ValueError('unknown metric: %s, must be one of %s' % (metric, _METRICS))
         self._num_dim = None
-        self._vectors = None  # type: np.ndarray
+        self._vectors = GrowableArray()
         self._is_binary = is_binary
-        self.helper_indexer = ListKeyIndexer()
+        self.metric = 'hamming' if is_binary else metric
+        self.block_size = block_size
+        if num_lists and self.metric == 'hamming':
+            raise ValueError('coarse lists can not be trained for the metric "hamming"')
+        self.num_lists = num_lists
+        self.nprobe = nprobe
+        self.coarse_centroids = None  # type: np.ndarray
+        self._lists = InvertedLists(num_lists) if num_lists else None
+        self.helper_indexer = self.helper_indexer or ColumnarKeyIndexer()
 
+    def train(self, vecs: np.ndarray, *args, **kwargs):
+        """Train the coarse centroids, only needed when ``num_lists > 0``"""
+        if self._is_ivf:
+            if self.metric == 'cosine':
+                vecs = vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), np.finfo(np.float32).tiny)
+            self.coarse_centroids = kmeans(vecs, self.num_lists)
+
+    @property
+    def _is_ivf(self) -> bool:
+        return getattr(self, '_lists', None) is not None
+
+    def __setstate__(self, d):
+        if not isinstance(d['_vectors'], GrowableArray):
+            # the earlier versions kept the vectors in a plain ndarray and only had the (binary) l1 distance
+            d['_vectors'] = GrowableArray.from_array(d['_vectors']) if d['_vectors'] is not None else GrowableArray()
+            d.setdefault('metric', 'hamming' if d.get('_is_binary') else 'l1')
+            d.setdefault('block_size', 8192)
+        super().__setstate__(d)
+
+    def _probe(self, vectors: np.ndarray, nprobe: int) -> np.ndarray:
+        return topk_smallest(pairwise_distance(vectors, self.coarse_centroids, self.metric), nprobe)[0]
+
+    @BCI.append_log
     @BCI.update_helper_indexer
     def add(self, keys: List[Tuple[int, Any]], vectors: np.ndarray, weights: List[float], *args,
             **kwargs):
@@ -47,22 +256,31 @@ class NumpyIndexer(BCI):
                 "vectors' shape [%d, %d] does not match with indexer's dim: %d" %
                 (vectors.shape[0], vectors.shape[1], self._num_dim))
 
-        if self._vectors is not None:
-            self._vectors = np.concatenate([self._vectors, vectors], axis=0)
+        if self._is_ivf:
+            if self.coarse_centroids is None:
+                raise RuntimeError('training is required before calling "add"')
+            ids = np.arange(len(vectors)) + self._lists.size
+            self._lists.add(self._probe(vectors, 1)[:, 0], vectors, ids)
         else:
-            self._vectors = vectors
-
-    def query(self, keys: np.ndarray, top_k: int, *args, **kwargs) -> List[List[Tuple]]:
-        dist = np.abs(np.expand_dims(keys, axis=1) - np.expand_dims(self._vectors, axis=0))
+            self._vectors.append(vectors)
 
-        if self._is_binary:
-            dist = np.minimum(dist, 1)
+    def query(self, keys: np.ndarray, top_k: int, nprobe: int = None, *args, **kwargs) -> List[List[Tuple]]:
+        """
+        :param nprobe: override the number of the lists scanned per query
+        """
+        if not (self._lists if self._is_ivf else self._vectors).size:
+            return [[] for _ in range(keys.shape[0])]
 
-        score = np.sum(dist, -1) / self._num_dim
+        if self._is_ivf:
+            def list_fn(list_id, q_idx):
+                vectors = self._lists.rows(list_id)
+                if vectors is None:
+                    return np.empty([len(q_idx), 0], dtype=np.int64), np.empty([len(q_idx), 0])
+                idx, dist = blocked_topk(keys[q_idx], vectors, top_k, self.metric, self.block_size)
+                return self._lists.ids(list_id)[idx], dist
 
-        ret = []
-        for ids in score:
-            rk = sorted(enumerate(ids), key=lambda x: x[1])[:top_k]
-            chunk_info = self.helper_indexer.query([j[0] for j in rk])
-            ret.append([(*r, s) for r, s in zip(chunk_info, [j[1] for j in rk])])
-        return ret
+            probes = self._probe(keys, min(nprobe or self.nprobe, self.num_lists))
+            ids, score = probed_topk(probes, list_fn, top_k)
+        else:
+            ids, score = blocked_topk(keys, self._vectors.data, top_k, self.metric, self.block_size)
+        return collect_hits(ids, score, self.helper_indexer)
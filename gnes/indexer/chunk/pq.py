@@ -0,0 +1,154 @@
+#  Tencent is pleased to support the open source community by making GNES available.
+#
+#  Copyright (C) 2019 THL A29 Limited, a Tencent company. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+from typing import List, Tuple, Any, Union
+
+import numpy as np
+
+from .helper import ColumnarKeyIndexer, GrowableArray, InvertedLists
+from .numpy import pairwise_distance, topk_smallest, scan_topk, probed_topk, collect_hits
+from ..base import BaseChunkIndexer as BCI
+from ...helper import adc_table, centroid_norms, nearest_centroids, kmeans
+
+
+def adc_distance(tables: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """
+    Sum up the lookup tables of :py:func:`adc_table` over the sub-spaces
+
+    :param tables: [num_queries, num_sub, num_clusters]
+    :param codes: [num_codes, num_sub] zero-based codes
+    :return: [num_queries, num_codes]
+    """
+    dist = np.zeros([tables.shape[0], codes.shape[0]], dtype=tables.dtype)
+    for s in range(codes.shape[1]):
+        dist += tables[:, s, codes[:, s]]
+    return dist
+
+
+class PQIndexer(BCI):
+    """A product quantization indexer that searches the codes of :py:class:`PQEncoder`
+    with the asymmetric distance (ADC): the float query is compared with the reconstructed vectors
+    via per-query lookup tables, so the quantization error is only on the indexed side.
+    The distance is the squared l2 distance, queries given as codes are reconstructed first.
+
+    With ``num_lists > 0``, the vectors are partitioned by a coarse k-means trained in :py:meth:`train`
+    (IVF), and a query only scans the codes in its ``nprobe`` nearest lists.
+    """
+
+    def __init__(self, encoder_path: str = None, num_lists: int = 0, nprobe: int = 1,
+                 block_size: int = 65536, *args, **kwargs):
+        """
+        :param encoder_path: dump of a trained :py:class:`PQEncoder`, whose centroids are used as the codebook.
+                it is read on first use, the codebook can also be given via :py:meth:`set_codebook`
+        :param num_lists: number of the coarse lists, 0 means all codes are scanned
+        :param nprobe: number of the lists scanned per query
+        :param block_size: number of codes scored at once at query time
+        """
+        super().__init__(*args, **kwargs)
+        self.encoder_path = encoder_path
+        self.num_lists = num_lists
+        self.nprobe = nprobe
+        self.block_size = block_size
+        self.codebook = None  # type: np.ndarray
+        self.codebook_norms = None  # type: np.ndarray
+        self.coarse_centroids = None  # type: np.ndarray
+        self._codes = InvertedLists(num_lists, np.uint8) if num_lists else GrowableArray(np.uint8)
+        self.helper_indexer = self.helper_indexer or ColumnarKeyIndexer()
+
+    def set_codebook(self, encoder: Union['PQEncoder', np.ndarray]) -> None:
+        """
+        :param encoder: a trained :py:class:`PQEncoder` or its centroids
+        """
+        centroids = np.asarray(getattr(encoder, 'centroids', encoder), dtype=np.float32)
+        self.codebook = np.reshape(centroids, centroids.shape[-3:])
+        self.codebook_norms = centroid_norms(self.codebook)
+
+    def _get_codebook(self) -> np.ndarray:
+        if self.codebook is None and self.encoder_path:
+            from ...encoder.numeric.pq import PQEncoder
+            self.set_codebook(PQEncoder.load(self.encoder_path))
+        if self.codebook is None:
+            raise RuntimeError('codebook is not set, give "encoder_path" or call "set_codebook" first')
+        return self.codebook
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        # zero-based codes, PQEncoder starts from 1 as 0 is reserved
+        codebook = self._get_codebook()
+        if vectors.dtype == np.uint8:
+            if vectors.shape[1] != codebook.shape[0]:
+                raise ValueError('codes of %d bytes do not match the codebook of %d bytes' %
+                                 (vectors.shape[1], codebook.shape[0]))
+            return np.maximum(vectors, 1) - 1
+        x = np.reshape(vectors, [vectors.shape[0], codebook.shape[0], codebook.shape[2]])
+        return nearest_centroids(x, codebook, self.codebook_norms, dtype=np.uint8)
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        codebook = self._get_codebook()
+        return np.reshape(codebook[np.arange(codebook.shape[0]), codes], [codes.shape[0], -1])
+
+    def _as_float(self, vectors: np.ndarray) -> np.ndarray:
+        return self._decode(self._encode(vectors)) if vectors.dtype == np.uint8 else vectors
+
+    def _probe(self, vectors: np.ndarray, nprobe: int) -> np.ndarray:
+        return topk_smallest(pairwise_distance(vectors, self.coarse_centroids, 'l2'), nprobe)[0]
+
+    def train(self, vecs: np.ndarray, *args, **kwargs):
+        """Train the coarse centroids on float vectors or codes, only needed when ``num_lists > 0``"""
+        if self.num_lists:
+            self.coarse_centroids = kmeans(self._as_float(vecs), self.num_lists)
+
+    @BCI.append_log
+    @BCI.update_helper_indexer
+    def add(self, keys: List[Tuple[int, Any]], vectors: np.ndarray, weights: List[float], *args, **kwargs):
+        if len(vectors) != len(keys):
+            raise ValueError('vectors length should be equal to doc_ids')
+
+        codes = self._encode(vectors)
+        if self.num_lists:
+            if self.coarse_centroids is None:
+                raise RuntimeError('training is required before calling "add"')
+            ids = np.arange(len(keys)) + self.helper_indexer.num_chunks
+            vectors = self._decode(codes) if vectors.dtype == np.uint8 else vectors
+            self._codes.add(self._probe(vectors, 1)[:, 0], codes, ids)
+        else:
+            self._codes.append(codes)
+
+    def query(self, keys: np.ndarray, top_k: int, nprobe: int = None, *args, **kwargs) -> List[List[Tuple]]:
+        """
+        :param keys: [num_queries, dim] float vectors, or [num_queries, num_bytes] codes of :py:class:`PQEncoder`
+        :param nprobe: override the number of the lists scanned per query
+        """
+        if not self._codes.size:
+            return [[] for _ in range(keys.shape[0])]
+
+        keys = self._as_float(keys)
+        tables = adc_table(keys, self._get_codebook(), self.codebook_norms)
+        if self.num_lists:
+            def list_fn(list_id, q_idx):
+                codes = self._codes.rows(list_id)
+                if codes is None:
+                    return np.empty([len(q_idx), 0], dtype=np.int64), np.empty([len(q_idx), 0])
+                idx, dist = scan_topk(lambda s, e: adc_distance(tables[q_idx], codes[s:e]),
+                                      len(q_idx), len(codes), top_k, self.block_size)
+                return self._codes.ids(list_id)[idx], dist
+
+            probes = self._probe(keys, min(nprobe or self.nprobe, self.num_lists))
+            ids, score = probed_topk(probes, list_fn, top_k)
+        else:
+            codes = self._codes.data
+            ids, score = scan_topk(lambda s, e: adc_distance(tables, codes[s:e]),
+                                   len(keys), len(codes), top_k, self.block_size)
+        return collect_hits(ids, score, self.helper_indexer)
@@ -13,23 +13,66 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-from typing import List
+from typing import List, Callable, Tuple, Optional
 
-from google.protobuf.json_format import MessageToJson, Parse
+from google.protobuf.json_format import Parse
 
 from ..base import BaseDocIndexer as BDI
 from ...proto import gnes_pb2
 
+_CODECS = {None, 'zstd', 'lz4'}
+
+
+def _get_codec(compress: Optional[str]) -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    if compress == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+    elif compress == 'lz4':
+        import lz4.frame
+        return lz4.frame.compress, lz4.frame.decompress
+    else:
+        return (lambda x: x), (lambda x: x)
+
 
 class DictIndexer(BDI):
+    """Keep the documents in memory as serialized protobuf, optionally compressed"""
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, compress: str = None,
+                 drop_raw_bytes: bool = False,
+                 drop_chunk_blob: bool = False,
+                 *args, **kwargs):
+        """
+        :param compress: compress every stored document with "zstd" or "lz4", None for no compression
+        :param drop_raw_bytes: do not store the raw bytes of the documents
+        :param drop_chunk_blob: do not store the blobs of the chunks
+        """
         super().__init__(*args, **kwargs)
+        if compress not in _CODECS:
+            raise ValueError('unknown compression: %s, must be one of %s' % (compress, _CODECS))
+        self.compress = compress
+        self.drop_raw_bytes = drop_raw_bytes
+        self.drop_chunk_blob = drop_chunk_blob
         self._content = {}
 
+    def post_init(self):
+        super().post_init()
+        self._compressor, self._decompressor = _get_codec(getattr(self, 'compress', None))
+        if any(isinstance(v, str) for v in self._content.values()):
+            # loaded from a dump of the old versions, which kept the documents as JSON
+            self._content = {k: self._compressor(Parse(v, gnes_pb2.Document()).SerializeToString())
+                             for k, v in self._content.items()}
+
+    @BDI.append_log
     @BDI.update_counter
     def add(self, keys: List[int], docs: List['gnes_pb2.Document'], *args, **kwargs):
-        self._content.update({k: MessageToJson(d) for (k, d) in zip(keys, docs)})
+        for k, d in zip(keys, docs):
+            if self.drop_raw_bytes:
+                d.ClearField('raw_bytes')
+            if self.drop_chunk_blob:
+                for c in d.chunks:
+                    c.ClearField('blob')
+            self._content[k] = self._compressor(d.SerializeToString())
 
+    @BDI.cached_query
     def query(self, keys: List[int], *args, **kwargs) -> List['gnes_pb2.Document']:
-        return [Parse(self._content[k], gnes_pb2.Document()) for k in keys]
+        return [gnes_pb2.Document.FromString(self._decompressor(self._content[k])) for k in keys]
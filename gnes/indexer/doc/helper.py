@@ -0,0 +1,41 @@
+#  Tencent is pleased to support the open source community by making GNES available.
+#
+#  Copyright (C) 2019 THL A29 Limited, a Tencent company. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pickle
+import struct
+
+# doc_id as a fixed-width big-endian integer, so that the byte order of the keys follows the numeric order
+_KEY_FORMAT = struct.Struct('>Q')
+
+# written to a store when it is created, a non-empty store without it has the pickled keys of the earlier versions.
+# it is never mistaken for a doc key, which is always 8 bytes long
+FORMAT_KEY = b'__gnes_key_format__'
+FORMAT_VERSION = b'1'
+
+
+def int2key(doc_id: int) -> bytes:
+    return _KEY_FORMAT.pack(doc_id)
+
+
+def key2int(key: bytes) -> int:
+    return _KEY_FORMAT.unpack(key)[0]
+
+
+def legacy_key2int(key: bytes) -> int:
+    """Decode a key of the earlier versions, which stored the pickled doc_id"""
+    doc_id = pickle.loads(key)
+    if not isinstance(doc_id, int):
+        raise ValueError('%r is not a pickled doc_id' % key)
+    return doc_id
@@ -14,10 +14,10 @@
 #  limitations under the License.
 
 
-import pickle
 from threading import Thread, Event
-from typing import List, Any
+from typing import List, Any, Dict
 
+from .helper import int2key, legacy_key2int, FORMAT_KEY, FORMAT_VERSION
 from ..base import BaseDocIndexer as BDI
 from ...proto import gnes_pb2
 
@@ -37,14 +37,38 @@ class LVDBIndexer(BDI):
         self._NOT_FOUND = None
 
     def post_init(self):
+        super().post_init()
         import plyvel
         self._db = plyvel.DB(self.data_path, create_if_missing=True)
+        self._check_key_format()
+
+    def _check_key_format(self):
+        version = self._db.get(FORMAT_KEY)
+        if version == FORMAT_VERSION:
+            return
+        if version is not None:
+            raise ValueError('%s has an unknown key format: %r' % (self.data_path, version))
+        with self._db.iterator(include_value=False) as it:
+            is_legacy = next(it, None) is not None
+        with self._db.write_batch(transaction=True) as wb:
+            if is_legacy:
+                self.logger.warning('%s has the pickled keys of an earlier version, '
+                                    'migrating them to fixed-width keys' % self.data_path)
+                # the iterators read the store before the batch is written, all deletes come first
+                # so that they never remove a migrated key
+                with self._db.iterator(include_value=False) as it:
+                    for k in it:
+                        wb.delete(k)
+                with self._db.iterator() as it:
+                    for k, v in it:
+                        wb.put(int2key(legacy_key2int(k)), v)
+            wb.put(FORMAT_KEY, FORMAT_VERSION)
 
     @BDI.update_counter
     def add(self, keys: List[int], docs: List['gnes_pb2.Document'], *args, **kwargs):
         with self._db.write_batch() as wb:
             for k, d in zip(keys, docs):
-                doc_id = pickle.dumps(k)
+                doc_id = int2key(k)
                 if self.drop_raw_bytes:
                     d.raw_bytes = b''
                 if self.drop_chunk_blob:
@@ -54,18 +78,27 @@ class LVDBIndexer(BDI):
                 wb.put(doc_id, doc)
 
     def query(self, keys: List[int], *args, **kwargs) -> List['gnes_pb2.Document']:
-        res = []
-        for k in keys:
-            doc_id = pickle.dumps(k)
-            v = self._db.get(doc_id)
-            doc = gnes_pb2.Document()
-            if v is not None:
-                doc.ParseFromString(v)
-                res.append(doc)
-            elif self.keep_na_doc:
-                res.append(self._NOT_FOUND)
+        res = self._query(keys)
+        if not self.keep_na_doc:
+            res = [d for d in res if d is not None]
         return res
 
+    @BDI.cached_query
+    def _query(self, keys: List[int]) -> List['gnes_pb2.Document']:
+        db_keys = [int2key(k) for k in keys]
+        values = self._multi_get(db_keys)
+        return [gnes_pb2.Document.FromString(values[k]) if k in values else self._NOT_FOUND for k in db_keys]
+
+    def _multi_get(self, keys: List[bytes]) -> Dict[bytes, bytes]:
+        # one iterator seeks through the sorted keys, so the reads go forward through the sorted tables on disk
+        res = {}
+        with self._db.iterator() as it:
+            for k in sorted(set(keys)):
+                it.seek(k)
+                kv = next(it, None)
+                if kv is not None and kv[0] == k:
+                    res[k] = kv[1]
+        return res
 
     def close(self):
         super().close()
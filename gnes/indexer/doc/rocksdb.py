@@ -15,9 +15,9 @@
 
 
 import gc
-import pickle
 from typing import List, Any
 
+from .helper import int2key, key2int, legacy_key2int, FORMAT_KEY, FORMAT_VERSION
 from ..base import BaseDocIndexer as BDI
 from ...proto import gnes_pb2
 
@@ -37,8 +37,9 @@ class RocksDBIndexer(BDI):
         self.kwargs = kwargs
 
     def post_init(self):
+        super().post_init()
         import rocksdb
-        
+
         opts = rocksdb.Options()
         opts.create_if_missing = True
         opts.max_open_files = 300000
@@ -55,6 +56,40 @@ class RocksDBIndexer(BDI):
             setattr(opts, key, value)
 
         self._db = rocksdb.DB(self.data_path, opts, read_only=self.read_only)
+        self._check_key_format()
+
+    def _check_key_format(self):
+        import rocksdb
+
+        version = self._db.get(FORMAT_KEY)
+        if version == FORMAT_VERSION:
+            return
+        if version is not None:
+            raise ValueError('%s has an unknown key format: %r' % (self.data_path, version))
+        it = self._db.iterkeys()
+        it.seek_to_first()
+        is_legacy = next(it, None) is not None
+        if self.read_only:
+            if is_legacy:
+                raise ValueError('%s has the pickled keys of an earlier version, '
+                                 'open it once without "read_only" to migrate them' % self.data_path)
+            return
+
+        write_batch = rocksdb.WriteBatch()
+        if is_legacy:
+            self.logger.warning('%s has the pickled keys of an earlier version, '
+                                'migrating them to fixed-width keys' % self.data_path)
+            # all deletes come first, so that they never remove a migrated key
+            it = self._db.iterkeys()
+            it.seek_to_first()
+            for k in it:
+                write_batch.delete(k)
+            it = self._db.iteritems()
+            it.seek_to_first()
+            for k, v in it:
+                write_batch.put(int2key(legacy_key2int(k)), v)
+        write_batch.put(FORMAT_KEY, FORMAT_VERSION)
+        self._db.write(write_batch, sync=True)
 
 
     @BDI.update_counter
@@ -63,7 +98,7 @@ class RocksDBIndexer(BDI):
 
         write_batch = rocksdb.WriteBatch()
         for k, d in zip(keys, docs):
-            key_bytes = pickle.dumps(k)
+            key_bytes = int2key(k)
             if self.drop_raw_data:
                 d.ClearField('raw_data')
             if self.drop_chunk_blob:
@@ -74,11 +109,9 @@ class RocksDBIndexer(BDI):
         self._db.write(write_batch, sync=True)
 
 
+    @BDI.cached_query
     def query(self, keys: List[int], *args, **kwargs) -> List['gnes_pb2.Document']:
-        query_keys = []
-        for k in keys:
-            key_value = pickle.dumps(k)
-            query_keys.append(key_value)
+        query_keys = [int2key(k) for k in keys]
 
         values = self._db.multi_get(query_keys)
         
@@ -106,7 +139,9 @@ class RocksDBIndexer(BDI):
             iterator = reversed(iterator)
     
         for key_bytes in iterator:
-            doc_id = pickle.loads(key_bytes)
+            if key_bytes == FORMAT_KEY:
+                continue
+            doc_id = key2int(key_bytes)
             value_bytes = self._db.get(key_bytes)
             pb_doc = gnes_pb2.Document()
             pb_doc.ParseFromString(value_bytes)
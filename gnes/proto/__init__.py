@@ -16,7 +16,7 @@
 import ctypes
 import os
 import random
-from typing import List, Iterator, Tuple
+from typing import List, Iterator, Tuple, Iterable
 from typing import Optional
 
 import numpy as np
@@ -27,7 +27,8 @@ from . import gnes_pb2
 from ..helper import batch_iterator, default_logger
 
 __all__ = ['RequestGenerator', 'send_message', 'recv_message',
-           'blob2array', 'array2blob', 'gnes_pb2', 'add_route', 'add_version']
+           'blob2array', 'blobs2array', 'array2blob', 'gnes_pb2', 'add_route', 'add_version',
+           'pack_chunk_embeddings', 'unpack_chunk_embeddings']
 
 
 class RequestGenerator:
@@ -74,8 +75,8 @@ class RequestGenerator:
         request_id_start += 1
 
     @staticmethod
-    def query(query: bytes, top_k: int, doc_type: int = gnes_pb2.Document.TEXT, request_id_start: int = 0, *args,
-              **kwargs):
+    def query(query: bytes, top_k: int, doc_type: int = gnes_pb2.Document.TEXT, request_id_start: int = 0,
+              explain: bool = False, *args, **kwargs):
         if top_k <= 0:
             raise ValueError('"top_k: %d" is not a valid number' % top_k)
 
@@ -84,17 +85,40 @@ class RequestGenerator:
         req.search.query.raw_bytes = query
         req.search.query.doc_type = doc_type
         req.search.top_k = top_k
+        req.search.explain = explain
         yield req
 
 
-def blob2array(blob: 'gnes_pb2.NdArray') -> np.ndarray:
+def blob2array(blob: 'gnes_pb2.NdArray', copy: bool = True) -> np.ndarray:
     """
     Convert a blob proto to an array.
+
+    :param copy: when set to false, return a read-only view over the bytes of the blob without copying
     """
-    x = np.frombuffer(blob.data, dtype=blob.dtype).copy()
+    x = np.frombuffer(blob.data, dtype=blob.dtype)
+    if copy:
+        x = x.copy()
     return x.reshape(blob.shape)
 
 
+def blobs2array(blobs: Iterable['gnes_pb2.NdArray']) -> np.ndarray:
+    """
+    Stack a sequence of blob protos of the same dtype and shape into one read-only array,
+    the bytes are joined in a single allocation instead of decoding each blob and calling ``np.stack``.
+
+    :return: an array in the shape of [num_blobs, *blob.shape]
+    """
+    blobs = list(blobs)
+    if not blobs:
+        raise ValueError('"blobs" must contain at least one blob')
+    dtype, shape = blobs[0].dtype, tuple(blobs[0].shape)
+    for b in blobs:
+        if b.dtype != dtype or tuple(b.shape) != shape:
+            raise ValueError('can not stack a blob of %s%s with blobs of %s%s' % (b.dtype, b.shape, dtype, shape))
+    x = np.frombuffer(b''.join(b.data for b in blobs), dtype=dtype)
+    return x.reshape([len(blobs), *shape])
+
+
 def array2blob(x: np.ndarray) -> 'gnes_pb2.NdArray':
     """Converts a N-dimensional array to blob proto.
     """
@@ -105,6 +129,39 @@ def array2blob(x: np.ndarray) -> 'gnes_pb2.NdArray':
     return blob
 
 
+def pack_chunk_embeddings(doc: 'gnes_pb2.Document', embeds: np.ndarray, chunk_idx: List[int] = None) -> None:
+    """
+    Store the embeddings of the chunks of a document as one packed array
+
+    :param doc: the document
+    :param embeds: [num_embedded_chunks, dim]
+    :param chunk_idx: the position of the chunk that each row belongs to, default all chunks in order
+    """
+    if chunk_idx is None:
+        chunk_idx = range(len(doc.chunks))
+    if len(chunk_idx) != embeds.shape[0]:
+        raise ValueError('mismatched %d chunk indices and a %s shape embedding' % (len(chunk_idx), embeds.shape))
+    for c in doc.chunks:
+        c.ClearField('embedding')
+    doc.chunk_embeddings.CopyFrom(array2blob(embeds))
+    doc.ClearField('chunk_embedding_idx')
+    doc.chunk_embedding_idx.extend(chunk_idx)
+
+
+def unpack_chunk_embeddings(doc: 'gnes_pb2.Document') -> Tuple[Optional[np.ndarray], List[int]]:
+    """
+    Read the embeddings of the chunks of a document, either packed or set on each chunk
+
+    :return: a tuple of a read-only [num_embedded_chunks, dim] array (or None) and the chunk position of each row
+    """
+    if doc.HasField('chunk_embeddings'):
+        return blob2array(doc.chunk_embeddings, copy=False), list(doc.chunk_embedding_idx)
+    chunk_idx = [j for j, c in enumerate(doc.chunks) if c.embedding.data]
+    if chunk_idx:
+        return blobs2array(doc.chunks[j].embedding for j in chunk_idx), chunk_idx
+    return None, []
+
+
 def router2str(m: 'gnes_pb2.Message') -> str:
     route_str = [r.service for r in m.envelope.routes]
     return colored('▸', 'green').join(route_str)
@@ -124,13 +181,6 @@ def add_version(evlp: 'gnes_pb2.Envelope'):
     evlp.vcs_version = os.environ.get('GNES_VCS_VERSION', '')
 
 
-def merge_routes(msg: 'gnes_pb2.Message', prev_msgs: List['gnes_pb2.Message']):
-    # take unique routes by service identity
-    routes = {(r.service + r.service_identity): r for m in prev_msgs for r in m.envelope.routes}
-    msg.envelope.ClearField('routes')
-    msg.envelope.routes.extend(sorted(routes.values(), key=lambda x: (x.start_time.seconds, x.start_time.nanos)))
-
-
 def check_msg_version(msg: 'gnes_pb2.Message'):
     from .. import __version__, __proto_version__
     if hasattr(msg.envelope, 'gnes_version'):
@@ -175,6 +225,7 @@ def check_msg_version(msg: 'gnes_pb2.Message'):
 def extract_bytes_from_msg(msg: 'gnes_pb2.Message') -> Tuple:
     doc_bytes = []
     chunk_bytes = []
+    packed_bytes = []
     doc_byte_type = b''
     chunk_byte_type = b''
 
@@ -202,6 +253,10 @@ def extract_bytes_from_msg(msg: 'gnes_pb2.Message') -> Tuple:
             doc_bytes.append(d.raw_text.encode())
             d.ClearField('raw_text')
 
+        if d.HasField('chunk_embeddings'):
+            packed_bytes.append(d.chunk_embeddings.data)
+            d.chunk_embeddings.ClearField('data')
+
         for c in d.chunks:
             # oneof content {
             # string text = 2;
@@ -223,7 +278,7 @@ def extract_bytes_from_msg(msg: 'gnes_pb2.Message') -> Tuple:
                 chunk_bytes.append(c.text.encode())
                 c.ClearField('text')
 
-    return doc_bytes, doc_byte_type, chunk_bytes, chunk_byte_type
+    return doc_bytes, doc_byte_type, chunk_bytes, chunk_byte_type, b''.join(packed_bytes)
 
 
 def fill_raw_bytes_to_msg(msg: 'gnes_pb2.Message', msg_data: List[bytes]):
@@ -233,7 +288,10 @@ def fill_raw_bytes_to_msg(msg: 'gnes_pb2.Message', msg_data: List[bytes]):
     chunk_bytes_len = int(msg_data[5])
 
     doc_bytes = msg_data[6:(6 + doc_bytes_len)]
-    chunk_bytes = msg_data[(6 + doc_bytes_len):]
+    chunk_bytes = msg_data[(6 + doc_bytes_len):(6 + doc_bytes_len + chunk_bytes_len)]
+    # all packed chunk embeddings are concatenated in the last frame
+    packed_bytes = msg_data[6 + doc_bytes_len + chunk_bytes_len] \
+        if len(msg_data) > 6 + doc_bytes_len + chunk_bytes_len else b''
 
     if len(chunk_bytes) != chunk_bytes_len:
         raise ValueError('"chunk_bytes_len"=%d in message, but the actual length is %d' % (
@@ -241,8 +299,14 @@ def fill_raw_bytes_to_msg(msg: 'gnes_pb2.Message', msg_data: List[bytes]):
 
     c_idx = 0
     d_idx = 0
+    p_idx = 0
     docs = msg.request.train.docs or msg.request.index.docs or [msg.request.search.query]
     for d in docs:
+        if d.HasField('chunk_embeddings'):
+            p_len = int(np.prod(d.chunk_embeddings.shape)) * np.dtype(d.chunk_embeddings.dtype).itemsize
+            d.chunk_embeddings.data = packed_bytes[p_idx:(p_idx + p_len)]
+            p_idx += p_len
+
         if doc_bytes and doc_bytes[d_idx]:
             if doc_byte_type == 'raw_bytes':
                 d.raw_bytes = doc_bytes[d_idx]
@@ -284,14 +348,15 @@ def send_message(sock: 'zmq.Socket', msg: 'gnes_pb2.Message', timeout: int = -1,
         if not squeeze_pb:
             sock.send_multipart([msg.envelope.client_id.encode(), msg.SerializeToString()])
         else:
-            doc_bytes, doc_byte_type, chunk_bytes, chunk_byte_type = extract_bytes_from_msg(msg)
+            doc_bytes, doc_byte_type, chunk_bytes, chunk_byte_type, packed_bytes = extract_bytes_from_msg(msg)
             # now raw_bytes are removed from message, hoping for faster de/serialization
             sock.send_multipart(
                 [msg.envelope.client_id.encode(),  # 0
                  msg.SerializeToString(),  # 1
                  doc_byte_type, chunk_byte_type,  # 2, 3
                  b'%d' % len(doc_bytes), b'%d' % len(chunk_bytes),  # 4, 5
-                 *doc_bytes, *chunk_bytes])  # 6, 7
+                 *doc_bytes, *chunk_bytes,  # 6, 7
+                 *([packed_bytes] if packed_bytes else [])])  # 8
     except zmq.error.Again:
         raise TimeoutError(
             'cannot send message to sock %s after timeout=%dms, please check the following:'
@@ -13,11 +13,13 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 from collections import defaultdict
-from typing import List, Generator
+from typing import List, Generator, Optional, Dict, Any
+
+import numpy as np
 
 from gnes.score_fn.base import CombinedScoreFn
 from ..base import TrainableBase, CompositionalTrainableBase
-from ..proto import gnes_pb2, merge_routes, array2blob
+from ..proto import gnes_pb2, array2blob, pack_chunk_embeddings, unpack_chunk_embeddings
 
 
 class BaseRouter(TrainableBase):
@@ -49,7 +51,39 @@ class BaseReduceRouter(BaseRouter):
         :param msg: the current message
         :param accum_msgs: accumulated messages
         """
-        merge_routes(msg, accum_msgs)
+        state = None
+        for m in accum_msgs:
+            state = self.accumulate(state, m)
+        self.finalize(state, msg)
+
+    def accumulate(self, state: Optional[Dict], msg: 'gnes_pb2.Message') -> Dict:
+        """
+        Fold one part of a multi-part message into the reduce state, so that the part can be released
+
+        :param state: the state returned by the last call, None on the first part
+        :param msg: a part of the message
+        :return: the new state
+        """
+        state = state or {'routes': {}, 'is_partial': False}
+        state['is_partial'] |= msg.envelope.is_partial
+        for r in msg.envelope.routes:
+            # take unique routes by service identity, copied so that the message is not referred
+            route = gnes_pb2.Envelope.route()
+            route.CopyFrom(r)
+            state['routes'][r.service + r.service_identity] = route
+        return state
+
+    def finalize(self, state: Dict, msg: 'gnes_pb2.Message') -> None:
+        """
+        Write the reduced state into the current message, which is the last part
+
+        :param state: the state after all parts are accumulated
+        :param msg: the current message
+        """
+        msg.envelope.ClearField('routes')
+        msg.envelope.routes.extend(sorted(state['routes'].values(),
+                                          key=lambda x: (x.start_time.seconds, x.start_time.nanos)))
+        msg.envelope.is_partial = state['is_partial']
         if len(msg.envelope.num_part) > 1:
             msg.envelope.num_part.pop()
         else:
@@ -57,11 +91,24 @@ class BaseReduceRouter(BaseRouter):
                 'message envelope says num_part=%s, means no further message reducing. '
                 'ignore this if you explicitly set "num_part" in RouterService' % msg.envelope.num_part)
 
+    @property
+    def is_incremental(self) -> bool:
+        """Whether the parts can be folded one by one via :py:meth:`accumulate`,
+        it is not the case when a subclass overrides :py:meth:`apply` but not :py:meth:`accumulate`"""
+        owner = lambda name: next(c for c in type(self).__mro__ if name in c.__dict__)
+        return issubclass(owner('accumulate'), owner('apply'))
+
 
 class BaseTopkReduceRouter(BaseReduceRouter):
-    def __init__(self, reduce_op: str = 'sum', *args, **kwargs):
+    def __init__(self, reduce_op: str = 'sum', top_k: int = 0, *args, **kwargs):
+        """
+        :param reduce_op: how the scores of the same key are combined, see :py:class:`CombinedScoreFn`
+        :param top_k: number of results to keep after reducing, 0 means following the ``top_k`` in the message.
+                if both are 0, all results are kept
+        """
         super().__init__(*args, **kwargs)
         self._reduce_op = reduce_op
+        self.top_k = top_k
 
     def post_init(self):
         self.reduce_op = CombinedScoreFn(score_mode=self._reduce_op)
@@ -72,54 +119,124 @@ class BaseTopkReduceRouter(BaseReduceRouter):
     def set_key(self, x: 'gnes_pb2.Response.QueryResponse.ScoredResult', k: str) -> None:
         raise NotImplementedError
 
-    def apply(self, msg: 'gnes_pb2.Message', accum_msgs: List['gnes_pb2.Message'], *args, **kwargs):
+    def accumulate(self, state: Optional[Dict], msg: 'gnes_pb2.Message') -> Dict:
+        # only the key and the value of each result are kept, the scores too if they are explained
+        state = super().accumulate(state, msg)
+        key2group = state.setdefault('key2group', {})
+        results = msg.response.search.topk_results
+        state.setdefault('groups', []).append(
+            np.array([key2group.setdefault(self.get_key(c), len(key2group)) for c in results], dtype=np.int64))
+        state.setdefault('values', []).append(np.array([c.score.value for c in results], dtype=np.float64))
+        if msg.response.search.explain:
+            scores = state.setdefault('scores', [])
+            for c in results:
+                scores.append(gnes_pb2.Response.QueryResponse.ScoredResult.Score())
+                scores[-1].CopyFrom(c.score)
+        return state
+
+    def finalize(self, state: Dict, msg: 'gnes_pb2.Message') -> None:
         # now convert chunk results to doc results
-        all_scored_results = [sr for m in accum_msgs for sr in m.response.search.topk_results]
-        score_dict = defaultdict(list)
+        keys = list(state['key2group'])
+        groups = np.concatenate(state['groups'])
+        values = self.reduce_op.batch_group_call(np.concatenate(state['values']), groups, len(keys))
+        top_k = topk_order(values, self.top_k or msg.response.search.top_k or len(keys),
+                           msg.response.search.is_big_score_similar)
+
+        explain = msg.response.search.explain and 'scores' in state
+        if explain:
+            group_scores = defaultdict(list)
+            for g, s in zip(groups.tolist(), state['scores']):
+                group_scores[g].append(s)
+        num_operands = np.bincount(groups, minlength=len(keys)).tolist()
 
-        # count score by iterating over chunks
-        for c in all_scored_results:
-            score_dict[self.get_key(c)].append(c.score)
+        msg.response.search.ClearField('topk_results')
+        for g in top_k.tolist():
+            r = msg.response.search.topk_results.add()
+            if explain:
+                r.score.CopyFrom(self.reduce_op(*group_scores[g]))
+            else:
+                r.score.value = values[g]
+                r.score.num_operands = num_operands[g]
+            self.set_key(r, keys[g])
+        msg.response.search.is_sorted = True
 
-        for k, v in score_dict.items():
-            score_dict[k] = self.reduce_op(*v)
+        super().finalize(state, msg)
 
-        msg.response.search.ClearField('topk_results')
 
-        for k, v in score_dict.items():
-            r = msg.response.search.topk_results.add()
-            r.score.CopyFrom(v)
-            self.set_key(r, k)
+def topk_order(values: np.ndarray, top_k: int, descending: bool = False) -> np.ndarray:
+    """
+    Indices of the ``top_k`` best values sorted from the best, the ties keep their original order
 
-        super().apply(msg, accum_msgs)
+    :param descending: larger value is better
+    """
+    keys = -values if descending else values
+    if top_k < len(keys):
+        idx = np.argpartition(keys, top_k - 1)[:top_k]
+        # keep the ties at the boundary in their original order
+        idx = np.flatnonzero(keys <= keys[idx].max())
+    else:
+        idx = np.arange(len(keys))
+    return idx[np.argsort(keys[idx], kind='stable')][:top_k]
 
 
 class BaseEmbedReduceRouter(BaseReduceRouter):
-    def reduce_embedding(self, accum_msgs: List['gnes_pb2.Message'], msg_type: str, chunk_idx: int, doc_idx: int):
+    def reduce_packed_embedding(self, embeds: List[np.ndarray]) -> np.ndarray:
+        """
+        Reduce the chunk embeddings of the same document from all accumulated messages
+
+        :param embeds: list of [num_embedded_chunks, ...] arrays, one per message
+        """
         raise NotImplementedError
 
-    def apply(self, msg: 'gnes_pb2.Message', accum_msgs: List['gnes_pb2.Message'], *args, **kwargs) -> None:
+    def accumulate_embedding(self, acc: Any, embeds: np.ndarray) -> Any:
         """
-        reduce embeddings from encoders (means, concat ....)
+        Fold the chunk embeddings of a document from one message, by default they are collected
+        and reduced by :py:meth:`reduce_packed_embedding` at the end
 
-        :param msg: the current message
-        :param accum_msgs: accumulated messages
+        :param acc: the folded embeddings of this document so far, None for the first message
+        :param embeds: [num_embedded_chunks, ...] array
         """
-        body = getattr(msg, msg.WhichOneof('body'))
-        msg_type = type(getattr(body, body.WhichOneof('body')))
-        if msg_type == gnes_pb2.Request.QueryRequest:
-            for i in range(len(msg.request.search.query.chunks)):
-                reduced_embedding = array2blob(self.reduce_embedding(accum_msgs, 'query', chunk_idx=i, doc_idx=-1))
-                msg.request.search.query.chunks[i].embedding.CopyFrom(reduced_embedding)
-        elif msg_type == gnes_pb2.Request.IndexRequest:
-            for i in range(len(msg.request.index.docs)):
-                for j in range(len(msg.request.index.docs[i].chunks)):
-                    reduced_embedding = array2blob(self.reduce_embedding(accum_msgs, 'index', chunk_idx=j, doc_idx=i))
-                    msg.request.index.docs[i].chunks[j].embedding.CopyFrom(reduced_embedding)
-        else:
-            self.logger.error('dont know how to handle %s' % msg_type)
+        return (acc or []) + [embeds]
+
+    def finalize_embedding(self, acc: Any) -> np.ndarray:
+        return self.reduce_packed_embedding(acc)
+
+    @staticmethod
+    def _get_docs(msg: 'gnes_pb2.Message') -> Optional[List['gnes_pb2.Document']]:
+        if msg.WhichOneof('body') == 'request':
+            if msg.request.WhichOneof('body') == 'search':
+                return [msg.request.search.query]
+            elif msg.request.WhichOneof('body') == 'index':
+                return msg.request.index.docs
 
-        super().apply(msg, accum_msgs)
+    def accumulate(self, state: Optional[Dict], msg: 'gnes_pb2.Message') -> Dict:
+        """
+        reduce embeddings from encoders (means, concat ....)
+        """
+        state = super().accumulate(state, msg)
+        docs = self._get_docs(msg)
+        if docs is None:
+            self.logger.error('dont know how to handle %s' % msg.WhichOneof('body'))
+            return state
+        accs = state.setdefault('embeds', [None] * len(docs))
+        for j, d in enumerate(docs):
+            embeds, chunk_idx = unpack_chunk_embeddings(d)
+            if chunk_idx:
+                accs[j] = self.accumulate_embedding(accs[j], embeds)
+        return state
+
+    def finalize(self, state: Dict, msg: 'gnes_pb2.Message') -> None:
+        for d, acc in zip(self._get_docs(msg) or [], state.get('embeds', [])):
+            if acc is None:
+                continue
+            _, chunk_idx = unpack_chunk_embeddings(d)
+            reduced = self.finalize_embedding(acc)
+            if d.HasField('chunk_embeddings'):
+                pack_chunk_embeddings(d, reduced, chunk_idx)
+            else:
+                for j, e in zip(chunk_idx, reduced):
+                    d.chunks[j].embedding.CopyFrom(array2blob(e))
+        super().finalize(state, msg)
 
 
 class PipelineRouter(CompositionalTrainableBase):
@@ -13,11 +13,11 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-from typing import List
+from typing import List, Optional, Tuple
+
 import numpy as np
 
 from .base import BaseReduceRouter, BaseTopkReduceRouter, BaseEmbedReduceRouter
-from ..proto import blob2array
 
 
 class DocFillReducer(BaseReduceRouter):
@@ -82,33 +82,28 @@ class ConcatEmbedRouter(BaseEmbedReduceRouter):
     """
     Gather all embeddings from multiple encoders and concat them on a specific axis.
     In default, concat will happen on the last axis.
-    chunk_idx, doc_idx denote index in for loop used in BaseEmbedReduceRouter
     """
 
-    def reduce_embedding(self, accum_msgs: List['gnes_pb2.Message'], msg_type: str, chunk_idx: int, doc_idx: int):
-        if msg_type == 'query':
-            return np.concatenate([blob2array(m.request.search.query.chunks[chunk_idx].embedding)
-                                   for m in accum_msgs], axis=1)
-        elif msg_type == 'index':
-            return np.concatenate([blob2array(m.request.index.docs[doc_idx].chunks[chunk_idx].embedding)
-                                   for m in accum_msgs], axis=1)
-        else:
-            self.logger.error('dont know how to handle %s' % msg_type)
+    def reduce_packed_embedding(self, embeds: List[np.ndarray]) -> np.ndarray:
+        return np.concatenate(embeds, axis=-1)
 
 
 class AvgEmbedRouter(BaseEmbedReduceRouter):
     """
     Gather all embeddings from multiple encoders and do average on a specific axis.
     In default, average will happen on the first axis.
-    chunk_idx, doc_idx denote index in for loop used in BaseEmbedReduceRouter
+    Only the running sum is kept while the messages arrive.
     """
 
-    def reduce_embedding(self, accum_msgs: List['gnes_pb2.Message'], msg_type: str, chunk_idx: int, doc_idx: int):
-        if msg_type == 'query':
-            return np.mean([blob2array(m.request.search.query.chunks[chunk_idx].embedding)
-                                   for m in accum_msgs], axis=0)
-        elif msg_type == 'index':
-            return np.mean([blob2array(m.request.index.docs[doc_idx].chunks[chunk_idx].embedding)
-                                   for m in accum_msgs], axis=0)
-        else:
-            self.logger.error('dont know how to handle %s' % msg_type)
\ No newline at end of file
+    def reduce_packed_embedding(self, embeds: List[np.ndarray]) -> np.ndarray:
+        return np.mean(embeds, axis=0)
+
+    def accumulate_embedding(self, acc: Optional[Tuple[np.ndarray, int, np.dtype]], embeds: np.ndarray):
+        if acc is None:
+            # summed in float64, but returned in the dtype np.mean gives
+            dtype = embeds.dtype if np.issubdtype(embeds.dtype, np.floating) else np.float64
+            return embeds.astype(np.float64), 1, dtype
+        return acc[0] + embeds, acc[1] + 1, acc[2]
+
+    def finalize_embedding(self, acc: Tuple[np.ndarray, int, np.dtype]) -> np.ndarray:
+        return (acc[0] / acc[1]).astype(acc[2])
@@ -21,7 +21,12 @@ _cls2file_map = {
     'CombinedScoreFn': 'base',
     'ModifierScoreFn': 'base',
     'WeightedChunkScoreFn': 'chunk',
+    'WeightedChunkOffsetScoreFn': 'chunk',
+    'CoordChunkScoreFn': 'chunk',
+    'TFIDFChunkScoreFn': 'chunk',
+    'BM25ChunkScoreFn': 'chunk',
     'WeightedDocScoreFn': 'doc',
+    'CoordDocScoreFn': 'doc',
     'Normalizer1': 'normalize',
     'Normalizer2': 'normalize',
     'Normalizer3': 'normalize',
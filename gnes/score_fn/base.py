@@ -14,23 +14,68 @@
 #  limitations under the License.
 
 import json
-from typing import Sequence
+from functools import lru_cache
+from typing import Sequence, Dict, Optional
 
 import numpy as np
 
-from ..base import TrainableBase
+from ..base import TrainableBase, import_class_by_str
 from ..proto import gnes_pb2
 
 
-def get_unary_score(value: float, **kwargs):
+def get_unary_score(value: float, name: str = '',
+                    operands: Sequence['gnes_pb2.Response.QueryResponse.ScoredResult.Score'] = (), **kwargs):
+    """
+    Build a score as a node of the explanation tree, the tree is rendered to JSON
+    only once by :py:func:`render_explained`
+
+    :param value: the value of the score
+    :param name: name of the score function or the factor giving this score
+    :param operands: the scores this score is computed from
+    :param kwargs: extra attributes shown in the explanation
+    """
     score = gnes_pb2.Response.QueryResponse.ScoredResult.Score()
     score.value = value
-    score.explained = json.dumps(
-        dict(value=float(value),
-             **kwargs))
+    score.name = name
+    score.operands.extend(operands)
+    score.num_operands = len(operands)
+    if kwargs:
+        score.meta = json.dumps(kwargs)
     return score
 
 
+@lru_cache()
+def _get_docstring(name: str) -> Optional[str]:
+    from . import _cls2file_map
+    if name in _cls2file_map:
+        doc = import_class_by_str(name).__doc__
+        return ' '.join(doc.split()).strip() if doc else None
+
+
+def explain_score(score: 'gnes_pb2.Response.QueryResponse.ScoredResult.Score') -> Dict:
+    """Convert the explanation tree of a score to a nested dict, the docstring of a score function is added by its name"""
+    r = dict(value=score.value)
+    if score.name:
+        r['name'] = score.name
+        docstring = _get_docstring(score.name)
+        if docstring:
+            r['docstring'] = docstring
+    if score.meta:
+        r.update(json.loads(score.meta))
+    if score.operands:
+        r['operands'] = [explain_score(s) for s in score.operands]
+    elif score.explained:
+        r['explained'] = json.loads(score.explained)
+    return r
+
+
+def render_explained(score: 'gnes_pb2.Response.QueryResponse.ScoredResult.Score') -> None:
+    """Render the explanation tree of a score to the JSON in ``score.explained`` and drop the tree"""
+    score.explained = json.dumps(explain_score(score))
+    for f in ('name', 'meta', 'operands'):
+        score.ClearField(f)
+
+
 class BaseScoreFn(TrainableBase):
     """Base score function. A score function must implement __call__ method"""
 
@@ -43,14 +88,20 @@ class BaseScoreFn(TrainableBase):
     def __call__(self, *args, **kwargs) -> 'gnes_pb2.Response.QueryResponse.ScoredResult.Score':
         raise NotImplementedError
 
+    def batch_call(self, values: np.ndarray, *args, **kwargs) -> np.ndarray:
+        """
+        Vectorized :py:meth:`__call__` on the values of many scores at once, no explanation is produced
+
+        :param values: score values in shape [num_scores]
+        :return: new score values in shape [num_scores]
+        """
+        raise NotImplementedError
+
     def new_score(self, *, operands: Sequence['gnes_pb2.Response.QueryResponse.ScoredResult.Score'] = (), **kwargs):
         if not self.__doc__:
             raise NotImplementedError('%s dont have docstring. For the sake of interpretability, '
                                       'please write docstring for this class')
-        return get_unary_score(name=self.__class__.__name__,
-                               docstring=' '.join(self.__doc__.split()).strip(),
-                               operands=[json.loads(s.explained) for s in operands],
-                               **kwargs)
+        return get_unary_score(name=self.__class__.__name__, operands=operands, **kwargs)
 
 
 class CombinedScoreFn(BaseScoreFn):
@@ -85,6 +136,26 @@ class CombinedScoreFn(BaseScoreFn):
             operands=last_scores,
             score_mode=self.score_mode)
 
+    def batch_call(self, *values: np.ndarray, **kwargs) -> np.ndarray:
+        return self.op(np.stack(np.broadcast_arrays(*values)), axis=0)
+
+    def batch_group_call(self, values: np.ndarray, groups: np.ndarray, num_groups: int) -> np.ndarray:
+        """
+        Vectorized :py:meth:`__call__` on groups of scores, the values of the same group are combined into one
+
+        :param values: score values in shape [num_scores]
+        :param groups: the group of every score, integers in [0, num_groups)
+        :param num_groups: number of groups
+        :return: combined values in shape [num_groups]
+        """
+        ufunc, init = {'multiply': (np.multiply, 1.), 'sum': (np.add, 0.), 'avg': (np.add, 0.),
+                       'max': (np.maximum, -np.inf), 'min': (np.minimum, np.inf)}[self.score_mode]
+        r = np.full(num_groups, init, dtype=np.float64)
+        ufunc.at(r, groups, values)
+        if self.score_mode == 'avg':
+            r /= np.maximum(np.bincount(groups, minlength=num_groups), 1)
+        return r
+
 
 class ModifierScoreFn(BaseScoreFn):
     """Modifier to apply to the value
@@ -135,7 +206,12 @@ class ModifierScoreFn(BaseScoreFn):
                 value=self.op(self.factor.value * last_score.value),
                 operands=[last_score],
                 modifier=self._modifier,
-                factor=json.loads(self.factor.explained))
+                factor=explain_score(self.factor))
+
+    def batch_call(self, values: np.ndarray, *args, **kwargs) -> np.ndarray:
+        if self._modifier == 'none' and self._factor == 1.0:
+            return values
+        return self.op(self.factor.value * values)
 
 
 class ScoreOps:
@@ -17,6 +17,18 @@ from .base import get_unary_score, CombinedScoreFn
 from typing import List, Tuple
 import numpy as np
 
+# one record per hit, used by the vectorized ``batch_call`` of the chunk score functions
+HIT_DTYPE = np.dtype([('q_idx', np.int64), ('doc_id', np.int64), ('offset', np.int64), ('weight', np.float64)])
+
+
+def _q_field(q_chunks: List['gnes_pb2.Chunk'], hits: np.ndarray, field: str) -> np.ndarray:
+    return np.array([getattr(c, field) for c in q_chunks], dtype=np.float64)[hits['q_idx']]
+
+
+def _per_doc(hits: np.ndarray, fn) -> np.ndarray:
+    doc_ids, inv = np.unique(hits['doc_id'], return_inverse=True)
+    return np.array([fn(d) for d in doc_ids.tolist()], dtype=np.float64)[inv]
+
 
 class WeightedChunkScoreFn(CombinedScoreFn):
     """score = d_chunk.weight * relevance * q_chunk.weight"""
@@ -34,6 +46,10 @@ class WeightedChunkScoreFn(CombinedScoreFn):
 
         return super().__call__(last_score, q_chunk_weight, d_chunk_weight)
 
+    def batch_call(self, values: np.ndarray, q_chunks: List['gnes_pb2.Chunk'], hits: np.ndarray,
+                   *args, **kwargs) -> np.ndarray:
+        return super().batch_call(values, _q_field(q_chunks, hits, 'weight'), hits['weight'])
+
 
 class WeightedChunkOffsetScoreFn(CombinedScoreFn):
     """
@@ -57,6 +73,12 @@ class WeightedChunkOffsetScoreFn(CombinedScoreFn):
                                             name='offset divergence')
         return super().__call__(last_score, q_chunk_weight, d_chunk_weight, offset_divergence)
 
+    def batch_call(self, values: np.ndarray, q_chunks: List['gnes_pb2.Chunk'], hits: np.ndarray,
+                   *args, **kwargs) -> np.ndarray:
+        # the hits carry no offset_nd, hence the divergence is always the 1-D one
+        divergence = np.abs(_q_field(q_chunks, hits, 'offset') - hits['offset'])
+        return super().batch_call(values, _q_field(q_chunks, hits, 'weight'), hits['weight'], divergence)
+
     @staticmethod
     def _cal_divergence(q_chunk: 'gnes_pb2.Chunk', d_chunk: 'gnes_pb2.Chunk'):
         if q_chunk.offset_nd and d_chunk.offset_nd:
@@ -81,6 +103,14 @@ class CoordChunkScoreFn(CombinedScoreFn):
                                              name='query coordination')
         return super().__call__(last_score, query_coordination)
 
+    def batch_call(self, values: np.ndarray, q_chunks: List['gnes_pb2.Chunk'], hits: np.ndarray,
+                   queried_results: List[List[Tuple]], *args, **kwargs) -> np.ndarray:
+        recalled = np.array([r[0] for r in queried_results[0]], dtype=np.int64)
+        doc_ids, counts = np.unique(recalled, return_counts=True)
+        pos = np.minimum(np.searchsorted(doc_ids, hits['doc_id']), len(doc_ids) - 1)
+        recall_chunks = np.where(doc_ids[pos] == hits['doc_id'], counts[pos], 0)
+        return super().batch_call(values, recall_chunks / _per_doc(hits, self._context.num_chunks_in_doc))
+
     def _cal_query_coord(self, d_chunk: 'gnes_pb2.Chunk', queried_results: List[List[Tuple]]):
         doc_id = d_chunk.doc_id
         total_chunks = self._context.num_chunks_in_doc(doc_id)
@@ -110,6 +140,10 @@ class TFIDFChunkScoreFn(CombinedScoreFn):
                                              name='query tf-idf')
         return super().__call__(last_score, tf_idf)
 
+    def batch_call(self, values: np.ndarray, q_chunks: List['gnes_pb2.Chunk'], hits: np.ndarray,
+                   queried_results: List[List[Tuple]], *args, **kwargs) -> np.ndarray:
+        return super().batch_call(values, self._cal_tf_idf(queried_results))
+
     def _cal_tf_idf(self, queried_results: List[List[Tuple]]):
         _, _, _, queried_relevance = zip(*(queried_results[0]))
         tf = len(list(filter(lambda x: x >= self.threshold, queried_relevance)))
@@ -147,8 +181,14 @@ class BM25ChunkScoreFn(CombinedScoreFn):
                                              name='query bm25')
         return super().__call__(last_score, bm25)
 
+    def batch_call(self, values: np.ndarray, q_chunks: List['gnes_pb2.Chunk'], hits: np.ndarray,
+                   queried_results: List[List[Tuple]], *args, **kwargs) -> np.ndarray:
+        return super().batch_call(values, _per_doc(hits, lambda d: self._cal_bm25_by_id(d, queried_results)))
+
     def _cal_bm25(self, d_chunk: 'gnes_pb2.Chunk', queried_results: List[List[Tuple]]):
-        doc_id = d_chunk.doc_id
+        return self._cal_bm25_by_id(d_chunk.doc_id, queried_results)
+
+    def _cal_bm25_by_id(self, doc_id: int, queried_results: List[List[Tuple]]):
         _, _, _, queried_relevance = zip(*(queried_results[0]))
         tf = len(list(filter(lambda x: x >= self.threshold, queried_relevance)))
 
@@ -13,11 +13,16 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from typing import List
+
+import numpy as np
+
 from .base import get_unary_score, CombinedScoreFn
-import json
 
 
 class WeightedDocScoreFn(CombinedScoreFn):
+    """score = score * doc.weight"""
+
     def __call__(self, last_score: 'gnes_pb2.Response.QueryResponse.ScoredResult.Score',
                  doc: 'gnes_pb2.Document', *args, **kwargs):
         d_weight = get_unary_score(value=doc.weight,
@@ -25,6 +30,9 @@ class WeightedDocScoreFn(CombinedScoreFn):
                                    doc_id=doc.doc_id)
         return super().__call__(last_score, d_weight)
 
+    def batch_call(self, values: np.ndarray, docs: List['gnes_pb2.Document'], *args, **kwargs) -> np.ndarray:
+        return super().batch_call(values, np.array([d.weight for d in docs], dtype=np.float64))
+
 
 class CoordDocScoreFn(CombinedScoreFn):
     """
@@ -35,10 +43,18 @@ class CoordDocScoreFn(CombinedScoreFn):
     def __call__(self, last_score: 'gnes_pb2.Response.QueryResponse.ScoredResult.Score',
                  doc: 'gnes_pb2.Document',
                  *args, **kwargs):
-        total_chunks = len(doc.chunks)
-        recall_chunks = len(json.loads(last_score.explained)['operands'])
-        query_coord = 1 if total_chunks == 0 else recall_chunks / total_chunks
-        d_weight = get_unary_score(value=query_coord,
+        d_weight = get_unary_score(value=float(self._cal_query_coord(len(doc.chunks), last_score.num_operands)),
                                    name='query coordination')
         return super().__call__(last_score, d_weight)
 
+    def batch_call(self, values: np.ndarray, docs: List['gnes_pb2.Document'],
+                   last_scores: List['gnes_pb2.Response.QueryResponse.ScoredResult.Score'],
+                   *args, **kwargs) -> np.ndarray:
+        total_chunks = np.array([len(d.chunks) for d in docs], dtype=np.float64)
+        recall_chunks = np.array([s.num_operands for s in last_scores], dtype=np.float64)
+        return super().batch_call(values, self._cal_query_coord(total_chunks, recall_chunks))
+
+    @staticmethod
+    def _cal_query_coord(total_chunks, recall_chunks):
+        # the number of recalled chunks is the number of chunk scores the router combined into this score
+        return np.where(total_chunks == 0, 1, recall_chunks / np.maximum(total_chunks, 1))
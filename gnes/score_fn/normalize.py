@@ -13,6 +13,8 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import numpy as np
+
 from .base import ModifierScoreFn, ScoreOps as so
 
 
@@ -25,6 +27,9 @@ class Normalizer1(ModifierScoreFn):
     def __call__(self, last_score, *args, **kwargs):
         return super().__call__(so.sqrt(last_score))
 
+    def batch_call(self, values, *args, **kwargs):
+        return super().batch_call(np.sqrt(values))
+
 
 class Normalizer2(ModifierScoreFn):
     """Do normalizing: score = 1 / (1 + score / num_dim)"""
@@ -39,6 +44,9 @@ class Normalizer3(Normalizer2):
     def __call__(self, last_score, *args, **kwargs):
         return super().__call__(so.sqrt(last_score))
 
+    def batch_call(self, values, *args, **kwargs):
+        return super().batch_call(np.sqrt(values))
+
 
 class Normalizer4(ModifierScoreFn):
     """Do normalizing: score = 1 - score / num_bytes """
@@ -55,3 +63,6 @@ class Normalizer5(ModifierScoreFn):
 
     def __call__(self, last_score, *args, **kwargs):
         return super().__call__(so.sqrt(so.abs(last_score)))
+
+    def batch_call(self, values, *args, **kwargs):
+        return super().batch_call(np.sqrt(np.abs(values)))
@@ -14,9 +14,13 @@
 #  limitations under the License.
 
 import copy
+import itertools
 import multiprocessing
 import os
+import queue
 import random
+import signal
+import struct
 import tempfile
 import threading
 import time
@@ -24,7 +28,7 @@ import types
 import uuid
 from contextlib import ExitStack
 from enum import Enum
-from typing import Tuple, List, Union, Type
+from typing import Tuple, List, Union, Type, Iterable
 
 import zmq
 import zmq.decorators as zmqd
@@ -35,6 +39,12 @@ from ..cli.parser import resolve_yaml_path
 from ..helper import set_logger, PathImporter, TimeContext, make_route_table
 from ..proto import gnes_pb2, add_route, send_message, recv_message, router2str
 
+# (duration in seconds, bytes written) reported by the background dump to the service
+_DUMP_REPORT = struct.Struct('<dQ')
+
+# wait time (ms) for the answer of a control message before sending it again
+_CTRL_RETRY_INTERVAL = 1000
+
 
 class BetterEnum(Enum):
     def __str__(self):
@@ -270,18 +280,44 @@ class MessageHandler:
         self.logger.info('handling message with %s' % fn.__name__)
         return fn(msg)
 
+    def send_back(self, msg: 'gnes_pb2.Message', out_sock):
+        self.call_hooks(msg, hook_type='post', verbose=self.service_context.args.verbose)
+        send_message(out_sock, msg, **self.service_context.send_recv_kwargs)
+
+    def call_routes_get_output(self, msg: 'gnes_pb2.Message') -> List['gnes_pb2.Message']:
+        """
+        Call the handler and the post hooks without sending, used by the pipelined event loop
+
+        :return: the messages to be sent out, empty if the message is blocked
+        """
+        try:
+            ret = self.call_routes(msg)
+            if ret is None:
+                out_msgs = [msg]
+            elif isinstance(ret, types.GeneratorType):
+                out_msgs = list(ret)
+            else:
+                raise ServiceError('unknown return type from the handler')
+        except BlockMessage:
+            return []
+        except ServiceError as ex:
+            self.logger.error(ex, exc_info=True)
+            return []
+
+        for m in out_msgs:
+            self.call_hooks(m, hook_type='post', verbose=self.service_context.args.verbose)
+        return out_msgs
+
     def call_routes_send_back(self, msg: 'gnes_pb2.Message', out_sock):
         try:
             # NOTE that msg is mutable object, it may be modified in fn()
             ret = self.call_routes(msg)
             if ret is None:
                 # assume 'msg' is modified inside fn()
-                self.call_hooks(msg, hook_type='post', verbose=self.service_context.args.verbose)
-                send_message(out_sock, msg, **self.service_context.send_recv_kwargs)
+                self.send_back(msg, out_sock)
             elif isinstance(ret, types.GeneratorType):
                 for r_msg in ret:
-                    self.call_hooks(msg, hook_type='post', verbose=self.service_context.args.verbose)
-                    send_message(out_sock, r_msg, **self.service_context.send_recv_kwargs)
+                    self.send_back(r_msg, out_sock)
             else:
                 raise ServiceError('unknown return type from the handler')
 
@@ -325,6 +361,8 @@ class ConcurrentService(type):
 class BaseService(metaclass=ConcurrentService):
     handler = MessageHandler()
     default_host = '0.0.0.0'
+    # whether the handlers can be called concurrently, required by more than one "--pipeline_workers"
+    thread_safe_handlers = False
 
     def _get_event(self):
         if isinstance(self, threading.Thread):
@@ -340,11 +378,20 @@ class BaseService(metaclass=ConcurrentService):
             PathImporter.add_modules(*args.py_path)
         self.args = args
         self.logger = set_logger(self.__class__.__name__, args.verbose)
+        if self.args.pipeline_workers > 1 and not self.thread_safe_handlers:
+            raise ServiceError('the handlers of %s are not thread-safe, "--pipeline_workers" must be 0 or 1, '
+                               'got %d' % (self.__class__.__name__, self.args.pipeline_workers))
         self.is_ready = self._get_event()
         self.is_event_loop = self._get_event()
         self.is_model_changed = self._get_event()
         self.is_handler_done = self._get_event()
         self.last_dump_time = time.perf_counter()
+        self.last_dump_duration = 0.
+        self.last_dump_size = 0
+        # pid of the child process doing the background dump and the pipe it reports to
+        self._dump_pid = None
+        self._dump_fd = None
+        self._dump_start_time = 0.
         self._model = None
         self.use_event_loop = True
         self.ctrl_with_ipc = (os.name != 'nt') and self.args.ctrl_with_ipc
@@ -372,30 +419,107 @@ class BaseService(metaclass=ConcurrentService):
         except Exception as ex:
             self.logger.error(ex, exc_info=True)
 
-    def dump(self, respect_dump_interval: bool = True):
-        if (not self.args.read_only
+    def _is_dump_needed(self, respect_dump_interval: bool = True) -> bool:
+        return (not self.args.read_only
                 and self.args.dump_interval > 0
                 and self._model
                 and self.is_model_changed.is_set()
                 and ((respect_dump_interval
-                      and (time.perf_counter() - self.last_dump_time) > self.args.dump_interval)
-                     or not respect_dump_interval)):
+                      and (time.perf_counter() - self.last_dump_time) > self.args.dump_interval
+                      and not self.is_dumping)
+                     or not respect_dump_interval))
+
+    @property
+    def is_dumping(self) -> bool:
+        """Whether a background dump is in progress, a finished one is collected here.
+        A background dump running longer than ``--dump_timeout`` is killed and replaced by a synchronous one
+        """
+        if self._dump_pid is not None:
+            pid, status = os.waitpid(self._dump_pid, os.WNOHANG)
+            if pid == 0:
+                if time.perf_counter() - self._dump_start_time <= self.args.dump_timeout:
+                    return True
+                self.logger.error('background dump in the process %d is not finished in %ds, '
+                                  'kill it and dump synchronously' % (self._dump_pid, self.args.dump_timeout))
+                os.kill(self._dump_pid, signal.SIGKILL)
+                os.waitpid(self._dump_pid, 0)
+                self._collect_dump(None)
+                self._dump_sync()
+            else:
+                self._collect_dump(status)
+        return False
+
+    def _collect_dump(self, status: int = None):
+        """Read the duration and the size reported by the background dump, ``status`` None means it is killed"""
+        report = os.read(self._dump_fd, _DUMP_REPORT.size) if status == 0 else b''
+        os.close(self._dump_fd)
+        self._dump_pid = None
+        self._dump_fd = None
+        if len(report) == _DUMP_REPORT.size:
+            self._on_dump_finished(*_DUMP_REPORT.unpack(report))
+        elif status is not None:
+            self.logger.error('background dump failed with exit status %d, will retry' % status)
+            self.is_model_changed.set()
+
+    def _dump_sync(self):
+        start_t = time.perf_counter()
+        size = self._model.dump()
+        self._on_dump_finished(time.perf_counter() - start_t, size or 0)
+
+    def _on_dump_finished(self, duration: float, size: int):
+        self.last_dump_duration = duration
+        self.last_dump_size = size
+        self.logger.info('dumping finished in %.1fs (%d bytes)! next dump will start in at least %3.0fs' %
+                         (self.last_dump_duration, self.last_dump_size, self.args.dump_interval))
+
+    def dump(self, respect_dump_interval: bool = True):
+        """
+        Dump the model if it is changed. With ``--async_dump``, the model is dumped by a forked child process,
+        which works on a copy-on-write snapshot of the memory, so the event loop is not blocked
+
+        :param respect_dump_interval: if False, wait for the background dump then dump synchronously
+        """
+        if not respect_dump_interval:
+            # bounded by "--dump_timeout", a stuck background dump is killed
+            while self.is_dumping:
+                time.sleep(0.1)
+        if self._is_dump_needed(respect_dump_interval):
             self.is_model_changed.clear()
             self.logger.info('dumping changes to the model, %3.0fs since last the dump'
                              % (time.perf_counter() - self.last_dump_time))
-            self._model.dump()
             self.last_dump_time = time.perf_counter()
-            self.logger.info('dumping finished! next dump will start in at least %3.0fs' % self.args.dump_interval)
+            if respect_dump_interval and self.args.async_dump and hasattr(os, 'fork'):
+                self._dump_start_time = time.perf_counter()
+                fd_r, fd_w = os.pipe()
+                self._dump_pid = os.fork()
+                if self._dump_pid == 0:
+                    # the child process, never return to the event loop
+                    exit_code = 1
+                    try:
+                        os.close(fd_r)
+                        size = self._model.dump()
+                        os.write(fd_w, _DUMP_REPORT.pack(time.perf_counter() - self._dump_start_time, size or 0))
+                        exit_code = 0
+                    finally:
+                        os._exit(exit_code)
+                os.close(fd_w)
+                self._dump_fd = fd_r
+                self.logger.info('dumping in the background process %d' % self._dump_pid)
+            else:
+                self._dump_sync()
 
     @handler.register_hook(hook_type='post')
     def _hook_warn_body_type_change(self, msg: 'gnes_pb2.Message', *args, **kwargs):
         new_type = msg.WhichOneof('body')
-        if new_type != self._msg_old_type:
-            self.logger.warning('message body type has changed from "%s" to "%s"' % (self._msg_old_type, new_type))
+        # None for the held-back messages from "pending_messages", which are not checked
+        old_type = getattr(self._msg_context, 'old_type', None)
+        if old_type is not None and new_type != old_type:
+            self.logger.warning('message body type has changed from "%s" to "%s"' % (old_type, new_type))
 
     @handler.register_hook(hook_type='post')
     def _hook_sort_response(self, msg: 'gnes_pb2.Message', *args, **kwargs):
-        if 'sorted_response' in self.args and self.args.sorted_response and msg.response.search.topk_results:
+        if 'sorted_response' in self.args and self.args.sorted_response and msg.response.search.topk_results \
+                and not msg.response.search.is_sorted:
             msg.response.search.topk_results.sort(key=lambda x: x.score.value,
                                                   reverse=msg.response.search.is_big_score_similar)
 
@@ -407,8 +531,9 @@ class BaseService(metaclass=ConcurrentService):
     @handler.register_hook(hook_type='pre')
     def _hook_add_route(self, msg: 'gnes_pb2.Message', *args, **kwargs):
         add_route(msg.envelope, self._model.__class__.__name__, self.args.identity)
-        self._msg_old_type = msg.WhichOneof('body')
-        self.logger.info('a message in type: %s with route: %s' % (self._msg_old_type, router2str(msg)))
+        # thread-local, as the pipelined event loop calls the post-hooks in the worker threads
+        self._msg_context.old_type = msg.WhichOneof('body')
+        self.logger.info('a message in type: %s with route: %s' % (self._msg_context.old_type, router2str(msg)))
 
     @handler.register_hook(hook_type='post')
     def _hook_update_route_timestamp(self, msg: 'gnes_pb2.Message', *args, **kwargs):
@@ -421,6 +546,7 @@ class BaseService(metaclass=ConcurrentService):
     def _run(self, ctx):
         ctx.setsockopt(zmq.LINGER, 0)
         self.handler.service_context = self
+        self._msg_context = threading.local()
         # print('!!!! t_id: %d service_context: %r' % (threading.get_ident(), self.handler.service_context))
         self.logger.info('bind sockets...')
         if self.ctrl_with_ipc:
@@ -454,6 +580,8 @@ class BaseService(metaclass=ConcurrentService):
             self.is_ready.set()
             self.is_event_loop.set()
             self.logger.critical('ready and listening')
+            if self.args.pipeline_workers > 0:
+                self._run_pipeline(poller, in_sock, out_sock, ctrl_sock)
             while self.is_event_loop.is_set():
                 socks = dict(poller.poll(1))
                 if socks.get(in_sock) == zmq.POLLIN:
@@ -461,7 +589,10 @@ class BaseService(metaclass=ConcurrentService):
                 elif socks.get(ctrl_sock) == zmq.POLLIN:
                     pull_sock = ctrl_sock
                 else:
-                    # no message received, pass
+                    # no message received, send out the held-back messages that are due
+                    self._msg_context.old_type = None
+                    for msg in self.pending_messages():
+                        self.handler.send_back(msg, out_sock)
                     continue
 
                 if self.use_event_loop or pull_sock == ctrl_sock:
@@ -505,6 +636,12 @@ class BaseService(metaclass=ConcurrentService):
         finally:
             self.is_ready.set()
             self.is_event_loop.clear()
+            try:
+                self._msg_context.old_type = None
+                for msg in self.pending_messages(force=True):
+                    self.handler.send_back(msg, out_sock)
+            except Exception as ex:
+                self.logger.error('fail to send out the held-back messages: %s' % str(ex), exc_info=True)
             in_sock.close()
             out_sock.close()
             ctrl_sock.close()
@@ -512,9 +649,132 @@ class BaseService(metaclass=ConcurrentService):
             self.dump(respect_dump_interval=False)
         self.logger.critical('terminated')
 
+    def _run_pipeline(self, poller: 'zmq.Poller', in_sock: 'zmq.Socket', out_sock: 'zmq.Socket',
+                      ctrl_sock: 'zmq.Socket'):
+        """
+        Run the event loop as a pipeline of three stages connected by bounded queues, so that
+        the (de)serialization and the network I/O overlap with the handler:
+
+        - this thread receives and parses the messages, then calls the pre-hooks;
+        - ``--pipeline_workers`` threads call the handler and the post-hooks;
+        - a sender thread serializes and sends the results, in the same order as the messages are received.
+
+        Control messages, dumps and the held-back messages from :py:meth:`pending_messages` are handled
+        in this thread. The handler is called concurrently with :py:meth:`pending_messages`, and with
+        more than one worker also with itself, so both must be thread-safe.
+        """
+        work_queue = queue.Queue(self.args.pipeline_queue_size)
+        send_queue = queue.Queue(self.args.pipeline_queue_size)
+        seq_id = itertools.count()
+        errors = []
+
+        def _on_error(ex):
+            self.logger.error(ex, exc_info=True)
+            errors.append(ex)
+            self.is_event_loop.clear()
+
+        def _work():
+            while True:
+                item = work_queue.get()
+                if item is None:
+                    work_queue.task_done()
+                    return
+                try:
+                    # the body type seen by the pre-hooks, checked by the post-hooks in this thread
+                    self._msg_context.old_type = item[2]
+                    send_queue.put((item[0], self.handler.call_routes_get_output(item[1])))
+                except Exception as ex:
+                    # keep the sequence going, the pipeline will be stopped anyway
+                    send_queue.put((item[0], []))
+                    _on_error(ex)
+                finally:
+                    work_queue.task_done()
+
+        def _send():
+            # results that arrive ahead of their turn
+            out_of_order = {}
+            next_id = 0
+            while True:
+                item = send_queue.get()
+                if item is None:
+                    send_queue.task_done()
+                    return
+                out_of_order[item[0]] = item[1]
+                try:
+                    while next_id in out_of_order:
+                        for m in out_of_order.pop(next_id):
+                            send_message(out_sock, m, **self.send_recv_kwargs)
+                        next_id += 1
+                except Exception as ex:
+                    _on_error(ex)
+                finally:
+                    send_queue.task_done()
+
+        def _wait_in_flight():
+            work_queue.join()
+            send_queue.join()
+
+        workers = [threading.Thread(target=_work, daemon=True) for _ in range(self.args.pipeline_workers)]
+        sender = threading.Thread(target=_send, daemon=True)
+        for t in (*workers, sender):
+            t.start()
+        self.logger.info('pipelined event loop with %d workers' % len(workers))
+
+        try:
+            while self.is_event_loop.is_set():
+                socks = dict(poller.poll(1))
+                if socks.get(in_sock) == zmq.POLLIN:
+                    msg = recv_message(in_sock, **self.send_recv_kwargs)
+                elif socks.get(ctrl_sock) == zmq.POLLIN:
+                    msg = recv_message(ctrl_sock, **self.send_recv_kwargs)
+                else:
+                    msg = None
+                    # no message received, send out the held-back messages that are due
+                    self._msg_context.old_type = None
+                    out_msgs = list(self.pending_messages())
+                    for m in out_msgs:
+                        self.handler.call_hooks(m, hook_type='post', verbose=self.args.verbose)
+                    if out_msgs:
+                        send_queue.put((next(seq_id), out_msgs))
+
+                if msg is not None:
+                    self.handler.call_hooks(msg, hook_type='pre')
+                    if msg.request and msg.request.WhichOneof('body') and \
+                            isinstance(getattr(msg.request, msg.request.WhichOneof('body')),
+                                       gnes_pb2.Request.ControlRequest):
+                        _wait_in_flight()
+                        self.handler.call_routes_send_back(msg, ctrl_sock)
+                    else:
+                        # blocks when the workers are busy
+                        work_queue.put((next(seq_id), msg, msg.WhichOneof('body')))
+
+                # block the pipeline if a dump is needed
+                if self._is_dump_needed():
+                    _wait_in_flight()
+                    self.dump()
+        finally:
+            if not errors:
+                for _ in workers:
+                    work_queue.put(None)
+                for t in workers:
+                    t.join()
+                send_queue.put(None)
+                sender.join()
+        if errors:
+            raise errors[0]
+
     def post_init(self):
         pass
 
+    def pending_messages(self, force: bool = False) -> Iterable['gnes_pb2.Message']:
+        """
+        Messages held back by the handler (via :py:class:`BlockMessage`) that are due to be sent out,
+        polled by the event loop whenever no new message arrives
+
+        :param force: return all held-back messages, used before the service terminates
+        """
+        return []
+
     def load_model(self, base_class: Type[TrainableBase], yaml_path=None) -> T:
         try:
             return base_class.load_yaml(self.args.yaml_path if not yaml_path else yaml_path)
@@ -533,6 +793,9 @@ class BaseService(metaclass=ConcurrentService):
             raise EventLoopEnd
         elif msg.request.control.command == gnes_pb2.Request.ControlRequest.STATUS:
             msg.response.control.status = gnes_pb2.Response.READY
+            msg.response.control.is_dumping = self.is_dumping
+            msg.response.control.last_dump_duration = self.last_dump_duration
+            msg.response.control.last_dump_size = self.last_dump_size
         else:
             raise ServiceError('dont know how to handle %s' % msg.request.control)
 
@@ -544,13 +807,23 @@ class BaseService(metaclass=ConcurrentService):
         if self.is_event_loop.is_set():
             msg = gnes_pb2.Message()
             msg.request.control.command = gnes_pb2.Request.ControlRequest.TERMINATE
-            return send_ctrl_message(self.ctrl_addr, msg, timeout=self.args.timeout)
+            return self._send_ctrl_message(msg)
 
     @property
     def status(self):
         msg = gnes_pb2.Message()
         msg.request.control.command = gnes_pb2.Request.ControlRequest.STATUS
-        return send_ctrl_message(self.ctrl_addr, msg, timeout=self.args.timeout)
+        return self._send_ctrl_message(msg)
+
+    def _send_ctrl_message(self, msg: 'gnes_pb2.Message'):
+        # the control socket is a PAIR, which refuses a new peer until the previous one is gone,
+        # so a message sent right after another one may be dropped, resend it until it is answered
+        deadline = time.perf_counter() + self.args.timeout / 1000 if self.args.timeout > 0 else None
+        while True:
+            r = send_ctrl_message(self.ctrl_addr, msg, timeout=_CTRL_RETRY_INTERVAL)
+            if r is not None or not self.is_event_loop.is_set() or \
+                    (deadline is not None and time.perf_counter() > deadline):
+                return r
 
     def __enter__(self):
         self.start()
@@ -14,19 +14,178 @@
 #  limitations under the License.
 
 
-from typing import List, Union
+import hashlib
+import io
+import os
+import re
+import shutil
+import threading
+import time
+from typing import List, Union, Generator, Optional
 
-from .base import BaseService as BS, MessageHandler
-from ..proto import gnes_pb2, array2blob, blob2array
+import numpy as np
+
+from .base import BaseService as BS, MessageHandler, BlockMessage
+from ..base import yaml
+from ..helper import LRUCache
+from ..proto import gnes_pb2, array2blob, blob2array, pack_chunk_embeddings
+
+
+class EmbeddingCache:
+    """
+    A content-addressed cache of the chunk embeddings. The recently used ones are kept in memory,
+    and if ``path`` is given, all of them are kept as .npy files under ``path``, as the second tier.
+    Every encoder has its own sub-directory there, which is the only one :py:meth:`clear` removes
+    """
+
+    def __init__(self, max_bytes: int, path: str = None, encoder_id: str = ''):
+        """
+        :param max_bytes: size of the in-memory tier
+        :param path: directory of the on-disk tier, it can be shared by several encoders
+        :param encoder_id: identity of the encoder, mixed into the keys so that the encoders sharing
+                ``path`` never read each other's embeddings
+        """
+        self._mem = LRUCache(max_bytes, size_fn=lambda x: x.nbytes)
+        self._encoder_id = encoder_id.encode()
+        self.path = os.path.join(path, 'embed-%s' % hashlib.blake2b(
+            self._encoder_id, digest_size=8).hexdigest()) if path else None
+        self.num_hit = 0
+        self.num_miss = 0
+        self._stat_lock = threading.Lock()
+
+    def get_key(self, doc_type: int, c: 'gnes_pb2.Chunk') -> str:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self._encoder_id)
+        h.update(bytes([doc_type]))
+        if c.WhichOneof('content') == 'text':
+            h.update(c.text.encode())
+        else:
+            h.update(c.blob.SerializeToString())
+        return h.hexdigest()
+
+    def _get_file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + '.npy')
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        v = self._mem.get(key)
+        if v is None and self.path:
+            try:
+                v = np.load(self._get_file(key))
+                self._mem.put(key, v)
+            except FileNotFoundError:
+                pass
+        with self._stat_lock:
+            if v is None:
+                self.num_miss += 1
+            else:
+                self.num_hit += 1
+        return v
+
+    def put(self, key: str, value: np.ndarray) -> None:
+        # a copy, so that the cached row does not keep the whole batch alive
+        value = np.array(value)
+        self._mem.put(key, value)
+        if self.path:
+            f = self._get_file(key)
+            os.makedirs(os.path.dirname(f), exist_ok=True)
+            # written aside and then renamed, so that a reader never sees a partial file
+            tmp = '%s.%d.%d.tmp' % (f, os.getpid(), threading.get_ident())
+            with open(tmp, 'wb') as fp:
+                np.save(fp, value)
+            os.replace(tmp, f)
+
+    @property
+    def num_bytes(self) -> int:
+        return self._mem.num_bytes
+
+    def clear(self) -> None:
+        self._mem.clear()
+        if self.path and os.path.exists(self.path):
+            shutil.rmtree(self.path)
 
 
 class EncoderService(BS):
     handler = MessageHandler(BS.handler)
+    # the batching and the embedding cache are locked, the encoder itself must allow concurrent encode() calls
+    thread_safe_handlers = True
 
     def post_init(self):
+        # messages held back for micro-batching
+        self._pending = []  # type: List['gnes_pb2.Message']
+        self._num_pending_chunks = 0
+        self._pending_since = 0
+        # the handler and "pending_messages" may be called from different threads in the pipelined event loop
+        self._batch_lock = threading.Lock()
         from ..encoder.base import BaseEncoder
         self._model = self.load_model(BaseEncoder)
         self.train_data = []
+        if self.args.embed_cache_size > 0 or self.args.embed_cache_path:
+            self._embed_cache = EmbeddingCache(self.args.embed_cache_size * 1024 * 1024, self.args.embed_cache_path,
+                                               self._get_encoder_id())
+        else:
+            self._embed_cache = None
+
+    def _get_encoder_id(self) -> str:
+        # the class and the config of the model, including the configured names of the components,
+        # as they decide the dump paths, but not the random ones given to the unnamed components
+        config = io.StringIO()
+        try:
+            yaml.dump(self._model, config)
+        except Exception as ex:
+            self.logger.warning('fail to dump the config of the encoder, only its class is used: %s' % ex)
+        config = re.sub(r'^(\s*name: \w+)-[0-9a-f]{8}$', r'\1', config.getvalue(), flags=re.MULTILINE)
+        # and the dumps the model and its components are restored from, so that retraining the model
+        # or swapping a dump gives a new id. The size and mtime are used, hashing a large dump slows down the start
+        dumps = []
+        models = [self._model]
+        while models:
+            m = models.pop()
+            c = getattr(m, 'components', None) or []
+            models.extend(c.values() if isinstance(c, dict) else c)
+            if os.path.isfile(m.dump_full_path):
+                st = os.stat(m.dump_full_path)
+                dumps.append('%s %d %d' % (m.name, st.st_size, st.st_mtime_ns))
+        return '%s\n%s\n%s' % (self._model.__class__.__name__, config, '\n'.join(dumps))
+
+    @staticmethod
+    def _get_docs(msg: 'gnes_pb2.Message') -> List['gnes_pb2.Document']:
+        if msg.request.WhichOneof('body') == 'search':
+            return [msg.request.search.query]
+        return list(msg.request.index.docs)
+
+    def _add_to_batch(self, msg: 'gnes_pb2.Message') -> Generator:
+        with self._batch_lock:
+            if not self._pending:
+                self._pending_since = time.perf_counter()
+            self._pending.append(msg)
+            self._num_pending_chunks += sum(len(d.chunks) for d in self._get_docs(msg))
+            # the wait is also checked on arrival, as "pending_messages" is only polled when the service is idle
+            if self._num_pending_chunks < self.args.max_batch_size and \
+                    (time.perf_counter() - self._pending_since) * 1000 < self.args.max_wait_ms:
+                raise BlockMessage
+            msgs = self._pop_batch()
+        yield from self._encode_batch(msgs)
+
+    def _pop_batch(self) -> List['gnes_pb2.Message']:
+        # must be called with the batch lock held
+        msgs = self._pending
+        self._pending = []
+        self._num_pending_chunks = 0
+        return msgs
+
+    def _encode_batch(self, msgs: List['gnes_pb2.Message']) -> List['gnes_pb2.Message']:
+        # one encode() call for the chunks of all held-back messages, the embeddings are written back in place
+        self.embed_chunks_in_docs([d for m in msgs for d in self._get_docs(m)])
+        self.logger.info('encoded %d messages in one batch' % len(msgs))
+        return msgs
+
+    def pending_messages(self, force: bool = False) -> List['gnes_pb2.Message']:
+        with self._batch_lock:
+            if not (self._pending and (force or (time.perf_counter() - self._pending_since) * 1000
+                                       >= self.args.max_wait_ms)):
+                return []
+            msgs = self._pop_batch()
+        return self._encode_batch(msgs)
 
     def embed_chunks_in_docs(self, docs: Union[List['gnes_pb2.Document'], 'gnes_pb2.Document'],
                              do_encoding: bool = True,
@@ -36,31 +195,44 @@ class EncoderService(BS):
 
         contents = []
         chunks = []
+        # the range of each doc in "chunks"
+        doc_spans = []
 
         for d in docs:
             if not d.chunks:
                 self.logger.warning('document (doc_id=%s) contains no chunks!' % d.doc_id)
                 continue
 
+            start = len(chunks)
             for c in d.chunks:
                 if d.doc_type == gnes_pb2.Document.TEXT:
                     contents.append(c.text)
                 elif d.doc_type in {gnes_pb2.Document.IMAGE, gnes_pb2.Document.VIDEO}:
-                    contents.append(blob2array(c.blob))
+                    contents.append(blob2array(c.blob, copy=False))
                 else:
                     self.logger.warning(
                         'chunk content is in type: %s, dont kow how to handle that, ignored' % c.WhichOneof('content'))
                 chunks.append(c)
+            doc_spans.append((d, start, len(chunks)))
 
         if do_encoding and contents:
             try:
-                embeds = self._model.encode(contents)
+                if self._embed_cache is not None and len(contents) == len(chunks):
+                    embeds = self._encode_with_cache(contents, [self._embed_cache.get_key(d.doc_type, c)
+                                                                for d, start, end in doc_spans
+                                                                for c in d.chunks])
+                else:
+                    embeds = self._model.encode(contents)
                 if len(chunks) != embeds.shape[0]:
                     self.logger.error(
                         'mismatched %d chunks and a %s shape embedding, '
                         'the first dimension must be the same' % (len(chunks), embeds.shape))
-                for idx, c in enumerate(chunks):
-                    c.embedding.CopyFrom(array2blob(embeds[idx]))
+                if self.args.pack_embedding:
+                    for d, start, end in doc_spans:
+                        pack_chunk_embeddings(d, embeds[start:end])
+                else:
+                    for idx, c in enumerate(chunks):
+                        c.embedding.CopyFrom(array2blob(embeds[idx]))
             except Exception as ex:
                 self.logger.error(ex, exc_info=True)
                 self.logger.warning('encoder service throws an exception, '
@@ -68,8 +240,24 @@ class EncoderService(BS):
 
         return contents
 
+    def _encode_with_cache(self, contents: List, keys: List[str]) -> np.ndarray:
+        embeds = [self._embed_cache.get(k) for k in keys]
+        # only the misses are encoded, in one batch and once per distinct content
+        misses = {}
+        for j, (k, e) in enumerate(zip(keys, embeds)):
+            if e is None:
+                misses.setdefault(k, j)
+        if misses:
+            encoded = dict(zip(misses, self._model.encode([contents[j] for j in misses.values()])))
+            for k, e in encoded.items():
+                self._embed_cache.put(k, e)
+            embeds = [encoded[k] if e is None else e for k, e in zip(keys, embeds)]
+        return np.stack(embeds)
+
     @handler.register(gnes_pb2.Request.IndexRequest)
     def _handler_index(self, msg: 'gnes_pb2.Message'):
+        if self.args.max_batch_size > 0:
+            return self._add_to_batch(msg)
         self.embed_chunks_in_docs(msg.request.index.docs)
 
     @handler.register(gnes_pb2.Request.TrainRequest)
@@ -84,12 +272,26 @@ class EncoderService(BS):
             self.logger.info('%d samples is flushed for training' % len(self.train_data))
             self.is_model_changed.set()
             self.train_data.clear()
+            if self._embed_cache is not None:
+                # the cached embeddings are from the model before training
+                self._embed_cache.clear()
             msg.response.control.status = gnes_pb2.Response.SUCCESS
 
     @handler.register(gnes_pb2.Request.QueryRequest)
     def _handler_search(self, msg: 'gnes_pb2.Message'):
+        if self.args.max_batch_size > 0:
+            return self._add_to_batch(msg)
         self.embed_chunks_in_docs(msg.request.search.query, is_input_list=False)
 
+    @handler.register(gnes_pb2.Request.ControlRequest)
+    def _handler_control(self, msg: 'gnes_pb2.Message'):
+        is_status = msg.request.control.command == gnes_pb2.Request.ControlRequest.STATUS
+        BS._handler_control(self, msg)
+        if is_status and self._embed_cache is not None:
+            msg.response.control.num_cache_hit = self._embed_cache.num_hit
+            msg.response.control.num_cache_miss = self._embed_cache.num_miss
+            msg.response.control.cache_size = self._embed_cache.num_bytes
+
     @handler.register_hook(hook_type=('pre', 'post'), only_when_verbose=True)
     def _hook_debug_msg(self, msg: 'gnes_pb2.Message', *args, **kwargs):
         from pprint import pformat
@@ -24,6 +24,7 @@ from google.protobuf.json_format import MessageToJson
 from ..client.base import ZmqClient
 from ..helper import set_logger, make_route_table
 from ..proto import gnes_pb2_grpc, gnes_pb2, router2str, add_route, add_version
+from ..score_fn.base import render_explained
 
 
 class FrontendService:
@@ -88,11 +89,20 @@ class FrontendService:
             add_version(msg.envelope)
             add_route(msg.envelope, FrontendService.__name__, self.args.identity)
             msg.request.CopyFrom(body)
+            if self.args.explain_score and msg.request.WhichOneof('body') == 'search':
+                msg.request.search.explain = True
             return msg
 
         def remove_envelope(self, m: 'gnes_pb2.Message'):
             resp = m.response
             resp.request_id = m.envelope.request_id
+            resp.is_partial = m.envelope.is_partial
+            if resp.is_partial:
+                self.logger.warning('request %s is answered from only some of the shards' % resp.request_id)
+            if resp.WhichOneof('body') == 'search' and resp.search.explain:
+                # the explanation trees are rendered to JSON only here, once per request
+                for r in resp.search.topk_results:
+                    render_explained(r.score)
             m.envelope.routes[0].end_time.GetCurrentTime()
             if self.args.route_table:
                 self.logger.info('route: %s' % router2str(m))
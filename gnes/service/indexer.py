@@ -13,10 +13,14 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import hashlib
+from typing import List
+
 import numpy as np
 
 from .base import BaseService as BS, MessageHandler, ServiceError
-from ..proto import gnes_pb2, blob2array
+from ..helper import LRUCache
+from ..proto import gnes_pb2, unpack_chunk_embeddings
 
 
 class IndexerService(BS):
@@ -28,6 +32,10 @@ class IndexerService(BS):
         self._model = self.load_model(BaseIndexer)
         # self._tmp_a = threading.get_ident()
         # print('id: %s, after: %r, self._tmp_a: %r' % (threading.get_ident(), self._model, self._tmp_a))
+        self._result_cache = LRUCache(self.args.result_cache_size * 1024 * 1024,
+                                      self.args.result_cache_ttl) if self.args.result_cache_size > 0 else None
+        # bumped on every change of the index, so that a result queried before the change is not cached
+        self._index_generation = 0
 
     @handler.register(gnes_pb2.Request.IndexRequest)
     def _handler_index(self, msg: 'gnes_pb2.Message'):
@@ -47,22 +55,27 @@ class IndexerService(BS):
             msg.response.index.status = gnes_pb2.Response.SUCCESS
 
         if is_changed:
+            self._index_generation += 1
+            if self._result_cache is not None:
+                self._result_cache.clear()
             self.is_model_changed.set()
 
     def _handler_chunk_index(self, msg: 'gnes_pb2.Message') -> bool:
-        embed_info = []
+        vecs, keys, weights = [], [], []
 
         for d in msg.request.index.docs:
             if not d.chunks:
                 self.logger.warning('document (doc_id=%s) contains no chunks!' % d.doc_id)
                 continue
 
-            embed_info += [(blob2array(c.embedding), d.doc_id, c.offset, c.weight) for c in d.chunks if
-                           c.embedding.data]
+            embeds, chunk_idx = unpack_chunk_embeddings(d)
+            if chunk_idx:
+                vecs.append(embeds)
+                keys += [(d.doc_id, d.chunks[j].offset) for j in chunk_idx]
+                weights += [d.chunks[j].weight for j in chunk_idx]
 
-        if embed_info:
-            vecs, doc_ids, offsets, weights = zip(*embed_info)
-            self._model.add(list(zip(doc_ids, offsets)), np.stack(vecs), weights)
+        if vecs:
+            self._model.add(keys, np.concatenate(vecs) if len(vecs) > 1 else vecs[0], weights)
             return True
         else:
             self.logger.warning('chunks contain no embedded vectors, the indexer will do nothing')
@@ -80,7 +93,6 @@ class IndexerService(BS):
     def _put_result_into_message(self, results, msg: 'gnes_pb2.Message'):
         msg.response.search.ClearField('topk_results')
         msg.response.search.topk_results.extend(results)
-        msg.response.search.top_k = len(results)
         msg.response.search.is_big_score_similar = self._model.is_big_score_similar
 
     @handler.register(gnes_pb2.Request.QueryRequest)
@@ -91,12 +103,57 @@ class IndexerService(BS):
                 'unsupported indexer, dont know how to use %s to handle this message' % self._model.__bases__)
 
         results = []
+        top_k = msg.request.search.top_k
+        explain = self.args.explain_score or msg.request.search.explain
         if not msg.request.search.query.chunks:
             self.logger.warning('query contains no chunks!')
         else:
-            results = self._model.query_and_score(msg.request.search.query.chunks, top_k=msg.request.search.top_k)
+            embeds, chunk_idx = unpack_chunk_embeddings(msg.request.search.query)
+            if chunk_idx:
+                q_chunks = [msg.request.search.query.chunks[j] for j in chunk_idx]
+                results = self._query_with_cache(q_chunks, embeds, top_k, explain)
+            else:
+                self.logger.warning('query chunks contain no embedded vectors!')
 
         self._put_result_into_message(results, msg)
+        # the requested top_k is kept in the response, so that the reducers know how many results to keep
+        msg.response.search.top_k = top_k
+        msg.response.search.explain = explain
+
+    def _query_with_cache(self, q_chunks: List['gnes_pb2.Chunk'], embeds: np.ndarray, top_k: int,
+                          explain: bool) -> List['gnes_pb2.Response.QueryResponse.ScoredResult']:
+        if self._result_cache is None:
+            return self._model.query_and_score(q_chunks, top_k=top_k, q_embeddings=embeds, explain=explain)
+
+        key = self._get_cache_key(q_chunks, embeds, top_k, explain)
+        cached = self._result_cache.get(key)
+        if cached is not None:
+            return gnes_pb2.Response.QueryResponse.FromString(cached).topk_results
+
+        generation = self._index_generation
+        results = self._model.query_and_score(q_chunks, top_k=top_k, q_embeddings=embeds, explain=explain)
+        if generation == self._index_generation:
+            self._result_cache.put(key, gnes_pb2.Response.QueryResponse(topk_results=results).SerializeToString())
+        return results
+
+    @staticmethod
+    def _get_cache_key(q_chunks: List['gnes_pb2.Chunk'], embeds: np.ndarray, top_k: int, explain: bool) -> bytes:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr((embeds.dtype.str, embeds.shape, top_k, explain)).encode())
+        h.update(np.ascontiguousarray(embeds).tobytes())
+        for c in q_chunks:
+            # the score functions read the weight and the offsets of the query chunks
+            h.update(repr((c.weight, c.offset, list(c.offset_nd))).encode())
+        return h.digest()
+
+    @handler.register(gnes_pb2.Request.ControlRequest)
+    def _handler_control(self, msg: 'gnes_pb2.Message'):
+        is_status = msg.request.control.command == gnes_pb2.Request.ControlRequest.STATUS
+        BS._handler_control(self, msg)
+        if is_status and self._result_cache is not None:
+            msg.response.control.num_cache_hit = self._result_cache.num_hit
+            msg.response.control.num_cache_miss = self._result_cache.num_miss
+            msg.response.control.cache_size = self._result_cache.num_bytes
 
     @handler.register(gnes_pb2.Response.QueryResponse)
     def _handler_doc_search(self, msg: 'gnes_pb2.Message'):
@@ -115,5 +172,6 @@ class IndexerService(BS):
 
         # assume the doc search will change the whatever sort order the message has
         msg.response.search.is_sorted = False
-        results = self._model.query_and_score(msg.response.search.topk_results)
+        msg.response.search.explain |= self.args.explain_score
+        results = self._model.query_and_score(msg.response.search.topk_results, explain=msg.response.search.explain)
         self._put_result_into_message(results, msg)
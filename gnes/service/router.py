@@ -14,13 +14,18 @@
 #  limitations under the License.
 
 
-from collections import defaultdict
-from typing import Dict, List
+import threading
+import time
+from collections import defaultdict, OrderedDict
+from typing import Dict, List, Tuple, Any, Generator, Iterable, Optional
 
 from .base import BaseService as BS, MessageHandler, BlockMessage
 from ..proto import gnes_pb2
 from ..router.base import BaseReduceRouter
 
+# number of recently evicted request ids remembered for dropping their late parts
+_MAX_EVICTED = 10000
+
 
 class RouterService(BS):
     handler = MessageHandler(BS.handler)
@@ -29,6 +34,15 @@ class RouterService(BS):
         from ..router.base import BaseRouter
         self._model = self.load_model(BaseRouter)
         self._pending = defaultdict(list)  # type: Dict[str, List]
+        # for the incremental reducers, only the number of received parts, the reduce state
+        # and the last received part (which the result is written into) are kept
+        self._pending_state = {}  # type: Dict[str, Tuple[int, Any, 'gnes_pb2.Message']]
+        # arrival time of the first part of every pending request, in arrival order
+        self._pending_since = OrderedDict()  # type: Dict[str, float]
+        self._evicted = OrderedDict()  # type: Dict[str, None]
+        self._lock = threading.Lock()
+        self.num_evicted_reduce = 0
+        self.num_late_parts = 0
 
     def _is_msg_complete(self, msg: 'gnes_pb2.Message', num_req: int) -> bool:
         return (self.args.num_part is None and num_req == msg.envelope.num_part[-1]) or \
@@ -37,14 +51,86 @@ class RouterService(BS):
     @handler.register(NotImplementedError)
     def _handler_default(self, msg: 'gnes_pb2.Message'):
         if isinstance(self._model, BaseReduceRouter):
-            req_id = msg.envelope.request_id
+            return self._reduce(msg)
+        else:
+            return self._model.apply(msg)
+
+    def _reduce(self, msg: 'gnes_pb2.Message') -> Generator:
+        with self._lock:
+            # expire the pending requests here as well, the event loop may never be idle under load
+            out_msgs = list(self._pop_expired())
+            done = self._add_part(msg)
+        if done is not None:
+            out_msgs.append(done)
+        if not out_msgs:
+            raise BlockMessage
+        yield from out_msgs
+
+    def _add_part(self, msg: 'gnes_pb2.Message') -> Optional['gnes_pb2.Message']:
+        """Add a part to its pending request, return the reduced message once all parts are received"""
+        req_id = msg.envelope.request_id
+        if req_id in self._evicted:
+            self.num_late_parts += 1
+            self.logger.warning('drop a part of request %s as it arrives after the reduce deadline' % req_id)
+            return None
+
+        self._pending_since.setdefault(req_id, time.perf_counter())
+        if self._model.is_incremental:
+            num_req, state, _ = self._pending_state.get(req_id, (0, None, None))
+            num_req, state = num_req + 1, self._model.accumulate(state, msg)
+            self._pending_state[req_id] = (num_req, state, msg)
+        else:
             self._pending[req_id].append(msg)
             num_req = len(self._pending[req_id])
 
-            if self._is_msg_complete(msg, num_req):
-                prev_msgs = self._pending.pop(req_id)
-                return self._model.apply(msg, prev_msgs)
-            else:
-                raise BlockMessage
+        if self._is_msg_complete(msg, num_req):
+            return self._pop_reduced(req_id)
+
+    def _pop_reduced(self, req_id: str) -> 'gnes_pb2.Message':
+        self._pending_since.pop(req_id, None)
+        if self._model.is_incremental:
+            _, state, msg = self._pending_state.pop(req_id)
+            self._model.finalize(state, msg)
         else:
-            return self._model.apply(msg)
+            prev_msgs = self._pending.pop(req_id)
+            msg = prev_msgs[-1]
+            self._model.apply(msg, prev_msgs)
+        return msg
+
+    def _pop_expired(self, force: bool = False) -> Iterable['gnes_pb2.Message']:
+        if self.args.reduce_timeout <= 0 and not force:
+            return
+        deadline = time.perf_counter() - self.args.reduce_timeout / 1000
+        expired = []
+        for req_id, since in self._pending_since.items():
+            if since > deadline and not force:
+                break
+            expired.append(req_id)
+
+        for req_id in expired:
+            self._evicted[req_id] = None
+            if len(self._evicted) > _MAX_EVICTED:
+                self._evicted.popitem(last=False)
+            self.num_evicted_reduce += 1
+            try:
+                msg = self._pop_reduced(req_id)
+            except Exception as ex:
+                self.logger.error('fail to reduce the partial request %s: %s' % (req_id, ex), exc_info=True)
+                continue
+            msg.envelope.is_partial = True
+            self.logger.warning('request %s is reduced from only some of its parts' % req_id)
+            yield msg
+
+    def pending_messages(self, force: bool = False) -> Iterable['gnes_pb2.Message']:
+        with self._lock:
+            return list(self._pop_expired(force and self.args.reduce_timeout > 0))
+
+    @handler.register(gnes_pb2.Request.ControlRequest)
+    def _handler_control(self, msg: 'gnes_pb2.Message'):
+        is_status = msg.request.control.command == gnes_pb2.Request.ControlRequest.STATUS
+        BS._handler_control(self, msg)
+        if is_status:
+            with self._lock:
+                msg.response.control.num_pending_reduce = len(self._pending_since)
+                msg.response.control.num_evicted_reduce = self.num_evicted_reduce
+                msg.response.control.num_late_parts = self.num_late_parts
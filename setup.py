@@ -67,6 +67,7 @@ extras_dep = {
     'chinese': ['jieba'],
     'vision': ['opencv-python>=4.0.0', 'imagehash>=4.0', 'image', 'peakutils'],
     'leveldb': ['plyvel>=1.0.5'],
+    'compression': ['zstandard', 'lz4'],
     'test': ['pylint', 'memory_profiler>=0.55.0', 'psutil>=5.6.1', 'gputil>=1.4.0'],
     'transformers': ['pytorch-transformers'],
     'onnx': ['onnxruntime'],
@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+
+from gnes.encoder.numeric.hash import HashEncoder
+from gnes.helper import nearest_centroids, adc_table, centroid_norms
+from gnes.encoder.numeric.pq import PQEncoder
+from gnes.helper import TimeContext
+
+
+def _legacy_pq_encode(vecs, centroids):
+    # the original implementation of PQEncoder.encode, kept for the benchmark
+    x = np.reshape(vecs, [vecs.shape[0], centroids.shape[1], 1, centroids.shape[3]])
+    x = np.sum(np.square(x - centroids), -1)
+    return np.array(np.argmax(-x, 2) + 1, dtype=np.uint8)
+
+
+class TestNearestCentroids(unittest.TestCase):
+    def setUp(self):
+        self.num_sub = 8
+        self.num_clusters = 50
+        self.dim_per_sub = 4
+        self.centroids = np.random.random([self.num_sub, self.num_clusters, self.dim_per_sub]).astype(np.float32)
+        self.vecs = np.random.random([500, self.num_sub * self.dim_per_sub]).astype(np.float32)
+
+    def _get_pq(self):
+        pq = PQEncoder(self.num_sub, self.num_clusters)
+        pq.centroids = np.expand_dims(self.centroids, 0)
+        pq.is_trained = True
+        return pq
+
+    def test_nearest_centroids(self):
+        x = np.reshape(self.vecs, [-1, self.num_sub, self.dim_per_sub])
+        dist = np.sum(np.square(np.expand_dims(x, 2) - self.centroids), -1)
+        expected = np.argmin(dist, -1)
+
+        np.testing.assert_array_equal(nearest_centroids(x, self.centroids), expected)
+        out = np.zeros([len(x), self.num_sub], dtype=np.uint8)
+        ret = nearest_centroids(x, self.centroids, centroid_norms(self.centroids), out=out, offset=1)
+        self.assertIs(ret, out)
+        np.testing.assert_array_equal(out, expected + 1)
+        self.assertRaises(ValueError, nearest_centroids, x[:, :3], self.centroids)
+
+    def test_adc_table(self):
+        table = adc_table(self.vecs[:10], self.centroids)
+        self.assertEqual(table.shape, (10, self.num_sub, self.num_clusters))
+
+        # the table sums up to the distance between a query and the reconstructed vector
+        codes = nearest_centroids(np.reshape(self.vecs, [-1, self.num_sub, self.dim_per_sub]), self.centroids)
+        recon = np.reshape(self.centroids[np.arange(self.num_sub), codes], [len(self.vecs), -1])
+        expected = np.sum(np.square(np.expand_dims(self.vecs[:10], 1) - recon), -1)
+        dist = table[:, np.arange(self.num_sub), codes].sum(-1)
+        np.testing.assert_allclose(dist, expected, rtol=1e-4, atol=1e-4)
+
+    def test_pq_encode(self):
+        pq = self._get_pq()
+        np.testing.assert_array_equal(pq.encode(self.vecs), _legacy_pq_encode(self.vecs, pq.centroids))
+        self.assertEqual(pq.encode(self.vecs).dtype, np.uint8)
+
+    def test_hash_pred_kmeans(self):
+        m = HashEncoder(self.num_sub, num_idx=3, kmeans_clusters=self.num_clusters)
+        m.centroids = np.random.random([1, 3, self.num_clusters, self.vecs.shape[1]]).astype(np.float32)
+        x = np.reshape(self.vecs, [self.vecs.shape[0], 1, 1, self.vecs.shape[1]])
+        expected = np.argmax(-np.sum(np.square(x - m.centroids), -1), axis=-1)
+        out = m.pred_kmeans(self.vecs)
+        self.assertEqual(out.dtype, np.uint32)
+        np.testing.assert_array_equal(out, expected)
+
+    def test_bench_legacy(self):
+        self.num_clusters = 255
+        self.centroids = np.random.random([16, self.num_clusters, 8]).astype(np.float32)
+        self.num_sub = 16
+        pq = self._get_pq()
+        vecs = np.random.random([2048, 128]).astype(np.float32)
+        with TimeContext('legacy PQEncoder.encode()'):
+            res1 = _legacy_pq_encode(vecs, pq.centroids)
+        with TimeContext('matmul PQEncoder.encode()'):
+            res2 = pq.encode(vecs)
+        np.testing.assert_array_equal(res1, res2)
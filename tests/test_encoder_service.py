@@ -1,13 +1,16 @@
 import os
+import random
+import shutil
+import time
 import unittest
 
 import numpy as np
 
 from gnes.cli.parser import set_encoder_parser, _set_client_parser
 from gnes.client.base import ZmqClient
-from gnes.proto import gnes_pb2, array2blob
-from gnes.service.base import ServiceManager
-from gnes.service.encoder import EncoderService
+from gnes.proto import gnes_pb2, array2blob, blob2array
+from gnes.service.base import ServiceManager, BlockMessage
+from gnes.service.encoder import EncoderService, EmbeddingCache
 from gnes.encoder.base import BaseEncoder
 
 
@@ -17,6 +20,20 @@ class TestEncoder(BaseEncoder):
         return np.array(x)
 
 
+class BatchSizeEncoder(BaseEncoder):
+
+    def encode(self, x):
+        # every embedding is the size of the batch it is encoded in
+        return np.full([len(x), 1], len(x), dtype=np.float32)
+
+
+class SlowEncoder(BaseEncoder):
+
+    def encode(self, x):
+        time.sleep(random.random() * 0.05)
+        return np.stack([np.ravel(v)[:1] for v in x]).astype(np.float32)
+
+
 class TestEncoderService(unittest.TestCase):
 
     def setUp(self):
@@ -41,6 +58,222 @@ class TestEncoderService(unittest.TestCase):
             self.assertEqual(len(r.request.index.docs), 1)
             self.assertEqual(r.response.index.status, gnes_pb2.Response.SUCCESS)
 
+    def test_micro_batching(self):
+        self._test_micro_batching([])
+
+    def test_micro_batching_pipeline(self):
+        self._test_micro_batching(['--pipeline_workers', '1'])
+
+    def _test_micro_batching(self, extra_args):
+        args = set_encoder_parser().parse_args([
+            '--yaml_path', '!BatchSizeEncoder {gnes_config: {name: EncoderService, is_trained: true}}',
+            '--max_batch_size', '4',
+            # never due on its own, the wait is driven by the test
+            '--max_wait_ms', '3600000', *extra_args])
+        c_args = _set_client_parser().parse_args([
+            '--port_in', str(args.port_out),
+            '--port_out', str(args.port_in)])
+
+        with EncoderService(args) as s, ZmqClient(c_args) as client:
+            # 6 messages of one chunk each, the first 4 are encoded in one batch
+            for j in range(6):
+                msg = gnes_pb2.Message()
+                msg.envelope.request_id = j
+                d = msg.request.index.docs.add()
+                d.doc_type = gnes_pb2.Document.IMAGE
+                d.chunks.add().blob.CopyFrom(array2blob(self.test_numeric[j]))
+                client.send_message(msg)
+
+            for j in range(4):
+                r = client.recv_message()
+                self.assertEqual(r.envelope.request_id, j)
+                self.assertEqual(blob2array(r.request.index.docs[0].chunks[0].embedding)[0], 4)
+
+            # the last 2 are held back until they have waited for "max_wait_ms"
+            deadline = time.perf_counter() + 10
+            while len(s._pending) < 2 and time.perf_counter() < deadline:
+                time.sleep(0.01)
+            with s._batch_lock:
+                self.assertEqual(len(s._pending), 2)
+                s._pending_since -= args.max_wait_ms / 1000
+            for j in range(4, 6):
+                r = client.recv_message()
+                self.assertEqual(r.envelope.request_id, j)
+                self.assertEqual(blob2array(r.request.index.docs[0].chunks[0].embedding)[0], 2)
+
+            # a message with a full batch of chunks is not held back
+            msg = gnes_pb2.Message()
+            for j in range(5):
+                c = msg.request.search.query.chunks.add()
+                c.blob.CopyFrom(array2blob(self.test_numeric[j]))
+            msg.request.search.query.doc_type = gnes_pb2.Document.IMAGE
+            client.send_message(msg)
+            r = client.recv_message()
+            self.assertEqual(blob2array(r.request.search.query.chunks[0].embedding)[0], 5)
+
+    def test_micro_batching_wait_on_arrival(self):
+        args = set_encoder_parser().parse_args([
+            '--yaml_path', '!BatchSizeEncoder {gnes_config: {name: EncoderService, is_trained: true}}',
+            '--max_batch_size', '100',
+            '--max_wait_ms', '50'])
+        s = EncoderService(args)
+        s.post_init()
+        msgs = []
+        for j in range(3):
+            msgs.append(gnes_pb2.Message())
+            d = msgs[-1].request.index.docs.add()
+            d.doc_type = gnes_pb2.Document.IMAGE
+            d.chunks.add().blob.CopyFrom(array2blob(self.test_numeric[j]))
+
+        self.assertRaises(BlockMessage, list, s._add_to_batch(msgs[0]))
+        self.assertRaises(BlockMessage, list, s._add_to_batch(msgs[1]))
+        # the service never gets idle, the next arrival flushes the batch that has waited too long
+        s._pending_since -= 0.05
+        self.assertEqual(list(s._add_to_batch(msgs[2])), msgs)
+        self.assertEqual(blob2array(msgs[0].request.index.docs[0].chunks[0].embedding)[0], 3)
+
+    def test_micro_batching_workers(self):
+        args = set_encoder_parser().parse_args([
+            '--yaml_path', '!SlowEncoder {gnes_config: {name: EncoderService, is_trained: true}}',
+            '--max_batch_size', '3',
+            '--max_wait_ms', '5',
+            '--pipeline_workers', '4'])
+        c_args = _set_client_parser().parse_args([
+            '--port_in', str(args.port_out),
+            '--port_out', str(args.port_in)])
+
+        with ServiceManager(EncoderService, args), ZmqClient(c_args) as client:
+            for j in range(30):
+                msg = gnes_pb2.Message()
+                msg.envelope.request_id = j
+                d = msg.request.index.docs.add()
+                d.doc_type = gnes_pb2.Document.IMAGE
+                d.chunks.add().blob.CopyFrom(array2blob(self.test_numeric[j]))
+                client.send_message(msg)
+
+            # batches are filled and flushed concurrently, no message goes out without its embedding
+            embeds = {}
+            for _ in range(30):
+                r = client.recv_message()
+                embeds[r.envelope.request_id] = blob2array(r.request.index.docs[0].chunks[0].embedding)[0]
+            self.assertEqual(embeds, {j: self.test_numeric[j][0] for j in range(30)})
+
+    def test_pipeline(self):
+        args = set_encoder_parser().parse_args([
+            '--yaml_path', '!SlowEncoder {gnes_config: {name: EncoderService, is_trained: true}}',
+            '--pipeline_workers', '4'])
+        c_args = _set_client_parser().parse_args([
+            '--port_in', str(args.port_out),
+            '--port_out', str(args.port_in)])
+
+        with ServiceManager(EncoderService, args), ZmqClient(c_args) as client:
+            for j in range(20):
+                msg = gnes_pb2.Message()
+                msg.envelope.request_id = j
+                d = msg.request.index.docs.add()
+                d.doc_type = gnes_pb2.Document.IMAGE
+                d.chunks.add().blob.CopyFrom(array2blob(self.test_numeric[j]))
+                client.send_message(msg)
+
+            # the results come out in the same order, though handled concurrently
+            for j in range(20):
+                r = client.recv_message()
+                self.assertEqual(r.envelope.request_id, j)
+                self.assertEqual(blob2array(r.request.index.docs[0].chunks[0].embedding)[0],
+                                 self.test_numeric[j][0])
+
+    def test_embed_cache(self):
+        cache_path = os.path.join(os.path.dirname(__file__), 'embed_cache')
+        self.addCleanup(shutil.rmtree, cache_path, ignore_errors=True)
+        def get_args():
+            args = set_encoder_parser().parse_args([
+                '--yaml_path', '!BatchSizeEncoder {gnes_config: {is_trained: true}}',
+                '--embed_cache_size', '1',
+                '--embed_cache_path', cache_path,
+                '--read_only'])
+            c_args = _set_client_parser().parse_args([
+                '--port_in', str(args.port_out),
+                '--port_out', str(args.port_in)])
+            return args, c_args
+
+        def encode(client, rows):
+            msg = gnes_pb2.Message()
+            d = msg.request.index.docs.add()
+            d.doc_type = gnes_pb2.Document.IMAGE
+            for j in rows:
+                d.chunks.add().blob.CopyFrom(array2blob(self.test_numeric[j]))
+            client.send_message(msg)
+            r = client.recv_message()
+            return [blob2array(c.embedding)[0] for c in r.request.index.docs[0].chunks]
+
+        args, c_args = get_args()
+        with EncoderService(args) as s, ZmqClient(c_args) as client:
+            # the repeated content is encoded once
+            self.assertEqual(encode(client, [0, 1, 0]), [2, 2, 2])
+            # only the new content is encoded, the cached ones are merged back in order
+            self.assertEqual(encode(client, [2, 0, 1]), [1, 2, 2])
+            self.assertEqual((s._embed_cache.num_hit, s._embed_cache.num_miss), (2, 4))
+
+        # a new service finds the embeddings in the on-disk tier
+        args, c_args = get_args()
+        with EncoderService(args) as s, ZmqClient(c_args) as client:
+            self.assertEqual(encode(client, [3, 2, 1]), [1, 1, 2])
+            r = s.status
+            self.assertEqual(r.response.control.num_cache_hit, 2)
+            self.assertEqual(r.response.control.num_cache_miss, 1)
+
+    def test_embed_cache_encoder_id(self):
+        work_dir = os.path.join(os.path.dirname(__file__), 'embed_cache_dump')
+        os.makedirs(work_dir, exist_ok=True)
+        self.addCleanup(shutil.rmtree, work_dir, ignore_errors=True)
+        def get_args():
+            return set_encoder_parser().parse_args([
+                '--yaml_path', '!BatchSizeEncoder {gnes_config: {name: cached_encoder, work_dir: %s, is_trained: true}}'
+                               % work_dir,
+                '--embed_cache_size', '1',
+                '--read_only'])
+
+        with EncoderService(get_args()) as s:
+            without_dump = s._get_encoder_id()
+            s._model.dump()
+            dump_id = s._get_encoder_id()
+            self.assertNotEqual(without_dump, dump_id)
+
+        # restored from the same dump, the id is the same
+        with EncoderService(get_args()) as s:
+            self.assertEqual(s._get_encoder_id(), dump_id)
+            # a new dump, e.g. of the retrained model, gives a new id
+            s._model.dump()
+            st = os.stat(s._model.dump_full_path)
+            os.utime(s._model.dump_full_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+            self.assertNotEqual(s._get_encoder_id(), dump_id)
+
+    def test_embed_cache_shared_path(self):
+        cache_path = os.path.join(os.path.dirname(__file__), 'embed_cache_shared')
+        self.addCleanup(shutil.rmtree, cache_path, ignore_errors=True)
+        os.makedirs(cache_path)
+        unrelated = os.path.join(cache_path, 'unrelated.txt')
+        with open(unrelated, 'w') as fp:
+            fp.write('not owned by the cache')
+
+        a = EmbeddingCache(1 << 20, cache_path, 'encoder-a')
+        b = EmbeddingCache(1 << 20, cache_path, 'encoder-b')
+        c = gnes_pb2.Chunk(text='hello')
+        key_a, key_b = a.get_key(gnes_pb2.Document.TEXT, c), b.get_key(gnes_pb2.Document.TEXT, c)
+        self.assertNotEqual(key_a, key_b)
+        a.put(key_a, np.ones(3))
+        b.put(key_b, np.zeros(5))
+
+        # another process of the same encoder reads the on-disk tier, never the ones of other encoders
+        np.testing.assert_array_equal(EmbeddingCache(1 << 20, cache_path, 'encoder-a').get(key_a), np.ones(3))
+        self.assertIsNone(EmbeddingCache(1 << 20, cache_path, 'encoder-a').get(key_b))
+
+        # clearing only removes the files of this encoder
+        a.clear()
+        self.assertIsNone(EmbeddingCache(1 << 20, cache_path, 'encoder-a').get(key_a))
+        np.testing.assert_array_equal(EmbeddingCache(1 << 20, cache_path, 'encoder-b').get(key_b), np.zeros(5))
+        self.assertTrue(os.path.exists(unrelated))
+
     def tearDown(self):
         if os.path.exists('EncoderService.bin'):
             os.remove('EncoderService.bin')
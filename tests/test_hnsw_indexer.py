@@ -0,0 +1,91 @@
+import glob
+import os
+import unittest
+
+import numpy as np
+
+from gnes.helper import TimeContext
+from gnes.indexer.chunk.hnsw import HNSWIndexer
+from gnes.indexer.chunk.numpy import NumpyIndexer
+
+
+def _recall(results, expected):
+    return np.mean([len(set(h[0] for h in r) & set(h[0] for h in e)) / len(e) for r, e in zip(results, expected)])
+
+
+class TestHNSWIndexer(unittest.TestCase):
+    def setUp(self):
+        self.vectors = np.random.random([1000, 16]).astype(np.float32)
+        self.queries = np.random.random([20, 16]).astype(np.float32)
+        self.keys = [(j, j % 3) for j in range(len(self.vectors))]
+        dirname = os.path.dirname(__file__)
+        self.data_path = os.path.join(dirname, 'hnsw_indexer')
+        self.dump_path = os.path.join(dirname, 'hnsw_indexer.bin')
+
+    def tearDown(self):
+        for f in glob.glob(self.data_path + '*'):
+            os.remove(f)
+
+    def _brute_force(self, metric, top_k=10):
+        b = NumpyIndexer(metric=metric)
+        b.add(self.keys, self.vectors, [1.] * len(self.keys))
+        return b.query(self.queries, top_k=top_k)
+
+    def test_query(self):
+        self.assertRaises(ValueError, HNSWIndexer, self.data_path, metric='l1')
+        for metric in ['l2', 'cosine', 'inner_product']:
+            a = HNSWIndexer(self.data_path, metric=metric, M=8, ef_construction=64)
+            self.assertListEqual(a.query(self.queries, top_k=3), [[]] * len(self.queries))
+            a.add(self.keys, self.vectors, [1.] * len(self.keys))
+            self.assertEqual(a.num_chunks, len(self.keys))
+            self.assertTrue(np.all((a._links0.data >= -1) & (a._links0.data < len(self.keys))))
+
+            res = a.query(self.queries, top_k=10)
+            self.assertTrue(all(len(r) == 10 for r in res))
+            self.assertTrue(all(np.all(np.diff([h[-1] for h in r]) >= 0) for r in res))
+            expected = self._brute_force(metric)
+            np.testing.assert_allclose([r[0][-1] for r in res], [r[0][-1] for r in expected], rtol=1e-3, atol=1e-4)
+            self.assertGreater(_recall(res, expected), 0.9)
+
+            self.assertGreater(_recall(a.query(self.queries, top_k=10, ef_search=500), expected), 0.98)
+
+    def test_interleaved_add_query(self):
+        a = HNSWIndexer(self.data_path, M=8)
+        for j in range(0, len(self.keys), 200):
+            a.add(self.keys[j:(j + 200)], self.vectors[j:(j + 200)], [1.] * 200)
+            # every vector is found right after it is added
+            ret = a.query(self.vectors[j:(j + 5)], top_k=1)
+            self.assertEqual([r[0][0] for r in ret], list(range(j, j + 5)))
+        self.assertEqual(a.num_docs, len(self.keys))
+
+    def test_dump_load(self):
+        a = HNSWIndexer(self.data_path, M=8)
+        a.add(self.keys[:500], self.vectors[:500], [1.] * 500)
+        a.dump(self.dump_path)
+        self.assertTrue(os.path.exists(self.data_path + '.link0.npy'))
+        np.testing.assert_array_equal(np.load(self.data_path + '.vec.npy'), self.vectors[:500])
+
+        b = HNSWIndexer.load(self.dump_path)
+        self.assertListEqual(a.query(self.queries, top_k=5), b.query(self.queries, top_k=5))
+        # the loaded graph keeps growing
+        b.add(self.keys[500:], self.vectors[500:], [1.] * 500)
+        self.assertEqual(b.num_chunks, len(self.keys))
+        self.assertGreater(_recall(b.query(self.queries, top_k=10), self._brute_force('l2')), 0.9)
+
+        a.read_only = True
+        a.dump(self.dump_path)
+        c = HNSWIndexer.load(self.dump_path)
+        self.assertIsInstance(c._vectors.data, np.memmap)
+        self.assertRaises(PermissionError, c.add, self.keys[:1], self.vectors[:1], [1.])
+        self.assertListEqual(a.query(self.queries, top_k=5), c.query(self.queries, top_k=5))
+
+    def test_bench_numpy(self):
+        a = HNSWIndexer(self.data_path, M=8, ef_construction=64)
+        with TimeContext('HNSWIndexer.add() of %d vectors' % len(self.keys)):
+            a.add(self.keys, self.vectors, [1.] * len(self.keys))
+        with TimeContext('NumpyIndexer.query()'):
+            expected = self._brute_force('l2')
+        for ef in [10, 50, 200]:
+            with TimeContext('HNSWIndexer.query(), ef_search=%d' % ef):
+                res = a.query(self.queries, top_k=10, ef_search=ef)
+            print('ef_search=%d, recall@10: %.3f' % (ef, _recall(res, expected)))
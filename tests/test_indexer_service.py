@@ -1,15 +1,28 @@
 import os
+import time
 import unittest
 
 import numpy as np
 
 from gnes.cli.parser import set_indexer_parser, _set_client_parser
 from gnes.client.base import ZmqClient
+from gnes.indexer.chunk.numpy import NumpyIndexer
 from gnes.proto import gnes_pb2, array2blob
 from gnes.service.base import ServiceManager
 from gnes.service.indexer import IndexerService
 
 
+class _HangingIndexer(NumpyIndexer):
+    def post_init(self):
+        super().post_init()
+        self._owner_pid = os.getpid()
+
+    def dump(self, filename: str = None) -> int:
+        if os.getpid() != self._owner_pid:
+            time.sleep(60)
+        return super().dump(filename)
+
+
 class TestIndexerService(unittest.TestCase):
 
     def setUp(self):
@@ -35,6 +48,116 @@ class TestIndexerService(unittest.TestCase):
             r = client.recv_message()
             self.assertEqual(r.response.index.status, gnes_pb2.Response.SUCCESS)
 
+    def test_async_dump(self):
+        args = set_indexer_parser().parse_args([
+            '--yaml_path', '!NumpyIndexer {gnes_config: {name: IndexerService}}',
+            '--dump_interval', '1',
+            '--async_dump'])
+        c_args = _set_client_parser().parse_args([
+            '--port_in', str(args.port_out),
+            '--port_out', str(args.port_in)])
+
+        with IndexerService(args) as s, ZmqClient(c_args) as client:
+            for j in range(2):
+                msg = gnes_pb2.Message()
+                d = msg.request.index.docs.add()
+                d.doc_id = j
+                c = d.chunks.add()
+                c.doc_id = j
+                c.embedding.CopyFrom(array2blob(self.test_numeric[j]))
+                c.offset = 0
+                c.weight = 1.0
+                client.send_message(msg)
+                r = client.recv_message()
+                self.assertEqual(r.response.index.status, gnes_pb2.Response.SUCCESS)
+
+            # the dump interval is passed, so the next message triggers the dump
+            s.last_dump_time -= args.dump_interval
+            # poll the status until the background dump is collected, a slow dump fails the test
+            deadline = time.perf_counter() + 10
+            r = s.status
+            while (r.response.control.is_dumping or not r.response.control.last_dump_size) \
+                    and time.perf_counter() < deadline:
+                time.sleep(0.1)
+                r = s.status
+            self.assertFalse(r.response.control.is_dumping)
+            self.assertEqual(r.response.control.last_dump_size, os.path.getsize('IndexerService.bin'))
+            self.assertGreater(r.response.control.last_dump_duration, 0)
+            self.assertTrue(os.path.exists('IndexerService.bin'))
+            umask = os.umask(0)
+            os.umask(umask)
+            self.assertEqual(os.stat('IndexerService.bin').st_mode & 0o777, 0o666 & ~umask)
+            self.assertFalse([f for f in os.listdir('.') if f.startswith('IndexerService.bin') and f.endswith('.tmp')])
+
+    def test_async_dump_timeout(self):
+        args = set_indexer_parser().parse_args([
+            '--yaml_path', '!NumpyIndexer {gnes_config: {name: IndexerService}}',
+            '--async_dump',
+            '--dump_timeout', '1'])
+        s = IndexerService(args)
+        s._model = _HangingIndexer(gnes_config={'name': 'IndexerService'})
+        s._model.add([(0, 0)], self.test_numeric[:1], [1.])
+        s.is_model_changed.set()
+        s.last_dump_time -= args.dump_interval
+        s.dump()
+        self.assertIsNotNone(s._dump_pid)
+        # the background dump hangs, it is killed and replaced by a synchronous one
+        s.dump(respect_dump_interval=False)
+        self.assertIsNone(s._dump_pid)
+        self.assertEqual(s.last_dump_size, os.path.getsize('IndexerService.bin'))
+
+    def test_result_cache(self):
+        args = set_indexer_parser().parse_args([
+            '--yaml_path', '!NumpyIndexer {}',
+            '--result_cache_size', '1',
+            '--read_only'])
+        c_args = _set_client_parser().parse_args([
+            '--port_in', str(args.port_out),
+            '--port_out', str(args.port_in)])
+
+        def index(doc_ids):
+            msg = gnes_pb2.Message()
+            for j in doc_ids:
+                d = msg.request.index.docs.add()
+                d.doc_id = j
+                c = d.chunks.add()
+                c.doc_id = j
+                c.embedding.CopyFrom(array2blob(self.test_numeric[j]))
+                c.weight = 1.0
+            client.send_message(msg)
+            return client.recv_message()
+
+        def query(j):
+            msg = gnes_pb2.Message()
+            msg.request.search.top_k = 3
+            c = msg.request.search.query.chunks.add()
+            c.embedding.CopyFrom(array2blob(self.test_numeric[j]))
+            c.weight = 1.0
+            client.send_message(msg)
+            return client.recv_message()
+
+        with IndexerService(args) as s, ZmqClient(c_args) as client:
+            index(range(10))
+            r1 = query(0)
+            r2 = query(0)
+            self.assertEqual(s._result_cache.num_miss, 1)
+            self.assertEqual(s._result_cache.num_hit, 1)
+            self.assertEqual(r1.response.search.topk_results, r2.response.search.topk_results)
+            self.assertEqual(r1.response.search.topk_results[0].chunk.doc_id, 0)
+
+            # a change of the index drops the cached results
+            index([10])
+            self.assertEqual(len(s._result_cache), 0)
+            query(10)
+            r3 = query(10)
+            self.assertEqual(s._result_cache.num_miss, 2)
+            self.assertEqual(r3.response.search.topk_results[0].chunk.doc_id, 10)
+
+            r = s.status
+            self.assertEqual(r.response.control.num_cache_hit, 2)
+            self.assertEqual(r.response.control.num_cache_miss, 2)
+            self.assertGreater(r.response.control.cache_size, 0)
+
     def tearDown(self):
         if os.path.exists('IndexerService.bin'):
             os.remove('IndexerService.bin')
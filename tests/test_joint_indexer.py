@@ -1,3 +1,5 @@
+import glob
+import io
 import os
 import unittest
 
@@ -43,3 +45,109 @@ class TestJointIndexer(unittest.TestCase):
                 d, o, w, s, *_ = topk[0]
                 self.assertEqual(1.0, s)
         mhi.close()
+
+
+class TestJointIndexerQuery(unittest.TestCase):
+    def test_batched_doc_query(self):
+        mhi = JointIndexer.load_yaml(io.StringIO('!JointIndexer\ncomponents:\n  - !NumpyIndexer {}\n  - !DictIndexer {}'))
+        pb_docs = [d for d in txt_file2pb_docs(open(os.path.join(os.path.dirname(__file__), 'tangshi.txt'),
+                                                    encoding='utf8')) if d.chunks]
+        vecs = []
+        for doc in pb_docs:
+            mhi.add([doc.doc_id], [doc], [1.])
+            vecs.append(np.random.random([len(doc.chunks), 4]).astype(np.float32))
+            mhi.add([(doc.doc_id, j) for j in range(len(doc.chunks))], vecs[-1], [1.] * len(doc.chunks))
+
+        doc_query = mhi._doc_indexer.query
+        num_calls = []
+
+        def counted_query(keys, *args, **kwargs):
+            num_calls.append(keys)
+            return doc_query(keys, *args, **kwargs)
+
+        mhi._doc_indexer.query = counted_query
+        results = mhi.query(np.concatenate(vecs[:3]), top_k=5)
+        self.assertEqual(len(num_calls), 1)
+        self.assertEqual(len(num_calls[0]), len(set(num_calls[0])))
+        docs = {d.doc_id: d for d in pb_docs}
+        for topk in results:
+            for doc_id, offset, weight, score, chunk in topk:
+                self.assertEqual(chunk, docs[doc_id].chunks[offset])
+
+    def test_missing_doc(self):
+        mhi = JointIndexer.load_yaml(io.StringIO('!JointIndexer\ncomponents:\n  - !NumpyIndexer {}\n  - !DictIndexer {}'))
+        pb_docs = [d for d in txt_file2pb_docs(open(os.path.join(os.path.dirname(__file__), 'tangshi.txt'),
+                                                    encoding='utf8')) if d.chunks][:3]
+        vecs = []
+        for doc in pb_docs:
+            mhi.add([doc.doc_id], [doc], [1.])
+            vecs.append(np.random.random([len(doc.chunks), 4]).astype(np.float32))
+            mhi.add([(doc.doc_id, j) for j in range(len(doc.chunks))], vecs[-1], [1.] * len(doc.chunks))
+
+        # the first document is absent from the doc indexer, which drops it like "keep_na_doc=False"
+        absent_id = pb_docs[0].doc_id
+        doc_query = mhi._doc_indexer.query
+        mhi._doc_indexer.query = lambda keys, *args, **kwargs: doc_query([k for k in keys if k != absent_id])
+
+        top_k = sum(len(d.chunks) for d in pb_docs)
+        results = mhi.query(np.concatenate(vecs), top_k=top_k)
+        docs = {d.doc_id: d for d in pb_docs}
+        for topk in results:
+            self.assertEqual(len(topk), top_k - len(pb_docs[0].chunks))
+            for doc_id, offset, weight, score, chunk in topk:
+                self.assertNotEqual(doc_id, absent_id)
+                self.assertEqual(chunk, docs[doc_id].chunks[offset])
+
+    def test_incremental_dump(self):
+        work_dir = os.path.dirname(__file__)
+        dump_path = os.path.join(work_dir, 'inc_joint_indexer.bin')
+        yaml_str = ('!JointIndexer\n'
+                    'components:\n'
+                    '  - !NumpyIndexer\n'
+                    '    parameters: {incremental_dump: true, compact_ratio: 100}\n'
+                    '    gnes_config: {name: inc_joint_vec, work_dir: %s}\n'
+                    '  - !DictIndexer\n'
+                    '    parameters: {incremental_dump: true, compact_ratio: 100}\n'
+                    '    gnes_config: {name: inc_joint_doc, work_dir: %s}\n'
+                    'gnes_config: {name: inc_joint_indexer, work_dir: %s}\n' % (work_dir, work_dir, work_dir))
+        pb_docs = [d for d in txt_file2pb_docs(open(os.path.join(work_dir, 'tangshi.txt'),
+                                                    encoding='utf8')) if d.chunks][:6]
+        vecs = [np.random.random([len(d.chunks), 4]).astype(np.float32) for d in pb_docs]
+
+        def add(mhi, docs, doc_vecs):
+            for doc, v in zip(docs, doc_vecs):
+                mhi.add([doc.doc_id], [doc], [1.])
+                mhi.add([(doc.doc_id, j) for j in range(len(doc.chunks))], v, [1.] * len(doc.chunks))
+
+        try:
+            mhi = JointIndexer.load_yaml(io.StringIO(yaml_str))
+            add(mhi, pb_docs[:3], vecs[:3])
+            # no snapshot yet, the first dump is a full one
+            mhi.dump()
+            self.assertTrue(os.path.exists(dump_path))
+            self.assertFalse(glob.glob(os.path.join(work_dir, 'inc_joint_*.bin.*.log')))
+
+            # the second dump only flushes the logs of the components
+            add(mhi, pb_docs[3:], vecs[3:])
+            mhi.dump()
+            self.assertEqual(len(glob.glob(os.path.join(work_dir, 'inc_joint_*.bin.*.log'))), 2)
+            expected = mhi.query(np.concatenate(vecs), top_k=3)
+            mhi.close()
+
+            # the restored components replay their logs
+            mhi = JointIndexer.load_yaml(io.StringIO(yaml_str))
+            self.assertEqual(mhi._binary_indexer.num_chunks, sum(len(d.chunks) for d in pb_docs))
+            self.assertListEqual(mhi.query(np.concatenate(vecs), top_k=3), expected)
+
+            # a new snapshot covers the logs of the components
+            for c in mhi.components:
+                c.compact_ratio = 0
+            mhi.dump()
+            self.assertFalse(glob.glob(os.path.join(work_dir, 'inc_joint_*.bin.*.log')))
+            mhi.close()
+            mhi = JointIndexer.load_yaml(io.StringIO(yaml_str))
+            self.assertListEqual(mhi.query(np.concatenate(vecs), top_k=3), expected)
+            mhi.close()
+        finally:
+            for f in glob.glob(os.path.join(work_dir, 'inc_joint_*')):
+                os.remove(f)
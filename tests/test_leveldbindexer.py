@@ -2,7 +2,10 @@ import os
 import unittest
 from shutil import rmtree
 
+from google.protobuf.json_format import MessageToJson, Parse
+
 from gnes.indexer.doc.dict import DictIndexer
+from gnes.helper import TimeContext
 from gnes.indexer.doc.leveldb import LVDBIndexer
 from gnes.proto import gnes_pb2
 from tests import txt_file2pb_docs
@@ -45,6 +48,74 @@ class TestBaseLVDB(unittest.TestCase):
             self.assertIsInstance(k, gnes_pb2.Document)
         self.assertEqual(len(self.test_docs), db3.num_docs)
 
+    def test_doc_cache(self):
+        db = DictIndexer(doc_cache_size=1)
+        db.add(range(len(self.test_docs)), self.test_docs)
+        res1 = db.query([3, 1, 3])
+        self.assertEqual([d.doc_id for d in res1], [self.test_docs[j].doc_id for j in [3, 1, 3]])
+        res2 = db.query([1, 2])
+        self.assertIs(res2[0], res1[1])
+        self.assertEqual(db.doc_cache_stats['num_hit'], 1)
+        self.assertEqual(db.doc_cache_stats['num_miss'], 4)
+        self.assertEqual(db.doc_cache_stats['num_docs'], 3)
+
+        # an overwritten document is dropped from the cache
+        d = gnes_pb2.Document()
+        d.CopyFrom(self.test_docs[0])
+        d.doc_id = 100
+        db.add([1], [d])
+        self.assertEqual(db.query([1])[0].doc_id, 100)
+
+        # the cache is not dumped
+        db.dump(self.dump_path)
+        db2 = DictIndexer.load(self.dump_path)
+        self.assertEqual(db2.doc_cache_stats['num_docs'], 0)
+        self.assertEqual(db2.query([1])[0].doc_id, 100)
+
+    def test_dict_indexer_options(self):
+        d = gnes_pb2.Document()
+        d.CopyFrom(self.test_docs[0])
+        d.raw_bytes = b'a' * 100
+        d.chunks.add().blob.data = b'b' * 100
+        db = DictIndexer(drop_raw_bytes=True, drop_chunk_blob=True)
+        db.add([0], [d])
+        r = db.query([0])[0]
+        self.assertFalse(r.raw_bytes)
+        self.assertFalse(r.chunks[-1].HasField('blob'))
+        self.assertEqual(r.chunks[0].text, self.test_docs[0].chunks[0].text)
+        self.assertRaises(ValueError, DictIndexer, compress='foo')
+
+    def test_dict_indexer_legacy_dump(self):
+        # a dump of the old versions keeps the documents as JSON
+        db = DictIndexer()
+        db.add(range(len(self.test_docs)), self.test_docs)
+        db._content = {k: MessageToJson(d) for k, d in enumerate(self.test_docs)}
+        db.dump(self.dump_path)
+        db2 = DictIndexer.load(self.dump_path)
+        self.assertEqual(db2.query([3])[0], self.test_docs[3])
+
+    def test_bench_dict_indexer(self):
+        docs = self.test_docs * 20
+        for d in docs:
+            for c in d.chunks:
+                c.blob.data = os.urandom(256)
+        keys = list(range(len(docs)))
+
+        legacy = {}
+        with TimeContext('legacy JSON DictIndexer.add()'):
+            legacy.update({k: MessageToJson(d) for k, d in zip(keys, docs)})
+        with TimeContext('legacy JSON DictIndexer.query()'):
+            res1 = [Parse(legacy[k], gnes_pb2.Document()) for k in keys]
+
+        db = DictIndexer()
+        with TimeContext('binary DictIndexer.add()'):
+            db.add(keys, docs)
+        with TimeContext('binary DictIndexer.query()'):
+            res2 = db.query(keys)
+        self.assertEqual(res1, res2)
+        print('stored bytes, JSON: %d, binary: %d' % (sum(len(v.encode()) for v in legacy.values()),
+                                                     sum(len(v) for v in db._content.values())))
+
     def test_add_docs(self):
         db = LVDBIndexer(self.db_path)
         db.add(range(len(self.test_docs)), self.test_docs)
@@ -65,6 +136,37 @@ class TestBaseLVDB(unittest.TestCase):
         self.assertEqual(num_non_empty, 0)
         db.close()
 
+    def test_batched_query(self):
+        db = LVDBIndexer(self.db_path, doc_cache_size=1)
+        db.add(range(len(self.test_docs)), self.test_docs)
+        # the keys are read in sorted order, the results follow the order of the query
+        keys = [5, 300, 1, 5, len(self.test_docs) + 1, 2]
+        for _ in range(2):
+            res = db.query(keys)
+            self.assertEqual([d.doc_id if d else None for d in res],
+                             [self.test_docs[k].doc_id if k < len(self.test_docs) else None for k in keys])
+        self.assertEqual(db.doc_cache_stats['num_hit'], 4)
+        db.close()
+
+    def test_legacy_keys(self):
+        # a store of the earlier versions, keyed by the pickled doc_id
+        import pickle
+        import plyvel
+        db = plyvel.DB(self.db_path, create_if_missing=True)
+        for k, d in enumerate(self.test_docs):
+            db.put(pickle.dumps(k), d.SerializeToString())
+        db.close()
+
+        db = LVDBIndexer(self.db_path)
+        res = db.query(range(len(self.test_docs)))
+        self.assertEqual([d.doc_id for d in res], [d.doc_id for d in self.test_docs])
+        db.close()
+
+        # the migrated store is opened as is
+        db = LVDBIndexer(self.db_path)
+        self.assertEqual(db.query([3])[0], self.test_docs[3])
+        db.close()
+
     def dump_load(self):
         tmp = LVDBIndexer(self.db_path)
         tmp.add(range(len(self.test_docs)), self.test_docs)
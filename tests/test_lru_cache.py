@@ -0,0 +1,37 @@
+import time
+import unittest
+
+from gnes.helper import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evict_by_size(self):
+        c = LRUCache(max_bytes=10)
+        c.put('a', b'1234')
+        c.put('b', b'1234')
+        self.assertEqual(c.get('a'), b'1234')
+        # 'b' is the least recently used one
+        c.put('c', b'1234')
+        self.assertEqual(c.num_bytes, 8)
+        self.assertIsNone(c.get('b'))
+        self.assertEqual(c.get('c'), b'1234')
+        self.assertEqual((c.num_hit, c.num_miss), (2, 1))
+
+        # a value that never fits is not cached, and evicts nothing
+        c.put('d', b'12345678901')
+        self.assertNotIn('d', c)
+        self.assertEqual(len(c), 2)
+
+        # replacing a value updates the size
+        c.put('a', b'12')
+        self.assertEqual(c.num_bytes, 6)
+        c.clear()
+        self.assertEqual((len(c), c.num_bytes), (0, 0))
+
+    def test_ttl(self):
+        c = LRUCache(max_bytes=10, ttl=0.1)
+        c.put('a', b'1')
+        self.assertEqual(c.get('a'), b'1')
+        time.sleep(0.2)
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(c.num_bytes, 0)
@@ -0,0 +1,91 @@
+import os
+import unittest
+
+import numpy as np
+
+from gnes.indexer.chunk.memmap import MmapIndexer
+from gnes.indexer.chunk.numpy import NumpyIndexer
+
+
+class TestMmapIndexer(unittest.TestCase):
+    def setUp(self):
+        self.vectors = np.random.random([500, 8]).astype(np.float32)
+        self.queries = np.random.random([10, 8]).astype(np.float32)
+        self.keys = [(j // 5, j % 5) for j in range(len(self.vectors))]
+        self.weights = np.random.random(len(self.keys)).tolist()
+        dirname = os.path.dirname(__file__)
+        self.data_path = os.path.join(dirname, 'mmap_indexer')
+        self.dump_path = os.path.join(dirname, 'mmap_indexer.bin')
+
+    def tearDown(self):
+        for f in [self.data_path + '.vec.npy', self.data_path + '.key.npy', self.dump_path]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_add_query(self):
+        a = MmapIndexer(self.data_path)
+        self.assertEqual(a.num_chunks, 0)
+        self.assertListEqual(a.query(self.queries, top_k=3), [[]] * len(self.queries))
+        a.add([], np.empty([0, 8], dtype=np.float32), [])
+        self.assertEqual(a.num_chunks, 0)
+        for j in range(0, len(self.keys), 100):
+            a.add(self.keys[j:(j + 100)], self.vectors[j:(j + 100)], self.weights[j:(j + 100)])
+        self.assertEqual(a.num_chunks, 500)
+        self.assertEqual(a.num_docs, 100)
+        self.assertEqual(a.num_chunks_in_doc(3), 5)
+
+        b = NumpyIndexer()
+        b.add(self.keys, self.vectors, self.weights)
+        res1 = a.query(self.queries, top_k=5)
+        res2 = b.query(self.queries, top_k=5)
+        for r1, r2 in zip(res1, res2):
+            self.assertEqual([r[:2] for r in r1], [r[:2] for r in r2])
+            np.testing.assert_allclose([r[2:] for r in r1], [r[2:] for r in r2], rtol=1e-6)
+
+        # the files are plain .npy
+        np.testing.assert_array_equal(np.load(a.vec_path), self.vectors)
+        self.assertEqual(np.load(a.key_path)['doc_id'].tolist(), [k[0] for k in self.keys])
+
+    def test_reopen(self):
+        a = MmapIndexer(self.data_path)
+        a.add(self.keys[:100], self.vectors[:100], self.weights[:100])
+        a.dump(self.dump_path)
+        self.assertLess(os.path.getsize(self.dump_path), 4096)
+
+        reader = MmapIndexer(self.data_path, read_only=True)
+        self.assertEqual(reader.num_chunks, 100)
+        self.assertRaises(PermissionError, reader.add, self.keys[:1], self.vectors[:1], self.weights[:1])
+
+        b = MmapIndexer.load(self.dump_path)
+        b.add(self.keys[100:], self.vectors[100:], self.weights[100:])
+        self.assertEqual(b.num_chunks, 500)
+        self.assertEqual(reader.num_chunks, 500)
+        self.assertListEqual(reader.query(self.queries, top_k=3), b.query(self.queries, top_k=3))
+
+    def test_incremental_add(self):
+        a = MmapIndexer(self.data_path)
+        # the chunks of doc 20 are split over two adds
+        a.add(self.keys[:103], self.vectors[:103], self.weights[:103])
+        self.assertEqual(a.num_docs, 21)
+        self.assertEqual(a.num_chunks_in_doc(20), 3)
+        a.query(self.queries, top_k=3)
+        mapped = a._keys
+        a.query(self.queries, top_k=3)
+        # not remapped as long as nothing is added
+        self.assertIs(a._keys, mapped)
+
+        a.add(self.keys[103:], self.vectors[103:], self.weights[103:])
+        self.assertEqual(a.num_chunks, 500)
+        self.assertEqual(a.num_docs, 100)
+        self.assertEqual(a.num_chunks_in_doc(20), 5)
+        self.assertEqual(a.num_chunks_in_doc(99), 5)
+
+    def test_interrupted_add(self):
+        a = MmapIndexer(self.data_path)
+        a.add(self.keys[:100], self.vectors[:100], self.weights[:100])
+        # simulate an add() that wrote the vectors but not the keys
+        from gnes.indexer.chunk.memmap import _append_rows
+        _append_rows(a.vec_path, self.vectors[300:350])
+        a.add(self.keys[100:200], self.vectors[100:200], self.weights[100:200])
+        self.assertEqual(a.num_chunks, 200)
+        np.testing.assert_array_equal(np.load(a.vec_path), self.vectors[:200])
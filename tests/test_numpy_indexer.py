@@ -0,0 +1,223 @@
+import glob
+import os
+import unittest.mock
+
+import numpy as np
+
+from gnes.helper import TimeContext
+from gnes.indexer.chunk.numpy import NumpyIndexer, pairwise_distance, blocked_topk
+
+
+def _legacy_query(vectors, keys, top_k):
+    # the original implementation of NumpyIndexer.query, kept for the benchmark
+    dist = np.abs(np.expand_dims(keys, axis=1) - np.expand_dims(vectors, axis=0))
+    score = np.sum(dist, -1) / vectors.shape[1]
+    return [sorted(enumerate(ids), key=lambda x: x[1])[:top_k] for ids in score]
+
+
+class TestNumpyIndexer(unittest.TestCase):
+    def setUp(self):
+        self.num_dim = 16
+        self.vectors = np.random.random([1000, self.num_dim]).astype(np.float32)
+        self.queries = np.random.random([20, self.num_dim]).astype(np.float32)
+        self.keys = [(j, j % 7) for j in range(len(self.vectors))]
+        dirname = os.path.dirname(__file__)
+        self.dump_path = os.path.join(dirname, 'numpy_indexer.bin')
+        self.inc_dump_path = os.path.join(dirname, 'inc_numpy_indexer.bin')
+
+    def tearDown(self):
+        for f in [self.dump_path] + glob.glob(self.inc_dump_path + '*'):
+            if os.path.exists(f):
+                os.remove(f)
+
+    def _brute_force(self, metric):
+        q, v = self.queries.astype(np.float64), self.vectors.astype(np.float64)
+        diff = np.expand_dims(q, 1) - np.expand_dims(v, 0)
+        if metric == 'l1':
+            return np.abs(diff).sum(-1) / self.num_dim
+        if metric == 'l2':
+            return (diff ** 2).sum(-1)
+        if metric == 'inner_product':
+            return -q.dot(v.T)
+        if metric == 'cosine':
+            return 1 - q.dot(v.T) / np.outer(np.linalg.norm(q, axis=1), np.linalg.norm(v, axis=1))
+
+    def test_pairwise_distance(self):
+        for metric in ['l1', 'l2', 'inner_product', 'cosine']:
+            np.testing.assert_allclose(pairwise_distance(self.queries, self.vectors, metric),
+                                       self._brute_force(metric), rtol=1e-4, atol=1e-4)
+
+        a = np.random.randint(0, 3, [5, 8]).astype(np.uint8)
+        b = np.random.randint(0, 3, [9, 8]).astype(np.uint8)
+        expected = (np.expand_dims(a, 1) != np.expand_dims(b, 0)).sum(-1) / 8
+        np.testing.assert_allclose(pairwise_distance(a, b, 'hamming'), expected)
+
+        self.assertRaises(ValueError, pairwise_distance, a, b, 'foo')
+
+        # the tiles are bounded by splitting both the queries and the vectors
+        with unittest.mock.patch('gnes.indexer.chunk.numpy._MAX_TILE_ELEMENTS', self.num_dim * 3):
+            np.testing.assert_allclose(pairwise_distance(self.queries, self.vectors, 'l1'),
+                                       self._brute_force('l1'), rtol=1e-4, atol=1e-4)
+        with unittest.mock.patch('gnes.indexer.chunk.numpy._MAX_TILE_ELEMENTS', 4):
+            np.testing.assert_allclose(pairwise_distance(a, b, 'hamming'), expected)
+
+    def test_blocked_topk(self):
+        for metric in ['l1', 'l2', 'inner_product', 'cosine']:
+            expected = np.argsort(self._brute_force(metric), axis=1, kind='stable')[:, :10]
+            for block_size in [7, 100, 5000]:
+                ids, dist = blocked_topk(self.queries, self.vectors, 10, metric, block_size)
+                self.assertEqual(ids.shape, (len(self.queries), 10))
+                np.testing.assert_array_equal(ids, expected)
+                self.assertTrue(np.all(np.diff(dist, axis=1) >= 0))
+
+        ids, dist = blocked_topk(self.queries, self.vectors[:3], 10)
+        self.assertEqual(ids.shape, (len(self.queries), 3))
+
+    def test_query(self):
+        for metric in ['l1', 'l2', 'cosine']:
+            a = NumpyIndexer(metric=metric, block_size=128)
+            a.add(self.keys, self.vectors, [1.] * len(self.keys))
+            ret = a.query(self.vectors[:10], top_k=3)
+            self.assertEqual(len(ret), 10)
+            self.assertEqual([r[0][0] for r in ret], list(range(10)))
+            self.assertEqual([r[0][1] for r in ret], [j % 7 for j in range(10)])
+
+        a = NumpyIndexer(is_binary=True)
+        self.assertEqual(a.metric, 'hamming')
+        self.assertListEqual(a.query(self.queries, top_k=3), [[]] * len(self.queries))
+        self.assertRaises(ValueError, NumpyIndexer, metric='foo')
+
+    def test_add_batches(self):
+        a = NumpyIndexer()
+        for j in range(0, len(self.keys), 10):
+            a.add(self.keys[j:(j + 10)], self.vectors[j:(j + 10)], [1.] * 10)
+        self.assertEqual(a.num_chunks, len(self.keys))
+        self.assertEqual(a._vectors.size, len(self.vectors))
+        self.assertEqual(a._vectors.capacity, 1024)
+        np.testing.assert_array_equal(a._vectors.data, self.vectors)
+
+    def test_dump_load(self):
+        a = NumpyIndexer(metric='l2')
+        a.add(self.keys, self.vectors, [1.] * len(self.keys))
+        a.dump(self.dump_path)
+        b = NumpyIndexer.load(self.dump_path)
+        self.assertListEqual(a.query(self.queries, top_k=5), b.query(self.queries, top_k=5))
+
+    def test_legacy_state(self):
+        import pickle
+        a = NumpyIndexer(is_binary=True)
+        # the state dumped by the earlier versions: the vectors in a plain ndarray and no metric
+        a._vectors = (self.vectors > 0.5).astype(np.uint8)
+        a._num_dim = self.vectors.shape[1]
+        a.helper_indexer.add(self.keys, [1.] * len(self.keys))
+        del a.metric, a.block_size
+        b = pickle.loads(pickle.dumps(a))
+        self.assertEqual(b.metric, 'hamming')
+        self.assertEqual(b._vectors.size, len(self.vectors))
+        queries = (self.queries > 0.5).astype(np.uint8)
+        c = NumpyIndexer(is_binary=True)
+        c.add(self.keys, a._vectors, [1.] * len(self.keys))
+        self.assertListEqual([[r[2] for r in topk] for topk in b.query(queries, top_k=5)],
+                             [[r[2] for r in topk] for topk in c.query(queries, top_k=5)])
+
+        b.add(self.keys[:10], a._vectors[:10], [1.] * 10)
+        self.assertEqual(b._vectors.size, len(self.vectors) + 10)
+
+    def test_incremental_dump(self):
+        gnes_config = {'name': 'inc_numpy_indexer', 'work_dir': os.path.dirname(self.inc_dump_path)}
+        a = NumpyIndexer(incremental_dump=True, compact_ratio=3, gnes_config=gnes_config)
+        self.assertEqual(a.dump_full_path, self.inc_dump_path)
+        a.add(self.keys[:100], self.vectors[:100], [1.] * 100)
+        # no snapshot yet, the first dump is a full one
+        a.dump()
+        self.assertTrue(os.path.exists(self.inc_dump_path))
+        self.assertFalse(glob.glob(self.inc_dump_path + '.*.log'))
+        snapshot_time = os.path.getmtime(self.inc_dump_path)
+
+        for j in range(100, 300, 50):
+            a.add(self.keys[j:(j + 50)], self.vectors[j:(j + 50)], [1.] * 50)
+        # the log is still smaller than the snapshot, only the log is written
+        a.dump()
+        self.assertEqual(os.path.getmtime(self.inc_dump_path), snapshot_time)
+        self.assertEqual(len(glob.glob(self.inc_dump_path + '.*.log')), 1)
+
+        b = NumpyIndexer.load(self.inc_dump_path)
+        self.assertEqual(b.num_chunks, 300)
+        self.assertListEqual(a.query(self.queries, top_k=5), b.query(self.queries, top_k=5))
+
+        # the log grows beyond the snapshot, it is compacted into a new snapshot
+        a.add(self.keys[300:], self.vectors[300:], [1.] * 700)
+        a.dump()
+        self.assertFalse(glob.glob(self.inc_dump_path + '.*.log'))
+        b = NumpyIndexer.load(self.inc_dump_path)
+        self.assertEqual(b.num_chunks, len(self.keys))
+        self.assertListEqual(a.query(self.queries, top_k=5), b.query(self.queries, top_k=5))
+
+        # adding to a loaded indexer continues the log
+        b.add([(2000, 0)], self.queries[:1], [1.])
+        b.dump()
+        c = NumpyIndexer.load(self.inc_dump_path)
+        self.assertEqual(c.num_chunks, len(self.keys) + 1)
+        self.assertEqual(c.query(self.queries[:1], top_k=1)[0][0][0], 2000)
+        c.close()
+
+    def test_bench_legacy(self):
+        # the legacy query materializes a [num_queries, num_vectors, dim] array, keep it small
+        vectors = np.random.random([5000, 32]).astype(np.float32)
+        queries = np.random.random([20, 32]).astype(np.float32)
+        a = NumpyIndexer()
+        a.add([(j, 0) for j in range(len(vectors))], vectors, [1.] * len(vectors))
+
+        with TimeContext('legacy NumpyIndexer.query()'):
+            res1 = _legacy_query(vectors, queries, 10)
+        with TimeContext('blocked NumpyIndexer.query()'):
+            res2 = a.query(queries, top_k=10)
+        self.assertEqual([[j[0] for j in r] for r in res1], [[j[0] for j in r] for r in res2])
+
+    def test_ivf(self):
+        self.assertRaises(ValueError, NumpyIndexer, is_binary=True, num_lists=4)
+        for metric in ['l1', 'l2', 'cosine']:
+            a = NumpyIndexer(metric=metric, num_lists=8, nprobe=2, block_size=64)
+            self.assertRaises(RuntimeError, a.add, self.keys, self.vectors, [1.] * len(self.keys))
+            a.train(self.vectors)
+            self.assertListEqual(a.query(self.queries, top_k=3), [[]] * len(self.queries))
+            # adds are routed to the lists incrementally
+            for j in range(0, len(self.keys), 100):
+                a.add(self.keys[j:(j + 100)], self.vectors[j:(j + 100)], [1.] * 100)
+            self.assertEqual(a.num_chunks, len(self.keys))
+            self.assertEqual(a._lists.list_sizes().sum(), len(self.keys))
+
+            ret = a.query(self.vectors[:10], top_k=3)
+            self.assertEqual([r[0][0] for r in ret], list(range(10)))
+
+            # probing all lists is exhaustive
+            b = NumpyIndexer(metric=metric)
+            b.add(self.keys, self.vectors, [1.] * len(self.keys))
+            res1 = a.query(self.queries, top_k=5, nprobe=8)
+            res2 = b.query(self.queries, top_k=5)
+            self.assertEqual([[h[0] for h in r] for r in res1], [[h[0] for h in r] for r in res2])
+
+        a.dump(self.dump_path)
+        b = NumpyIndexer.load(self.dump_path)
+        self.assertListEqual(a.query(self.queries, top_k=5), b.query(self.queries, top_k=5))
+
+    def test_bench_ivf(self):
+        vectors = np.random.random([50000, 32]).astype(np.float32)
+        queries = np.random.random([100, 32]).astype(np.float32)
+        keys = [(j, 0) for j in range(len(vectors))]
+        a = NumpyIndexer(metric='l2')
+        a.add(keys, vectors, [1.] * len(vectors))
+        b = NumpyIndexer(metric='l2', num_lists=64)
+        b.train(vectors[:5000])
+        b.add(keys, vectors, [1.] * len(vectors))
+
+        with TimeContext('exhaustive NumpyIndexer.query()'):
+            expected = [set(h[0] for h in r) for r in a.query(queries, top_k=10)]
+        recalls = []
+        for nprobe in [1, 4, 16, 64]:
+            with TimeContext('IVF NumpyIndexer.query(), nprobe=%d' % nprobe):
+                res = b.query(queries, top_k=10, nprobe=nprobe)
+            recalls.append(np.mean([len(set(h[0] for h in r) & e) / 10 for r, e in zip(res, expected)]))
+        # probing more lists never loses a hit, and probing all of them is exhaustive
+        self.assertEqual(recalls, sorted(recalls))
+        self.assertEqual(recalls[-1], 1.0)
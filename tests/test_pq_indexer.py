@@ -0,0 +1,125 @@
+import os
+import unittest
+
+import numpy as np
+
+from gnes.helper import kmeans
+from gnes.encoder.numeric.pq import PQEncoder
+from gnes.helper import TimeContext
+from gnes.indexer.chunk.numpy import NumpyIndexer
+from gnes.indexer.chunk.pq import PQIndexer, adc_distance
+
+
+def _get_pq(vecs, num_bytes, num_clusters):
+    pq = PQEncoder(num_bytes, num_clusters)
+    x = np.reshape(vecs, [vecs.shape[0], num_bytes, -1])
+    pq.centroids = np.expand_dims(np.stack([kmeans(x[:, j], num_clusters, seed=j) for j in range(num_bytes)]), 0)
+    pq.is_trained = True
+    return pq
+
+
+def _recall(results, expected):
+    return np.mean([len(set(r[0] for r in res) & set(e)) / len(e) for res, e in zip(results, expected)])
+
+
+class TestPQIndexer(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.num_bytes = 8
+        self.vectors = np.random.random([2000, 32]).astype(np.float32)
+        self.queries = self.vectors[:20] + np.random.random([20, 32]).astype(np.float32) * 0.1
+        self.keys = [(j, 0) for j in range(len(self.vectors))]
+        self.pq = _get_pq(self.vectors, self.num_bytes, 64)
+        dist = ((np.expand_dims(self.queries, 1) - np.expand_dims(self.vectors, 0)) ** 2).sum(-1)
+        self.expected = np.argsort(dist, axis=1)[:, :10].tolist()
+        self.dump_path = os.path.join(os.path.dirname(__file__), 'pq_indexer.bin')
+
+    def tearDown(self):
+        if os.path.exists(self.dump_path):
+            os.remove(self.dump_path)
+
+    def test_adc_distance(self):
+        a = PQIndexer()
+        a.set_codebook(self.pq)
+        codes = self.pq.encode(self.vectors[:100])
+        recon = a._decode(codes.astype(np.int64) - 1)
+        expected = ((np.expand_dims(self.queries, 1) - np.expand_dims(recon, 0)) ** 2).sum(-1)
+        from gnes.helper import adc_table
+        tables = adc_table(self.queries, a.codebook)
+        np.testing.assert_allclose(adc_distance(tables, codes - 1), expected, rtol=1e-4, atol=1e-3)
+
+    def test_query(self):
+        a = PQIndexer()
+        self.assertRaises(RuntimeError, a.add, self.keys, self.vectors, [1.] * len(self.keys))
+        a.set_codebook(self.pq)
+        self.assertListEqual(a.query(self.queries, top_k=3), [[]] * len(self.queries))
+
+        # indexing the codes of PQEncoder equals to indexing the float vectors
+        codes = self.pq.encode(self.vectors)
+        a.add(self.keys, codes, [1.] * len(self.keys))
+        b = PQIndexer()
+        b.set_codebook(self.pq.centroids)
+        b.add(self.keys, self.vectors, [1.] * len(self.keys))
+        np.testing.assert_array_equal(a._codes.data, b._codes.data)
+
+        res = a.query(self.queries, top_k=10)
+        self.assertEqual(len(res), len(self.queries))
+        self.assertTrue(all(len(r) == 10 for r in res))
+        self.assertTrue(all(np.all(np.diff([h[-1] for h in r]) >= 0) for r in res))
+
+        # ADC keeps much more of the quality than comparing the codes byte by byte
+        c = NumpyIndexer(is_binary=True)
+        c.add(self.keys, codes, [1.] * len(self.keys))
+        adc_recall = _recall(res, self.expected)
+        hamming_recall = _recall(c.query(self.pq.encode(self.queries), top_k=10), self.expected)
+        self.assertGreater(adc_recall, 2 * hamming_recall)
+
+        # queries given as codes are reconstructed
+        self.assertEqual(len(a.query(self.pq.encode(self.queries), top_k=10)), len(self.queries))
+
+    def test_ivf(self):
+        a = PQIndexer(num_lists=16, nprobe=4, block_size=100)
+        a.set_codebook(self.pq)
+        self.assertRaises(RuntimeError, a.add, self.keys, self.vectors, [1.] * len(self.keys))
+        a.train(self.vectors)
+        for j in range(0, len(self.keys), 500):
+            a.add(self.keys[j:(j + 500)], self.vectors[j:(j + 500)], [1.] * 500)
+        self.assertEqual(a._codes.size, len(self.keys))
+        self.assertEqual(a.num_chunks, len(self.keys))
+
+        b = PQIndexer()
+        b.set_codebook(self.pq)
+        b.add(self.keys, self.vectors, [1.] * len(self.keys))
+        # probing all lists is exhaustive
+        res_all = a.query(self.queries, top_k=10, nprobe=16)
+        res_b = b.query(self.queries, top_k=10)
+        for r1, r2 in zip(res_all, res_b):
+            np.testing.assert_allclose([r[-1] for r in r1], [r[-1] for r in r2], rtol=1e-5)
+        self.assertGreater(_recall(a.query(self.queries, top_k=10), self.expected), 0.5 * _recall(res_b, self.expected))
+
+    def test_dump_load(self):
+        pq_path = os.path.join(os.path.dirname(__file__), 'pq_encoder.bin')
+        self.pq.dump(pq_path)
+        try:
+            a = PQIndexer(encoder_path=pq_path, num_lists=8, nprobe=2)
+            a.train(self.vectors)
+            a.add(self.keys, self.vectors, [1.] * len(self.keys))
+            a.dump(self.dump_path)
+        finally:
+            os.remove(pq_path)
+        b = PQIndexer.load(self.dump_path)
+        self.assertListEqual(a.query(self.queries, top_k=5), b.query(self.queries, top_k=5))
+
+    def test_bench_hamming(self):
+        codes = self.pq.encode(self.vectors)
+        a = PQIndexer()
+        a.set_codebook(self.pq)
+        a.add(self.keys, codes, [1.] * len(self.keys))
+        c = NumpyIndexer(is_binary=True)
+        c.add(self.keys, codes, [1.] * len(self.keys))
+        with TimeContext('hamming on PQ codes'):
+            res1 = c.query(self.pq.encode(self.queries), top_k=10)
+        with TimeContext('ADC on PQ codes'):
+            res2 = a.query(self.queries, top_k=10)
+        # the asymmetric distance keeps the query unquantized, so it ranks the codes much better
+        self.assertGreater(_recall(res2, self.expected), _recall(res1, self.expected))
@@ -3,7 +3,8 @@ import unittest
 import numpy as np
 from numpy.testing import assert_array_equal
 
-from gnes.proto import gnes_pb2, array2blob, blob2array
+from gnes.proto import gnes_pb2, array2blob, blob2array, blobs2array, pack_chunk_embeddings, \
+    unpack_chunk_embeddings
 
 
 class TestProto(unittest.TestCase):
@@ -13,6 +14,42 @@ class TestProto(unittest.TestCase):
         blob = array2blob(x)
         x1 = blob2array(blob)
         assert_array_equal(x, x1)
+        x1[0, 0] = 1
+
+        x2 = blob2array(blob, copy=False)
+        assert_array_equal(x, x2)
+        self.assertFalse(x2.flags.writeable)
+
+    def test_blobs2array(self):
+        d = gnes_pb2.Document()
+        x = np.random.random([10, 4]).astype(np.float32)
+        for v in x:
+            d.chunks.add().embedding.CopyFrom(array2blob(v))
+        x1 = blobs2array(c.embedding for c in d.chunks)
+        self.assertEqual(x1.dtype, np.float32)
+        assert_array_equal(x, x1)
+
+        d.chunks.add().embedding.CopyFrom(array2blob(np.zeros([3])))
+        self.assertRaises(ValueError, blobs2array, [c.embedding for c in d.chunks])
+        self.assertRaises(ValueError, blobs2array, [])
+
+    def test_pack_chunk_embeddings(self):
+        d = gnes_pb2.Document()
+        x = np.random.random([6, 4]).astype(np.float32)
+        for v in x:
+            d.chunks.add().embedding.CopyFrom(array2blob(v))
+        x1, idx = unpack_chunk_embeddings(d)
+        assert_array_equal(x, x1)
+        self.assertListEqual(idx, list(range(6)))
+
+        pack_chunk_embeddings(d, x[::2], [0, 2, 4])
+        self.assertFalse(any(c.embedding.data for c in d.chunks))
+        x2, idx = unpack_chunk_embeddings(d)
+        assert_array_equal(x[::2], x2)
+        self.assertListEqual(idx, [0, 2, 4])
+        self.assertRaises(ValueError, pack_chunk_embeddings, d, x[:4])
+
+        self.assertEqual(unpack_chunk_embeddings(gnes_pb2.Document()), (None, []))
 
     def test_new_msg(self):
         a = gnes_pb2.Message()
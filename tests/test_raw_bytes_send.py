@@ -7,7 +7,7 @@ import numpy as np
 from gnes.cli.parser import _set_client_parser
 from gnes.client.base import ZmqClient
 from gnes.helper import TimeContext
-from gnes.proto import gnes_pb2, array2blob, blob2array
+from gnes.proto import gnes_pb2, array2blob, blob2array, pack_chunk_embeddings, unpack_chunk_embeddings
 from gnes.service.base import SocketType
 
 
@@ -52,6 +52,26 @@ class TestSqueezedSendRecv(unittest.TestCase):
                 print('.', end='')
             print('checked %d docs' % len(msg.request.index.docs))
 
+    def test_send_recv_packed_embeddings(self):
+        with ZmqClient(self.c1_args) as c1, ZmqClient(self.c2_args) as c2:
+            msg = gnes_pb2.Message()
+            msg.envelope.client_id = c1.args.identity
+            embeds = []
+            for j in range(random.randint(10, 20)):
+                d = msg.request.index.docs.add()
+                d.raw_bytes = b'a' * random.randint(100, 1000)
+                for _ in range(random.randint(1, 5)):
+                    d.chunks.add().blob.CopyFrom(array2blob(np.random.random([3, 4])))
+                embeds.append(np.random.random([len(d.chunks), 8]).astype(np.float32))
+                pack_chunk_embeddings(d, embeds[-1])
+            raw_bytes = copy.deepcopy([d.raw_bytes for d in msg.request.index.docs])
+            c1.send_message(msg, squeeze_pb=True)
+            r_msg = c2.recv_message()
+            for o_d, o_e, r_d in zip(raw_bytes, embeds, r_msg.request.index.docs):
+                self.assertEqual(o_d, r_d.raw_bytes)
+                np.testing.assert_array_equal(o_e, unpack_chunk_embeddings(r_d)[0])
+                self.assertEqual(blob2array(r_d.chunks[0].blob).shape, (3, 4))
+
     def test_send_recv_response(self):
         with ZmqClient(self.c1_args) as c1, ZmqClient(self.c2_args) as c2:
             msg = gnes_pb2.Message()
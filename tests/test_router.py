@@ -1,12 +1,14 @@
 import json
 import os
+import time
 import unittest
 
 import numpy as np
 
 from gnes.cli.parser import set_router_parser, _set_client_parser
 from gnes.client.base import ZmqClient
-from gnes.proto import gnes_pb2, array2blob
+from gnes.proto import gnes_pb2, array2blob, blob2array, pack_chunk_embeddings, unpack_chunk_embeddings
+from gnes.score_fn.base import explain_score
 from gnes.service.base import SocketType
 from gnes.service.router import RouterService
 
@@ -25,6 +27,10 @@ class TestProto(unittest.TestCase):
         self.concat_router_yaml = 'ConcatEmbedRouter'
         self.avg_router_yaml = 'AvgEmbedRouter'
 
+    @staticmethod
+    def _operands(score):
+        return [o['explained'] for o in explain_score(score)['operands']]
+
     def test_service_empty(self):
         args = set_router_parser().parse_args(['--yaml_path', 'BaseRouter'])
         with RouterService(args):
@@ -118,6 +124,8 @@ class TestProto(unittest.TestCase):
             s.chunk.doc_id = 1
 
             msg.envelope.num_part.extend([1, 2])
+            msg.response.search.explain = True
+            msg.response.search.is_big_score_similar = True
             c1.send_message(msg)
 
             msg.response.search.ClearField('topk_results')
@@ -143,16 +151,57 @@ class TestProto(unittest.TestCase):
             self.assertGreaterEqual(r.response.search.topk_results[0].score.value,
                                     r.response.search.topk_results[-1].score.value)
             print(r.response.search.topk_results)
-            self.assertEqual(json.loads(r.response.search.topk_results[0].score.explained)['operands'],
-                             ['1-c1', '1-c3', '2-c1'])
-            self.assertEqual(json.loads(r.response.search.topk_results[1].score.explained)['operands'],
-                             ['1-c2', '2-c2'])
-            self.assertEqual(json.loads(r.response.search.topk_results[2].score.explained)['operands'], ['2-c3'])
+            self.assertEqual(self._operands(r.response.search.topk_results[0].score), ['1-c1', '1-c3', '2-c1'])
+            self.assertEqual(self._operands(r.response.search.topk_results[1].score), ['1-c2', '2-c2'])
+            self.assertEqual(self._operands(r.response.search.topk_results[2].score), ['2-c3'])
+            self.assertEqual([x.score.num_operands for x in r.response.search.topk_results], [3, 2, 1])
+            self.assertTrue(r.response.search.is_sorted)
 
             self.assertAlmostEqual(r.response.search.topk_results[0].score.value, 0.6)
             self.assertAlmostEqual(r.response.search.topk_results[1].score.value, 0.4)
             self.assertAlmostEqual(r.response.search.topk_results[2].score.value, 0.3)
 
+    def test_chunk_reduce_router_topk(self):
+        args = set_router_parser().parse_args([
+            '--yaml_path', '!Chunk2DocTopkReducer {parameters: {reduce_op: max}}',
+            '--socket_out', str(SocketType.PUB_BIND)
+        ])
+        c_args = _set_client_parser().parse_args([
+            '--port_in', str(args.port_out),
+            '--port_out', str(args.port_in),
+            '--socket_in', str(SocketType.SUB_CONNECT)
+        ])
+        scores = np.random.random([2, 50])
+        with RouterService(args), ZmqClient(c_args) as c1:
+            msg = gnes_pb2.Message()
+            msg.envelope.num_part.extend([1, 2])
+            msg.response.search.top_k = 5
+            for j in range(2):
+                msg.response.search.ClearField('topk_results')
+                for k, v in enumerate(scores[j]):
+                    s = msg.response.search.topk_results.add()
+                    s.score.value = v
+                    s.chunk.doc_id = k % 20
+                c1.send_message(msg)
+            r = c1.recv_message()
+
+        # the max score of every doc, distance-like by default, the smaller the better
+        best = np.full(20, -np.inf)
+        for k, v in enumerate(scores.astype(np.float32).T):
+            best[k % 20] = max(best[k % 20], v.max())
+        expected = np.argsort(best)[:5]
+        self.assertTrue(r.response.search.is_sorted)
+        self.assertEqual([x.doc.doc_id for x in r.response.search.topk_results], expected.tolist())
+        np.testing.assert_allclose([x.score.value for x in r.response.search.topk_results], best[expected])
+
+    def test_topk_order(self):
+        from gnes.router.base import topk_order
+        values = np.array([0.3, 0.1, 0.5, 0.1, 0.2, 0.5])
+        self.assertEqual(topk_order(values, 3).tolist(), [1, 3, 4])
+        self.assertEqual(topk_order(values, 2, descending=True).tolist(), [2, 5])
+        self.assertEqual(topk_order(values, 10).tolist(), [1, 3, 4, 0, 2, 5])
+        self.assertEqual(topk_order(values[:0], 3).tolist(), [])
+
     def test_doc_reduce_router(self):
         args = set_router_parser().parse_args([
             '--yaml_path', self.doc_router_yaml,
@@ -392,7 +441,7 @@ class TestProto(unittest.TestCase):
             msg = gnes_pb2.Message()
             for i in range(10):
                 c = msg.request.search.query.chunks.add()
-                c.embedding.CopyFrom(array2blob(np.random.random([5, 2])))
+                c.embedding.CopyFrom(array2blob(np.random.random([5, 2]).astype(np.float32)))
             msg.envelope.num_part.extend([1, 3])
             c1.send_message(msg)
             c1.send_message(msg)
@@ -402,6 +451,7 @@ class TestProto(unittest.TestCase):
             print(r.envelope.routes)
             for i in range(10):
                 self.assertEqual(r.request.search.query.chunks[i].embedding.shape, [5, 2])
+                self.assertEqual(blob2array(r.request.search.query.chunks[i].embedding).dtype, np.float32)
 
             for j in range(1, 4):
                 d = msg.request.index.docs.add()
@@ -418,6 +468,93 @@ class TestProto(unittest.TestCase):
                 for i in range(10):
                     self.assertEqual(r.request.index.docs[j - 1].chunks[i].embedding.shape, [5, 2])
                     
+    def test_incremental_reduce(self):
+        from gnes.router.reduce import DocFillReducer, AvgEmbedRouter
+        self.assertFalse(DocFillReducer().is_incremental)
+        self.assertTrue(AvgEmbedRouter().is_incremental)
+
+        args = set_router_parser().parse_args([
+            '--yaml_path', self.avg_router_yaml,
+            '--socket_out', str(SocketType.PUSH_BIND)
+        ])
+        c_args = _set_client_parser().parse_args([
+            '--port_in', str(args.port_out),
+            '--port_out', str(args.port_in),
+            '--socket_in', str(SocketType.PULL_CONNECT)
+        ])
+        embeds = [np.random.random([4, 3]).astype(np.float32) for _ in range(3)]
+        with RouterService(args) as s, ZmqClient(c_args) as c1:
+            msg = gnes_pb2.Message()
+            msg.envelope.num_part.extend([1, 3])
+            for _ in range(4):
+                msg.request.search.query.chunks.add()
+            for j in range(2):
+                pack_chunk_embeddings(msg.request.search.query, embeds[j])
+                c1.send_message(msg)
+            for _ in range(50):
+                if s._pending_state.get(msg.envelope.request_id, (0,))[0] == 2:
+                    break
+                time.sleep(0.1)
+            # the parts are folded into the state, only the last part is kept
+            self.assertEqual(s._pending_state[msg.envelope.request_id][0], 2)
+            self.assertFalse(s._pending)
+
+            pack_chunk_embeddings(msg.request.search.query, embeds[2])
+            c1.send_message(msg)
+            r = c1.recv_message()
+            self.assertSequenceEqual(r.envelope.num_part, [1])
+            reduced = unpack_chunk_embeddings(r.request.search.query)[0]
+            np.testing.assert_allclose(reduced, np.mean(embeds, axis=0), rtol=1e-6)
+            # the same dtype as np.mean gives, though summed in float64
+            self.assertEqual(reduced.dtype, np.float32)
+            self.assertFalse(s._pending_state)
+
+    def test_reduce_timeout(self):
+        args = set_router_parser().parse_args([
+            '--yaml_path', self.avg_router_yaml,
+            '--socket_out', str(SocketType.PUSH_BIND),
+            '--reduce_timeout', '200'
+        ])
+        c_args = _set_client_parser().parse_args([
+            '--port_in', str(args.port_out),
+            '--port_out', str(args.port_in),
+            '--socket_in', str(SocketType.PULL_CONNECT)
+        ])
+        embeds = [np.random.random([4, 3]) for _ in range(3)]
+        with RouterService(args) as s, ZmqClient(c_args) as c1:
+            msg = gnes_pb2.Message()
+            msg.envelope.num_part.extend([1, 3])
+            for _ in range(4):
+                msg.request.search.query.chunks.add()
+            for j in range(2):
+                pack_chunk_embeddings(msg.request.search.query, embeds[j])
+                c1.send_message(msg)
+
+            # the third part never arrives, the first two are reduced after the deadline
+            r = c1.recv_message()
+            self.assertTrue(r.envelope.is_partial)
+            self.assertSequenceEqual(r.envelope.num_part, [1])
+            np.testing.assert_allclose(unpack_chunk_embeddings(r.request.search.query)[0],
+                                       np.mean(embeds[:2], axis=0))
+            self.assertFalse(s._pending_state)
+
+            # the late part is dropped
+            pack_chunk_embeddings(msg.request.search.query, embeds[2])
+            c1.send_message(msg)
+            for _ in range(50):
+                if s.num_late_parts:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(s.num_late_parts, 1)
+            self.assertEqual(s.num_evicted_reduce, 1)
+            self.assertFalse(s._pending_state)
+
+            status = s.status
+            self.assertEqual(status.response.control.num_pending_reduce, 0)
+            self.assertEqual(status.response.control.num_evicted_reduce, 1)
+            self.assertEqual(status.response.control.num_late_parts, 1)
+            time.sleep(0.5)
+
     def test_multimap_multireduce(self):
         # p1 ->
         #      p21 ->
@@ -2,8 +2,11 @@ import json
 import unittest
 from pprint import pprint
 
+import numpy as np
+
 from gnes.proto import gnes_pb2
-from gnes.score_fn.base import get_unary_score, CombinedScoreFn, ModifierScoreFn
+from gnes.score_fn.base import get_unary_score, explain_score, render_explained, BaseScoreFn, CombinedScoreFn, \
+    ModifierScoreFn
 from gnes.score_fn.chunk import WeightedChunkScoreFn, WeightedChunkOffsetScoreFn, CoordChunkScoreFn, TFIDFChunkScoreFn, BM25ChunkScoreFn
 from gnes.score_fn.doc import CoordDocScoreFn
 from gnes.score_fn.normalize import Normalizer1, Normalizer2, Normalizer3, Normalizer4
@@ -19,7 +22,7 @@ class TestScoreFn(unittest.TestCase):
         a = get_unary_score(0.5)
         b = get_unary_score(0.7)
         print(a)
-        print(b.explained)
+        print(explain_score(b))
 
     def test_op(self):
         a = get_unary_score(0.5)
@@ -50,6 +53,46 @@ class TestScoreFn(unittest.TestCase):
             indexer.add(keys=[(0, 1), (1, 2)], vectors=np.array([[1, 1, 1], [2, 2, 2]]), weights=[0.5, 0.8])
             queried_result = indexer.query_and_score(q_chunks=[q_chunk], top_k=2)
 
+    def test_batch_score_fn(self):
+        from gnes.indexer.chunk.numpy import NumpyIndexer
+        from gnes.proto import array2blob
+        import numpy as np
+
+        q_chunks = []
+        for j in range(5):
+            c = gnes_pb2.Chunk()
+            c.weight = 0.1 * (j + 1)
+            c.offset = j
+            c.embedding.CopyFrom(array2blob(np.random.random(4)))
+            q_chunks.append(c)
+        keys = [(j // 3, j % 3) for j in range(30)]
+        vectors = np.random.random([30, 4])
+        weights = np.random.random(30).tolist()
+
+        for _fn in [WeightedChunkScoreFn, WeightedChunkOffsetScoreFn, CoordChunkScoreFn, TFIDFChunkScoreFn,
+                    BM25ChunkScoreFn]:
+            for _norm in [ModifierScoreFn(), Normalizer1(), Normalizer3(4)]:
+                indexer = NumpyIndexer(normalize_fn=_norm, score_fn=_fn())
+                indexer.add(keys=keys, vectors=vectors, weights=weights)
+                r1 = indexer.query_and_score(q_chunks=q_chunks, top_k=4)
+                r2 = indexer.query_and_score(q_chunks=q_chunks, top_k=4, explain=True)
+                self.assertEqual(len(r1), 20)
+                self.assertEqual([r.chunk for r in r1], [r.chunk for r in r2])
+                np.testing.assert_allclose([r.score.value for r in r1], [r.score.value for r in r2], rtol=1e-6)
+                self.assertFalse(any(r.score.name or r.score.operands for r in r1))
+                self.assertTrue(all(r.score.name for r in r2))
+
+        # a score function without batch_call falls back to the explained path
+        class _ScoreFn(ModifierScoreFn):
+            def __call__(self, last_score, *args, **kwargs):
+                return super().__call__(last_score)
+
+            batch_call = BaseScoreFn.batch_call
+
+        indexer = NumpyIndexer(score_fn=_ScoreFn())
+        indexer.add(keys=keys, vectors=vectors, weights=weights)
+        self.assertTrue(all(r.score.name for r in indexer.query_and_score(q_chunks=q_chunks, top_k=4)))
+
     def test_doc_combine_score_fn(self):
         from gnes.indexer.doc.dict import DictIndexer
 
@@ -96,6 +139,7 @@ class TestScoreFn(unittest.TestCase):
             s.chunk.doc_id = 1
 
             msg.envelope.num_part.extend([1, 2])
+            msg.response.search.is_big_score_similar = True
             c1.send_message(msg)
 
             msg.response.search.ClearField('topk_results')
@@ -119,35 +163,61 @@ class TestScoreFn(unittest.TestCase):
             doc_indexer = DictIndexer(score_fn=CoordDocScoreFn())
             doc_indexer.add(keys=document_id_list, docs=document_list)
 
+            self.assertEqual([x.score.num_operands for x in r.response.search.topk_results], [3, 2, 1])
+            r2 = gnes_pb2.Message()
+            r2.CopyFrom(r)
             queried_result = doc_indexer.query_and_score(docs=r.response.search.topk_results, top_k=2)
+            explained_result = doc_indexer.query_and_score(docs=r2.response.search.topk_results, explain=True)
+            # coordination = #chunks recalled / 3 chunks in each doc
+            np.testing.assert_allclose([x.score.value for x in queried_result],
+                                       [x.score.value for x in explained_result], rtol=1e-6)
+            self.assertAlmostEqual(queried_result[1].score.value, 0.4 * 2 / 3)
+
+    def test_render_explained(self):
+        q_chunk = gnes_pb2.Chunk()
+        q_chunk.weight = 0.5
+        d_chunk = gnes_pb2.Chunk()
+        d_chunk.weight = 0.7
+        # normalized relevance: 1 / (1 + sqrt(4))
+        c = WeightedChunkScoreFn()(Normalizer1()(get_unary_score(4, name='relevance')), q_chunk, d_chunk)
+        self.assertFalse(c.explained)
+        render_explained(c)
+        self.assertFalse(c.operands)
+        e = json.loads(c.explained)
+        self.assertAlmostEqual(e['value'], 0.35 / 3)
+        self.assertEqual(e['name'], 'WeightedChunkScoreFn')
+        self.assertEqual(e['docstring'], 'score = d_chunk.weight * relevance * q_chunk.weight')
+        self.assertEqual([o['name'] for o in e['operands']],
+                         ['Normalizer1', 'query chunk weight', 'document chunk weight'])
+        self.assertEqual(e['operands'][0]['operands'][0]['operands'][0]['name'], 'relevance')
 
     def test_normalizer(self):
         a = get_unary_score(0.5)
         norm_op = Normalizer1()
         b = norm_op(a)
-        pprint(json.loads(b.explained))
+        pprint(explain_score(b))
 
         a = get_unary_score(0.5)
         norm_op = Normalizer2(2)
         b = norm_op(a)
-        pprint(json.loads(b.explained))
+        pprint(explain_score(b))
         self.assertAlmostEqual(b.value, 0.8)
 
         a = get_unary_score(0.5)
         norm_op = Normalizer3(2)
         b = norm_op(a)
-        pprint(json.loads(b.explained))
+        pprint(explain_score(b))
         self.assertAlmostEqual(b.value, 0.7387961283389092)
 
         a = get_unary_score(0.5)
         norm_op = Normalizer4(2)
         b = norm_op(a)
-        pprint(json.loads(b.explained))
+        pprint(explain_score(b))
         self.assertEqual(b.value, 0.75)
 
         norm_op = ModifierScoreFn('none')
         b = norm_op(a)
-        pprint(json.loads(b.explained))
+        pprint(explain_score(b))
         self.assertEqual(b.value, 0.5)
 
         q_chunk = gnes_pb2.Chunk()
@@ -159,5 +229,5 @@ class TestScoreFn(unittest.TestCase):
         rel_score = get_unary_score(2)
         _op = WeightedChunkScoreFn()
         c = _op(rel_score, q_chunk, d_chunk)
-        pprint(json.loads(c.explained))
+        pprint(explain_score(c))
         self.assertAlmostEqual(c.value, 0.7)
@@ -5,7 +5,7 @@ import grpc
 
 from gnes.cli.parser import set_router_parser, set_frontend_parser, set_encoder_parser, set_indexer_parser
 from gnes.proto import gnes_pb2_grpc, RequestGenerator
-from gnes.service.base import ServiceManager, SocketType, ParallelType
+from gnes.service.base import ServiceManager, SocketType, ParallelType, ServiceError
 from gnes.service.frontend import FrontendService
 from gnes.service.indexer import IndexerService
 from gnes.service.router import RouterService
@@ -89,6 +89,21 @@ class TestServiceManager(unittest.TestCase):
             resp = stub.Call(list(RequestGenerator.query(b'abc', 1))[0])
             self.assertEqual(resp.request_id, 0)
 
+    def test_pipeline_workers(self):
+        a = set_router_parser().parse_args([
+            '--yaml_path', 'BaseRouter',
+            '--pipeline_workers', '2'
+        ])
+        # the handlers of the router are not declared thread-safe
+        self.assertRaises(ServiceError, ServiceManager, RouterService, a)
+
+        # a single worker is allowed
+        a = set_router_parser().parse_args([
+            '--yaml_path', 'BaseRouter',
+            '--pipeline_workers', '1'
+        ])
+        self.assertEqual(RouterService(a).args.pipeline_workers, 1)
+
     def test_external_module(self):
         args = set_encoder_parser().parse_args([
             '--yaml_path', os.path.join(self.dir_path, 'contrib', 'dummy.yml'),
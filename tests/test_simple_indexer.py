@@ -4,7 +4,8 @@ import unittest
 import numpy as np
 
 from gnes.helper import batch_iterator, TimeContext
-from gnes.indexer.chunk.helper import DictKeyIndexer, NumpyKeyIndexer, ListKeyIndexer, ListNumpyKeyIndexer
+from gnes.indexer.chunk.helper import DictKeyIndexer, NumpyKeyIndexer, ListKeyIndexer, ListNumpyKeyIndexer, \
+    GrowableArray, ColumnarKeyIndexer
 
 
 class TestProto(unittest.TestCase):
@@ -51,8 +52,91 @@ class TestProto(unittest.TestCase):
     def test_dict(self):
         self._test_any(DictKeyIndexer)
 
+    def test_columnar(self):
+        a = ColumnarKeyIndexer()
+        a.add(self.key_offset, self.weights)
+        self.assertEqual(a.num_chunks, self.num_sample)
+        self.assertEqual(a.num_docs, self.num_sample)
+        self.assertEqual(a.num_chunks_in_doc(self.key_offset[0][0]), 1)
+        self.assertEqual(a.num_chunks_in_doc(-1), 0)
+
+        res1 = a.query(self.query)
+        res2 = [(*self.key_offset[q], self.weights[q]) for q in self.query]
+        self.assertListEqual([r[:2] for r in res1], [r[:2] for r in res2])
+        np.testing.assert_allclose([r[2] for r in res1], [r[2] for r in res2], rtol=1e-6)
+
+        doc_ids, offsets, weights = a.query_columns(np.array(self.query))
+        self.assertEqual(doc_ids.dtype, np.uint64)
+        self.assertEqual(offsets.dtype, np.uint32)
+        self.assertEqual(weights.dtype, np.float32)
+
+        a.add([(0, 300), (0, 301)], [1., 1.])
+        self.assertEqual(a.num_docs, self.num_sample)
+        self.assertEqual(a.num_chunks_in_doc(0), 3)
+
+        a.dump(self.dump_path)
+        b = ColumnarKeyIndexer.load(self.dump_path)
+        self.assertListEqual(a.query(self.query), b.query(self.query))
+        self.assertEqual(b.num_chunks_in_doc(0), 3)
+
+    def test_growable_array(self):
+        a = GrowableArray(capacity=4)
+        self.assertEqual(a.capacity, 0)
+        self.assertIsNone(a.data)
+        for j in range(10):
+            a.append(np.full([3, 2], j, dtype=np.float32))
+        self.assertEqual(a.size, 30)
+        self.assertEqual(a.capacity, 32)
+        self.assertEqual(a.dtype, np.float32)
+        np.testing.assert_array_equal(a[-3:], np.full([3, 2], 9))
+        self.assertRaises(ValueError, a.append, np.zeros([2, 3]))
+
+        import pickle
+        b = pickle.loads(pickle.dumps(a))
+        self.assertEqual(b.capacity, 30)
+        np.testing.assert_array_equal(a.data, b.data)
+
+        a.shrink_to_fit()
+        self.assertEqual(a.capacity, 30)
+        np.testing.assert_array_equal(a.data, b.data)
+
+    def test_numpy_buffer_size(self):
+        a = NumpyKeyIndexer(buffer_size=100)
+        a.add(self.key_offset[:10], self.weights[:10])
+        self.assertEqual(a.capacity, 100)
+        a.add(self.key_offset[10:150], self.weights[10:150])
+        self.assertEqual(a.size, 150)
+        self.assertEqual(a.capacity, 200)
+        a.shrink_to_fit()
+        self.assertEqual(a.capacity, 150)
+
+    def test_numpy_empty_query(self):
+        a = NumpyKeyIndexer()
+        self.assertListEqual(a.query([]), [])
+        self.assertRaises(IndexError, a.query, [0])
+
+    def test_columnar_empty_query(self):
+        a = ColumnarKeyIndexer()
+        self.assertListEqual(a.query([]), [])
+        doc_ids, offsets, weights = a.query_columns(np.empty([2, 0], dtype=np.int64))
+        self.assertEqual(doc_ids.shape, (2, 0))
+        self.assertRaises(IndexError, a.query, [0])
+
+    def test_numpy_legacy_state(self):
+        import pickle
+        a = NumpyKeyIndexer()
+        # the state dumped by the earlier versions: a zero-padded ndarray and the number of filled rows
+        a._int2key_info = np.zeros([100, 3])
+        a._int2key_info[:10, 0:2] = self.key_offset[:10]
+        a._int2key_info[:10, 2] = self.weights[:10]
+        a._size, a._max_size, a._all_docs = 10, 100, []
+        b = pickle.loads(pickle.dumps(a))
+        self.assertEqual(b.size, 10)
+        b.add(self.key_offset[10:20], self.weights[10:20])
+        self.assertListEqual(b.query(list(range(20))), [(*self.key_offset[q], self.weights[q]) for q in range(20)])
+
     def test_bench_numpy_list(self):
-        for cls in [ListKeyIndexer, NumpyKeyIndexer, ListNumpyKeyIndexer, DictKeyIndexer]:
+        for cls in [ListKeyIndexer, NumpyKeyIndexer, ListNumpyKeyIndexer, DictKeyIndexer, ColumnarKeyIndexer]:
             a = cls()
             b_size = 1000
             with TimeContext('%s:add()' % cls.__name__):
@@ -1,7 +1,24 @@
 import os
 import unittest
+
 import numpy as np
+
 from gnes.encoder.numeric.vlad import VladEncoder
+from gnes.helper import TimeContext
+
+
+def _legacy_encode(model, vecs):
+    # the original loop of VladEncoder.encode, kept for the benchmark
+    knn_output = [model.kmeans_pred(vecs_) for vecs_ in vecs]
+    output = []
+    for chunk_count, chunk in enumerate(vecs):
+        res = np.zeros((model.centroids.shape[0], model.centroids.shape[1]))
+        for frame_count, frame in enumerate(chunk):
+            center_index = knn_output[chunk_count][frame_count]
+            res[center_index] += (frame - model.centroids[center_index])
+        res = res.reshape([-1])
+        output.append(res / np.sum(res ** 2) ** 0.5)
+    return np.array(output, dtype=np.float32)
 
 
 class TestVladEncoder(unittest.TestCase):
@@ -14,6 +31,43 @@ class TestVladEncoder(unittest.TestCase):
         if os.path.exists(self.dump_path):
             os.remove(self.dump_path)
 
+    def _get_model(self, num_clusters=20, num_dim=128, **kwargs):
+        # a model with random centroids, so that the tests do not need faiss for training
+        model = VladEncoder(num_clusters, **kwargs)
+        model.set_centroids(np.random.random([num_clusters, num_dim]).astype(np.float32))
+        model.is_trained = True
+        return model
+
+    def test_kmeans_pred(self):
+        model = self._get_model()
+        frames = model.centroids[[3, 0, 7]] + 1e-3
+        self.assertEqual(model.kmeans_pred(frames).tolist(), [3, 0, 7])
+
+    def test_vlad_encode(self):
+        model = self._get_model()
+        vecs = np.random.random([5, 30, 128]).astype(np.float32)
+        v = model.encode(vecs)
+        self.assertEqual(v.shape, (5, 20 * 128))
+        np.testing.assert_allclose(v, _legacy_encode(model, vecs), rtol=1e-4, atol=1e-6)
+
+        # chunks of different number of frames
+        ragged = [vecs[0, :10], vecs[1], vecs[2, :1]]
+        np.testing.assert_allclose(model.encode(ragged),
+                                   np.concatenate([_legacy_encode(model, [r]) for r in ragged]),
+                                   rtol=1e-4, atol=1e-6)
+
+        v = self._get_model(intra_norm=True, power_norm=True).encode(vecs)
+        np.testing.assert_allclose(np.linalg.norm(v, axis=1), 1, rtol=1e-5)
+
+    def test_bench_legacy(self):
+        model = self._get_model(num_clusters=64)
+        vecs = np.random.random([20, 500, 128]).astype(np.float32)
+        with TimeContext('legacy VladEncoder.encode()'):
+            v1 = _legacy_encode(model, vecs)
+        with TimeContext('vectorized VladEncoder.encode()'):
+            v2 = model.encode(vecs)
+        np.testing.assert_allclose(v1, v2, rtol=1e-4, atol=1e-6)
+
     def test_vlad_train(self):
         model = VladEncoder(20)
         model.train(self.mock_train_data)